@@ -1,7 +1,165 @@
 import flet as ft
+import asyncio
+import bisect
+import datetime
 import utils
+import thumbnails
+import history_index
 import os
 
+# ==========================================
+#      虚拟化瀑布流参数
+# ==========================================
+# 说明：
+#   缓存可能有上万张图，一次性为每张图创建 Container + Image 会卡死界面。
+#   这里按页从历史索引加载记录，卡片高度由索引里的宽高算出 (不用等图片解码)，
+#   每列只渲染视口附近的卡片，上下用等高的占位块撑开滚动高度；
+#   滚出范围的卡片放回该列的复用池，再滚进来的记录直接换图复用。
+HISTORY_PAGE_SIZE = 60       # 每次从索引加载的条数
+RENDER_MARGIN_SCREENS = 1.0  # 视口上下各多渲染的屏数
+SEARCH_DEBOUNCE = 0.3        # 搜索框停止输入多久后再查询 (秒)
+DATE_FILTERS = [             # (键, 文本, 天数)；0 天表示今天零点起
+    ("all", "全部时间", None),
+    ("today", "今天", 0),
+    ("7d", "最近7天", 7),
+    ("30d", "最近30天", 30),
+]
+CARD_GAP = 10                # 卡片间距 (与列间距一致)
+GRID_PADDING = 10            # 瀑布流左右 / 顶部内边距
+
+class HistoryItem:
+    """一条已加载的历史记录；查看器直接使用 src / original_src / data / is_downloaded"""
+    def __init__(self, entry, src):
+        self.original_src = entry["path"]
+        self.src = src # 显示用地址 (有缩略图时为缩略图)
+        self.data = entry["metadata"]
+        self.mtime = entry["mtime"]
+        self.width = entry.get("width")
+        self.height = entry.get("height")
+        self.is_downloaded = True
+        self.has_thumb = src != entry["path"]
+        self.column = None      # 所在列 (MasonryColumn)
+        self.top = 0.0          # 在列内的纵向位置
+        self.card_height = 0.0
+        self.card = None        # 当前绑定的卡片，不在视口附近时为 None
+
+    def aspect(self):
+        """高宽比 (未知尺寸按正方形，极端比例做限制)"""
+        if not self.width or not self.height: return 1.0
+        return min(4.0, max(0.25, self.height / self.width))
+
+class MasonryColumn:
+    def __init__(self, new_card):
+        """
+        :param new_card: 复用池为空时创建卡片的函数
+        """
+        self.new_card = new_card
+        self.items = []       # 本列的记录 (从上到下)
+        self.tops = []        # 与 items 对应的纵向位置，二分查找可见范围
+        self.total_height = 0.0
+        self.rendered = []    # 当前渲染了卡片的记录
+        self.pool = []        # 可复用的卡片 (已从页面上移除)
+        self.window = None
+        self.top_spacer = ft.Container(height=0)
+        self.bottom_spacer = ft.Container(height=0)
+        self.control = ft.Column(spacing=CARD_GAP, expand=True, alignment="start")
+
+    def insert(self, idx, item):
+        self.items.insert(idx, item)
+        item.column = self
+
+    def append(self, item, col_width):
+        """追加到列尾：直接累加位置，不必整列重算"""
+        item.column = self
+        item.top = self.total_height
+        item.card_height = col_width * item.aspect()
+        self.items.append(item)
+        self.tops.append(item.top)
+        self.total_height += item.card_height + CARD_GAP
+        self.window = None
+
+    def remove(self, item):
+        if item in self.items: self.items.remove(item)
+        if item in self.rendered:
+            self.rendered.remove(item)
+            self._release(item)
+        item.column = None
+
+    def layout(self, col_width):
+        """按列宽重新计算每条记录的位置与卡片高度"""
+        y = 0.0
+        self.tops = []
+        for item in self.items:
+            item.top = y
+            item.card_height = col_width * item.aspect()
+            self.tops.append(y)
+            y += item.card_height + CARD_GAP
+        self.total_height = y
+        self.window = None # 强制下一次 render 重建
+
+    def render(self, lo, hi):
+        """
+        只为 [lo, hi] 范围内的记录绑定卡片，其余用占位块代替
+        :return: 列的控件列表是否有变化
+        """
+        if not self.items:
+            changed = bool(self.control.controls)
+            for item in self.rendered: self._release(item)
+            self.rendered = []
+            self.control.controls = []
+            return changed
+
+        start = max(0, bisect.bisect_right(self.tops, lo) - 1)
+        if start < len(self.items) and self.tops[start] + self.items[start].card_height < lo: start += 1
+        end = max(start, bisect.bisect_right(self.tops, hi))
+        if self.window == (start, end): return False
+        self.window = (start, end)
+
+        visible = self.items[start:end]
+        keep = set(map(id, visible))
+        leaving = [item for item in self.rendered if id(item) not in keep]
+        for item in visible:
+            if item.card is None: self._bind(item)
+            else: item.card.height = item.card_height # 列宽变化后高度跟着变
+
+        if not visible:
+            # 整列都在范围外：一个占位块撑起整列高度
+            self.top_spacer.height = max(0.0, self.total_height - CARD_GAP)
+            controls = [self.top_spacer]
+        else:
+            controls = []
+            if start > 0:
+                self.top_spacer.height = max(0.0, self.tops[start] - CARD_GAP)
+                controls.append(self.top_spacer)
+            controls.extend(item.card for item in visible)
+            if end < len(self.items):
+                last = visible[-1]
+                self.bottom_spacer.height = max(0.0, self.total_height - 2 * CARD_GAP - (last.top + last.card_height))
+                controls.append(self.bottom_spacer)
+        self.control.controls = controls
+        self.rendered = visible
+
+        # 离开视口的卡片在本次更新之后才进入复用池，避免同一次更新里既移除又添加同一个控件
+        for item in leaving: self._release(item)
+        return True
+
+    def _bind(self, item):
+        card = self.pool.pop() if self.pool else self.new_card()
+        card.content.src = item.src
+        card.height = item.card_height
+        card.history_item = item
+        item.card = card
+
+    def _release(self, item):
+        card = item.card
+        if card is None: return
+        item.card = None
+        card.history_item = None
+        self.pool.append(card)
+
+    def cards(self):
+        return [item.card for item in self.rendered if item.card] + self.pool
+
 class History_View:
     def __init__(self, page: ft.Page, config: dict, viewer_callback):
         """
@@ -18,12 +176,26 @@ class History_View:
         self.theme_mode = config.get("theme_mode", "dark")
         
         # 内部状态
-        self.history_images_objs = [] # 存储图片对象，用于传递给查看器
+        self.history_images_objs = [] # 已加载的记录 (HistoryItem，最新的在前)，用于传递给查看器
         self.is_wide_mode = False
         self.current_columns = 3 # 默认3列
+        self.loaded = False # 首次打开历史页时加载第一页，之后只做增量更新
+        self.items_by_path = {} # 路径 -> HistoryItem
+        self.columns = [] # MasonryColumn
+        self.exhausted = False # 索引里的记录是否已全部加载
+        self.layout_thumb_width = thumbnails.GRID_THUMB_WIDTH
+        self.view_width = page.width or 1200
+        self.scroll_pixels = 0.0
+        self.viewport_height = page.height or 800
+        self.filters = {} # 当前搜索条件 (text / model / size / since)
+        self.search_seq = 0 # 搜索框输入序号，用于防抖
+        self.load_seq = 0 # 已加载列表的版本号 (换搜索条件时递增)，查询返回时据此丢弃过期结果
+        self.page_loading = False # 是否正在查询下一页
         
         # 初始化 UI
         self._init_components()
+        # 新生成的图片写入缓存 / 被淘汰时增量更新卡片
+        utils.add_history_listener(self._on_history_changed)
 
     def _init_components(self):
         # 1. 主滚动容器 (瀑布流的载体)
@@ -46,9 +218,31 @@ class History_View:
             controls=[self.masonry_wrapper],
             scroll=ft.ScrollMode.AUTO,
             expand=True,
-            spacing=0
+            spacing=0,
+            on_scroll=self._on_scroll, # 按滚动位置加载下一页 / 回收卡片
+            on_scroll_interval=100
         )
         
+        # 1.5 搜索栏 (提示词全文搜索 + 模型 / 尺寸 / 日期筛选)
+        self.search_field = ft.TextField(
+            hint_text="搜索提示词 / 模型...", text_size=13, height=40, expand=True,
+            prefix_icon="search", content_padding=ft.padding.symmetric(horizontal=10, vertical=0),
+            border_radius=8, bgcolor="transparent", border_color=utils.get_border_color(self.theme_mode), border_width=1,
+            on_change=self._on_search_change, on_submit=lambda e: self.page.run_task(self._apply_filters)
+        )
+        self.model_filter = self._make_filter_dropdown([ft.dropdown.Option("all", "全部模型")], width=180)
+        self.size_filter = self._make_filter_dropdown([ft.dropdown.Option("all", "全部尺寸")], width=130)
+        self.date_filter = self._make_filter_dropdown([ft.dropdown.Option(k, t) for k, t, _ in DATE_FILTERS], width=120)
+        self.search_bar = ft.Container(
+            content=ft.Row([
+                self.search_field,
+                self.model_filter.associated_container,
+                self.size_filter.associated_container,
+                self.date_filter.associated_container
+            ], spacing=8),
+            padding=ft.padding.only(left=10, right=10, top=10)
+        )
+
         # 2. 空状态提示
         self.empty_text = ft.Text("暂无本次会话的历史记录", color="grey", size=14, visible=False)
         self.empty_icon = ft.Icon("history_toggle_off", color="grey", size=40, visible=False)
@@ -69,7 +263,7 @@ class History_View:
             icon="refresh", 
             icon_color="white",
             bgcolor=self.primary_color, 
-            on_click=lambda e: self.refresh_history(),
+            on_click=lambda e: self.page.run_task(self.refresh_history),
             tooltip="刷新历史记录"
         )
         
@@ -99,11 +293,29 @@ class History_View:
 
         # 4. 主容器
         self.content = ft.Stack([
-            self.scroll_container,
-            self.empty_container,
+            ft.Column([
+                self.search_bar,
+                ft.Stack([self.scroll_container, self.empty_container], expand=True)
+            ], spacing=0, expand=True),
             self.control_bar
         ], expand=True)
 
+    def _make_filter_dropdown(self, options, width):
+        """筛选下拉框 (外面包一层带边框的容器，挂在 associated_container 上)"""
+        dropdown = ft.Dropdown(
+            options=options, value="all", text_size=13, content_padding=ft.padding.only(left=10, right=10, bottom=5),
+            border_color="transparent", border_width=0,
+            fill_color=utils.get_dropdown_bgcolor(self.theme_mode),
+            bgcolor=utils.get_dropdown_fill_color(self.theme_mode),
+            focused_bgcolor=ft.Colors.TRANSPARENT, expand=True,
+            on_change=lambda e: self.page.run_task(self._apply_filters)
+        )
+        dropdown.associated_container = ft.Container(
+            content=dropdown, height=40, width=width, border=ft.border.all(1, utils.get_border_color(self.theme_mode)),
+            border_radius=8, alignment=ft.alignment.center_left
+        )
+        return dropdown
+
     def get_content(self):
         """返回主视图控件"""
         return self.content
@@ -117,82 +329,314 @@ class History_View:
         
         if cols != self.current_columns:
             self.current_columns = cols
-            self.refresh_history() # 重新布局
+            self._relayout() # 重新分列 (复用已有卡片)
 
-    def refresh_history(self):
+    async def refresh_history(self):
         """读取本地缓存并刷新界面 (瀑布流布局)"""
-        paths = utils.get_cached_history()
-        
-        self.history_images_objs = [] # 清空旧引用
-        self.masonry_row.controls.clear() # 清空旧布局
-        
-        if not paths:
-            self.empty_container.visible = True
-            self.empty_text.visible = True
-            self.empty_icon.visible = True
-            self.scroll_container.visible = False
-            self.scroll_container.update()
-            self.empty_container.update()
+        await self._refresh_filter_options()
+        if not self.loaded:
+            # 首次打开：建立列并加载第一页
+            self.loaded = True
+            self._build_columns()
+            await self._load_next_page()
+            self._update_view()
             return
 
-        self.empty_container.visible = False
-        self.scroll_container.visible = True
-        
-        # 1. 创建 N 个列容器
-        columns = [ft.Column(spacing=10, expand=True, alignment="start") for _ in range(self.current_columns)]
-        
-        # 2. 遍历图片并分发到列中
-        for idx, path in enumerate(paths):
-            # 尝试快速读取元数据
-            meta = None
-            try:
-                with open(path, "rb") as f:
-                    file_bytes = f.read()
-                    meta = utils.extract_metadata_from_png(file_bytes)
+        # 之后的刷新只与已加载范围对账：更新的记录插到最上面，已删除的移除，其余卡片保持不动
+        # 查询多取一页，避免新记录把已加载的尾部挤出查询范围而被误删
+        seq = self.load_seq
+        window = await utils.get_history_entries(limit=len(self.history_images_objs) + HISTORY_PAGE_SIZE, **self.filters)
+        if seq != self.load_seq: return # 查询期间换了搜索条件
+        current = {entry["path"] for entry in window}
+        oldest = self.history_images_objs[-1].mtime if self.history_images_objs else 0
+        added = [entry for entry in window if entry["path"] not in self.items_by_path and entry["mtime"] >= oldest]
+        removed = [path for path in self.items_by_path if path not in current]
+        self._apply_changes(added, removed)
+
+    def _on_history_changed(self, added, removed):
+        """缓存写入 / 淘汰后的增量通知 (见 utils.notify_history_changed)"""
+        if not self.loaded: return # 还没打开过历史页，首次打开时再加载
+        if self.filters: added = [entry for entry in added if history_index.matches(entry, **self.filters)]
+        self._apply_changes(added, removed)
+
+    # ================= 搜索与筛选 =================
+
+    def _on_search_change(self, e):
+        """输入防抖：停止输入一小段时间后再查询"""
+        self.search_seq += 1
+        self.page.run_task(self._debounced_search, self.search_seq)
+
+    async def _debounced_search(self, seq):
+        await asyncio.sleep(SEARCH_DEBOUNCE)
+        if seq == self.search_seq: await self._apply_filters()
+
+    def _current_filters(self):
+        filters = {}
+        text = (self.search_field.value or "").strip()
+        if text: filters["text"] = text
+        if self.model_filter.value and self.model_filter.value != "all":
+            filters["model"] = self.model_filter.value
+        if self.size_filter.value and self.size_filter.value != "all":
+            try: filters["size"] = tuple(int(v) for v in self.size_filter.value.split("x"))
+            except ValueError: pass
+        days = dict((k, d) for k, _, d in DATE_FILTERS).get(self.date_filter.value)
+        if days is not None:
+            start = datetime.datetime.combine(datetime.date.today(), datetime.time.min) - datetime.timedelta(days=days)
+            filters["since"] = start.timestamp()
+        return filters
+
+    async def _apply_filters(self):
+        """搜索条件变化：清空已加载的记录，按新条件从第一页重新加载"""
+        filters = self._current_filters()
+        if filters == self.filters: return
+        self.filters = filters
+        if not self.loaded: return
+        self.load_seq += 1
+        self.page_loading = False # 旧条件下还没返回的查询作废
+        self.history_images_objs = []
+        self.items_by_path = {}
+        self.exhausted = False
+        self.scroll_pixels = 0.0
+        self._build_columns()
+        await self._load_next_page()
+        self._update_view()
+        try: self.scroll_container.scroll_to(offset=0, duration=0)
+        except: pass
+
+    async def _refresh_filter_options(self):
+        """按索引里实际出现的模型 / 尺寸刷新筛选项 (保留当前选择)"""
+        facets = await utils.get_history_facets()
+        model_options = [(m, m.split("/")[-1]) for m in facets["models"]]
+        size_options = [(f"{w}x{h}", f"{w}×{h}") for w, h in facets["sizes"]]
+        for dropdown, all_text, options in ((self.model_filter, "全部模型", model_options), (self.size_filter, "全部尺寸", size_options)):
+            keys = [key for key, _ in options]
+            if dropdown.value not in keys and dropdown.value != "all":
+                options.append((dropdown.value, dropdown.value)) # 当前选择的项暂时没有图片，也保留
+            dropdown.options = [ft.dropdown.Option("all", all_text)] + [ft.dropdown.Option(k, t) for k, t in options]
+            try: dropdown.update()
             except: pass
-            
-            # 创建图片控件
-            img = ft.Image(
-                src=path,
-                fit=ft.ImageFit.CONTAIN, 
-                border_radius=10,
-                gapless_playback=True,
-                animate_opacity=300,
-                expand=True # 宽度填满列
-            )
-            
-            # 挂载数据
-            img.data = meta
-            img.is_downloaded = True 
-            
-            self.history_images_objs.append(img)
-            
-            # 包装卡片
-            card = ft.Container(
-                content=img,
-                border_radius=10,
-                on_click=lambda e, i=img: self._on_image_click(i),
-                clip_behavior=ft.ClipBehavior.HARD_EDGE,
-                shadow=ft.BoxShadow(blur_radius=5, color=ft.Colors.with_opacity(0.1, "black")),
-                bgcolor=utils.get_dropdown_bgcolor(self.theme_mode) # 给个底色防止透明图看起来怪
-            )
-            
-            # 简单的轮询分发 (Round-Robin)
-            target_col = idx % self.current_columns
-            columns[target_col].controls.append(card)
-            
-        # 3. 将列添加到 Row 中
-        self.masonry_row.controls = columns
-        
-        self.masonry_row.update()
-        self.scroll_container.update()
-        self.empty_container.update()
 
-    def _on_image_click(self, clicked_img):
+    # ================= 分页加载 =================
+
+    async def _load_next_page(self):
+        """从索引加载下一页 (查询在磁盘池中执行)，逐条追加到当前最短的一列"""
+        if self.exhausted or self.page_loading: return
+        self.page_loading = True
+        seq = self.load_seq
+        try:
+            entries = await utils.get_history_entries(limit=HISTORY_PAGE_SIZE, offset=len(self.history_images_objs), **self.filters)
+        finally:
+            if seq == self.load_seq: self.page_loading = False
+        if seq != self.load_seq: return # 查询期间换了搜索条件，结果已过期
+        if len(entries) < HISTORY_PAGE_SIZE: self.exhausted = True
+
+        new_items = []
+        col_width = self._column_width()
+        for entry in entries:
+            if entry["path"] in self.items_by_path: continue
+            item = self._new_item(entry)
+            self._shortest_column().append(item, col_width)
+            self.history_images_objs.append(item)
+            new_items.append(item)
+        if not new_items: return
+        self._render()
+        self._schedule_thumbnails([item for item in new_items if not item.has_thumb])
+
+    def _new_item(self, entry):
+        """登记一条记录；还没有缩略图的先显示原图，后台生成后替换"""
+        path = entry["path"]
+        item = HistoryItem(entry, thumbnails.thumbnail_path(path, self._thumb_width()) or path)
+        self.items_by_path[path] = item
+        return item
+
+    # ================= 布局 =================
+
+    def _column_width(self):
+        cols = self.current_columns
+        return max(1.0, (self.view_width - 2 * GRID_PADDING - CARD_GAP * (cols - 1)) / cols)
+
+    def _thumb_width(self):
+        return self._column_width()
+
+    def _new_card(self):
+        """创建一张可复用的卡片 (绑定的记录挂在 card.history_item 上)"""
+        img = ft.Image(
+            src="",
+            fit=ft.ImageFit.CONTAIN, 
+            border_radius=10,
+            gapless_playback=True,
+            animate_opacity=300,
+            expand=True # 宽度填满列
+        )
+        card = ft.Container(
+            content=img,
+            border_radius=10,
+            clip_behavior=ft.ClipBehavior.HARD_EDGE,
+            shadow=ft.BoxShadow(blur_radius=5, color=ft.Colors.with_opacity(0.1, "black")),
+            bgcolor=utils.get_dropdown_bgcolor(self.theme_mode) # 给个底色防止透明图看起来怪
+        )
+        card.history_item = None
+        card.on_click = lambda e, c=card: self._on_image_click(c.history_item)
+        return card
+
+    def _shortest_column(self):
+        """
+        最短列优先 (而不是轮询)：横竖图混排时各列高度保持接近
+        卡片高度来自索引里的宽高 (只读文件头)，不需要解码图片
+        """
+        return min(self.columns, key=lambda c: c.total_height)
+
+    def _build_columns(self):
+        """按当前列数新建列，已加载的记录依次放进最短列 (记录与卡片都复用，不重新创建)"""
+        loaded = set(map(id, self.history_images_objs))
+        spare = [] # 旧列复用池里的卡片，以及已不在列表中的记录 (如换了搜索条件) 占着的卡片
+        for col in self.columns:
+            spare.extend(col.pool)
+            for item in col.rendered:
+                if item.card is not None and id(item) not in loaded:
+                    item.card.history_item = None
+                    spare.append(item.card)
+                    item.card = None
+            col.control.controls = []
+
+        self.columns = [MasonryColumn(self._new_card) for _ in range(self.current_columns)]
+        col_width = self._column_width()
+        for item in self.history_images_objs:
+            self._shortest_column().append(item, col_width)
+        # 已绑定卡片的记录随记录一起进入新列，由下一次 render 决定保留还是回收到新列的复用池
+        for col in self.columns:
+            col.rendered = [item for item in col.items if item.card is not None]
+        for i, card in enumerate(spare):
+            self.columns[i % len(self.columns)].pool.append(card)
+        self.masonry_row.controls = [col.control for col in self.columns]
+        self.layout_thumb_width = thumbnails.pick_width(self._thumb_width())
+
+    def _relayout(self):
+        """列数变化：已加载的记录重新分列"""
+        if not self.loaded:
+            self.page.run_task(self.refresh_history)
+            return
+        old_width = self.layout_thumb_width
+        self._build_columns()
+        self._render(full=True)
+        # 列变宽时换用更大一档的缩略图
+        if self.layout_thumb_width > old_width:
+            self._schedule_thumbnails(list(self.history_images_objs))
+
+    def _apply_changes(self, added, removed):
+        """
+        增量增删记录，只更新受影响的列
+        :param added: 索引记录列表 (最新的在前)；已加载的路径 (重复保存) 移到最上面
+        :param removed: 已不存在的文件路径
+        """
+        if not self.columns: self._build_columns()
+        col_width = self._column_width()
+        dirty = {} # id(列) -> 列
+        for path in removed:
+            item = self.items_by_path.pop(path, None)
+            if item is not None: self._detach(item, dirty)
+        # 先重算被移除 / 移走记录的列，最短列的判断才准确
+        for col in dirty.values(): col.layout(col_width)
+
+        new_items = []
+        for entry in reversed(added): # 从旧到新依次插到顶部，最新的在最上面
+            item = self.items_by_path.get(entry["path"])
+            if item is not None:
+                old_col = item.column
+                self._detach(item, dirty)
+                if old_col is not None: old_col.layout(col_width)
+                item.data = entry["metadata"]
+                item.mtime = entry["mtime"]
+            else:
+                item = self._new_item(entry)
+                if not item.has_thumb: new_items.append(item)
+            col = self._shortest_column()
+            col.insert(0, item)
+            col.layout(col_width)
+            self.history_images_objs.insert(0, item)
+            dirty[id(col)] = col
+
+        if not dirty: return
+        self._render()
+        self._schedule_thumbnails(new_items)
+
+    def _detach(self, item, dirty):
+        col = item.column
+        if col is not None:
+            col.remove(item)
+            dirty[id(col)] = col
+        if item in self.history_images_objs: self.history_images_objs.remove(item)
+
+    # ================= 视口渲染 =================
+
+    def _on_scroll(self, e):
+        self.scroll_pixels = e.pixels or 0.0
+        if e.viewport_dimension: self.viewport_height = e.viewport_dimension
+        self._render()
+
+    def _render(self, full=False):
+        """
+        每列只保留视口上下各一屏范围内的卡片；列表底部进入这个范围时加载下一页
+        :param full: 列对象整体换过 (列数变化)，需要更新整个瀑布流
+        """
+        margin = self.viewport_height * RENDER_MARGIN_SCREENS
+        lo = self.scroll_pixels - GRID_PADDING - margin
+        hi = self.scroll_pixels - GRID_PADDING + self.viewport_height + margin
+        changed = [col for col in self.columns if col.render(lo, hi)]
+        if full: self._update_view()
+        elif changed: self._update_view([col.control for col in changed])
+
+        # 最短的一列已经露底：继续加载 (_load_next_page 会再次调用 _render，直到填满或加载完)
+        if not (self.exhausted or self.page_loading) and self.columns and min(col.total_height for col in self.columns) < hi:
+            self.page.run_task(self._load_next_page)
+
+    def _update_view(self, columns=None):
+        """
+        刷新显示：空状态切换或整体重排时更新整个瀑布流，否则只更新变化的列
+        :param columns: 变化的列控件；为 None 表示整体重排
+        """
+        is_empty = not self.history_images_objs
+        self.empty_text.value = "没有符合条件的记录" if self.filters else "暂无本次会话的历史记录"
+        toggled = self.scroll_container.visible == is_empty
+        self.empty_container.visible = is_empty
+        self.empty_text.visible = is_empty
+        self.empty_icon.visible = is_empty
+        self.scroll_container.visible = not is_empty
+        try:
+            if columns is None or toggled:
+                self.masonry_row.update()
+                self.scroll_container.update()
+                self.empty_container.update()
+            else:
+                for col in columns: col.update()
+        except: pass # 历史页尚未挂载到页面上
+
+    # ================= 缩略图 =================
+
+    def _schedule_thumbnails(self, items):
+        if items: self.page.run_task(self._fill_thumbnails, items, self._thumb_width())
+
+    async def _fill_thumbnails(self, items, width, chunk=16):
+        """后台补齐缺失的缩略图，每生成一批就替换正在显示的卡片"""
+        for start in range(0, len(items), chunk):
+            # 已被移除的记录不再处理
+            group = [item for item in items[start:start + chunk] if self.items_by_path.get(item.original_src) is item]
+            if not group: continue
+            thumbs = await asyncio.gather(*[thumbnails.ensure_thumbnail(item.original_src, width) for item in group])
+            for item, thumb in zip(group, thumbs):
+                if thumb == item.original_src or thumb == item.src: continue
+                item.src = thumb
+                item.has_thumb = True
+                if item.card is not None:
+                    item.card.content.src = thumb
+                    try: item.card.content.update()
+                    except: pass
+
+    def _on_image_click(self, item):
         """点击图片，调用主程序的查看器"""
-        if clicked_img in self.history_images_objs:
-            idx = self.history_images_objs.index(clicked_img)
-            self.viewer_callback(clicked_img.src, self.history_images_objs, idx)
+        if item in self.history_images_objs:
+            idx = self.history_images_objs.index(item)
+            self.viewer_callback(thumbnails.original_src(item), self.history_images_objs, idx)
 
     def update_theme(self, primary_color, theme_mode):
         """响应主题切换"""
@@ -207,27 +651,41 @@ class History_View:
         self.control_bar.bgcolor = utils.get_dropdown_bgcolor(theme_mode)
         self.control_bar.border = ft.border.all(1, utils.get_border_color(theme_mode))
         
+        # 更新搜索栏
+        self.search_field.border_color = utils.get_border_color(theme_mode)
+        for dropdown in (self.model_filter, self.size_filter, self.date_filter):
+            dropdown.fill_color = utils.get_dropdown_bgcolor(theme_mode)
+            dropdown.bgcolor = utils.get_dropdown_fill_color(theme_mode)
+            dropdown.associated_container.border = ft.border.all(1, utils.get_border_color(theme_mode))
+        
         # 更新图标颜色
         text_color = utils.get_text_color(theme_mode)
         self.control_bar.content.controls[0].color = text_color
         self.control_bar.content.controls[2].color = text_color
         
-        # 更新现有卡片的底色
-        if self.masonry_row.controls:
-            for col in self.masonry_row.controls:
-                for card in col.controls:
-                    card.bgcolor = utils.get_dropdown_bgcolor(theme_mode)
+        # 更新现有卡片 (含复用池里的) 的底色
+        for col in self.columns:
+            for card in col.cards():
+                card.bgcolor = utils.get_dropdown_bgcolor(theme_mode)
         
         try: 
             self.refresh_btn.update()
             self.control_bar.update()
+            self.search_bar.update()
             self.masonry_row.update()
         except: pass
 
     def on_resize(self, is_wide, w, h):
         """响应式布局"""
         self.is_wide_mode = is_wide
-        pass
+        if h: self.viewport_height = h
+        # 宽度变化会改变卡片高度，需要重新计算各列位置
+        if w and abs(w - self.view_width) > 1:
+            self.view_width = w
+            if self.loaded:
+                col_width = self._column_width()
+                for col in self.columns: col.layout(col_width)
+                self._render()
 
     def set_grid_columns(self, cols):
         """兼容接口"""
@@ -235,4 +693,4 @@ class History_View:
         self.current_columns = cols
         self.size_slider.value = cols
         self.size_slider.update()
-        self.refresh_history()
\ No newline at end of file
+        self._relayout()
\ No newline at end of file
@@ -1,16 +1,17 @@
 import flet as ft
-import requests
-import json
 import asyncio
-import random
 import os
 import utils  # 引入公共工具模块
+import gen_engine  # 无 UI 的生图引擎
+import executors  # 网络 / 磁盘 / 图片编解码 分类执行器
+import thumbnails  # 缩略图 (网格显示用)
+import gen_view  # T2I / I2I 共用的批次与结果区逻辑
 
 # ==========================================
 #      I2I 功能模块封装 (去布局版)
 # ==========================================
 
-class I2I_View:
+class I2I_View(gen_view.GenBatchMixin):
     def __init__(self, page: ft.Page, config: dict, viewer_callback, switch_view_callback, transfer_callback=None):
         """
         :param page: Flet Page 对象
@@ -32,10 +33,10 @@ class I2I_View:
         self.theme_mode = config.get("theme_mode", "dark")
         self.stored_custom_models = config.get("custom_models", "")
         self.power_config = config.get("power_mode_config", {}) # 新增：强力模式配置
+        self._init_batch_state() # 共用引擎与批次 / 结果区状态 (见 gen_view.GenBatchMixin)
 
         # 内部状态
         self.is_wide_mode = False
-        self.generated_images_objs = []
         self.uploaded_files = [] # 存储本地文件路径列表
 
         # 常量定义
@@ -77,8 +78,8 @@ class I2I_View:
         return self.page1_scroll_col
 
     def get_generate_btn(self):
-        """返回生成按钮，供 Main_App 放置在底部固定栏"""
-        return self.generate_btn
+        """返回生成按钮 (含暂停/停止)，供 Main_App 放置在底部固定栏"""
+        return self.generate_bar
 
     def get_results_content(self):
         """返回结果展示 Grid"""
@@ -114,6 +115,8 @@ class I2I_View:
         
         # --- 强力模式逻辑：更新 Slider 最大值 ---
         is_power_mode = self.power_config.get("enabled", False)
+        stream_total = self._stream_total(is_power_mode)
+        self.batch_slider.disabled = bool(stream_total) # 流式批量的张数由强力模式配置决定
         
         if is_power_mode:
             # 强力模式下，最大值由配置决定 (1-50)
@@ -126,7 +129,7 @@ class I2I_View:
 
             # 【修改点】更新左侧标题样式
             if hasattr(self, 'batch_row'):
-                self.batch_row.controls[0].value = "⚡ 强力"
+                self.batch_row.controls[0].value = "⚡ 流式" if stream_total else "⚡ 强力"
                 self.batch_row.controls[0].color = "red"
                 self.batch_row.controls[0].weight = "bold"
         else:
@@ -149,7 +152,7 @@ class I2I_View:
         if self.batch_slider.value > new_max: 
             self.batch_slider.value = new_max
             
-        self.batch_val_text.value = str(int(self.batch_slider.value))
+        self.batch_val_text.value = str(stream_total or int(self.batch_slider.value))
         
         # 强制刷新一下界面以应用文字变化
         try: self.batch_row.update()
@@ -164,6 +167,8 @@ class I2I_View:
         
         # 1. 更新生成按钮
         self.generate_btn.bgcolor = primary_color
+        self.pause_btn.icon_color = primary_color
+        if self.queue_priority == gen_engine.PRIORITY_NORMAL: self.priority_btn.icon_color = primary_color
         
         # 2. 更新 Slider 
         # 【修改点】判断强力模式，防止主题切换覆盖红色警示
@@ -324,8 +329,8 @@ class I2I_View:
             [
              ft.IconButton("content_paste", icon_size=16, tooltip="读取剪贴板元数据", on_click=self._process_clipboard_metadata),
              ft.IconButton("folder_open", icon_size=16, tooltip="读取元数据文件", on_click=lambda _: self.meta_file_picker.pick_files(allow_multiple=False, allowed_extensions=["png"])),
-             ft.IconButton("language", icon_size=16, tooltip="转英文", on_click=lambda e: self._handle_translate(e, self.prompt_input, "en")),
-             ft.IconButton("translate", icon_size=16, tooltip="转中文", on_click=lambda e: self._handle_translate(e, self.prompt_input, "zh"))
+             ft.IconButton("language", icon_size=16, tooltip="转英文", on_click=lambda e: self.page.run_task(self._handle_translate, e, self.prompt_input, "en")),
+             ft.IconButton("translate", icon_size=16, tooltip="转中文", on_click=lambda e: self.page.run_task(self._handle_translate, e, self.prompt_input, "zh"))
             ], right=5, bottom=2, opacity=0, animate_opacity=300, visible=False 
         )
 
@@ -346,8 +351,8 @@ class I2I_View:
 
         self.neg_trans_row = ft.Row(
             [
-             ft.IconButton("language", icon_size=16, tooltip="转英文", on_click=lambda e: self._handle_translate(e, self.neg_prompt_input, "en")),
-             ft.IconButton("translate", icon_size=16, tooltip="转中文", on_click=lambda e: self._handle_translate(e, self.neg_prompt_input, "zh"))
+             ft.IconButton("language", icon_size=16, tooltip="转英文", on_click=lambda e: self.page.run_task(self._handle_translate, e, self.neg_prompt_input, "en")),
+             ft.IconButton("translate", icon_size=16, tooltip="转中文", on_click=lambda e: self.page.run_task(self._handle_translate, e, self.neg_prompt_input, "zh"))
             ], right=5, bottom=2, opacity=0, animate_opacity=300, visible=False 
         )
 
@@ -380,9 +385,23 @@ class I2I_View:
 
         # 6. 生成按钮
         self.generate_btn = ft.ElevatedButton(
-            "开始编辑", icon="auto_fix_high", bgcolor=self.primary_color, color="white", height=50, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=12)), width=float("inf"),
+            "开始编辑", icon="auto_fix_high", bgcolor=self.primary_color, color="white", height=50, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=12)), expand=True,
             on_click=self._run_gen
         )
+        # 批次控制：暂停 (挂起未提交的任务) / 停止 (取消整批)，仅在生成过程中显示
+        self.pause_btn = ft.IconButton(icon="pause", icon_color=self.primary_color, tooltip="暂停提交", visible=False, on_click=self._toggle_pause_batch)
+        self.stop_btn = ft.IconButton(icon="stop", icon_color="red", tooltip="停止全部", visible=False, on_click=self._stop_batch)
+        # 队列优先级：生成中也可以继续点击生成，新批次按优先级进入全局队列
+        self.priority_btn = ft.PopupMenuButton(
+            icon="low_priority", icon_color=self.primary_color, tooltip="队列优先级: 普通",
+            items=[
+                ft.PopupMenuItem(text="高优先级 (插队)", on_click=lambda e: self._set_queue_priority(gen_engine.PRIORITY_HIGH)),
+                ft.PopupMenuItem(text="普通", on_click=lambda e: self._set_queue_priority(gen_engine.PRIORITY_NORMAL)),
+                ft.PopupMenuItem(text="低优先级 (空闲时)", on_click=lambda e: self._set_queue_priority(gen_engine.PRIORITY_LOW)),
+            ]
+        )
+        self.stream_progress_text = ft.Text("", size=11, color="grey", visible=False, tooltip="流式批量进度 (已结束/总数)")
+        self.generate_bar = ft.Row([self.generate_btn, self.stream_progress_text, self.priority_btn, self.pause_btn, self.stop_btn], spacing=5, vertical_alignment="center")
 
         # 7. 结果区域
         self.results_grid = ft.GridView(expand=True, runs_count=None, max_extent=350, child_aspect_ratio=1.0, spacing=10, run_spacing=10, padding=10)
@@ -446,10 +465,15 @@ class I2I_View:
                 pass
             return
 
+        missing_thumbs = [] # 还没有缩略图的上传文件，渲染完后在后台生成
         if not is_multi_mode:
             # 单图模式
             file_path = self.uploaded_files[0]
-            img_view = ft.Image(src=file_path, fit=ft.ImageFit.CONTAIN, border_radius=8)
+            thumb_width = thumbnails.GRID_THUMB_WIDTH
+            thumb = thumbnails.thumbnail_path(file_path, thumb_width)
+            if not thumb: missing_thumbs.append(file_path)
+            img_view = ft.Image(src=thumb or file_path, fit=ft.ImageFit.CONTAIN, border_radius=8)
+            img_view.original_src = file_path
             clear_btn = ft.Container(
                 content=ft.IconButton(icon="close", icon_size=20, icon_color="red", on_click=lambda e: self._remove_image(0)),
                 top=5, right=5
@@ -462,8 +486,12 @@ class I2I_View:
         else:
             # 多图模式
             thumbs = []
+            thumb_width = thumbnails.PREVIEW_THUMB_WIDTH
             for i, path in enumerate(self.uploaded_files):
-                img_thumb = ft.Image(src=path, fit=ft.ImageFit.COVER, width=100, height=100, border_radius=8)
+                thumb = thumbnails.thumbnail_path(path, thumb_width)
+                if not thumb: missing_thumbs.append(path)
+                img_thumb = ft.Image(src=thumb or path, fit=ft.ImageFit.COVER, width=100, height=100, border_radius=8)
+                img_thumb.original_src = path
                 rm_btn = ft.Container(
                     content=ft.IconButton(icon="close", icon_size=16, icon_color="white", on_click=lambda e, idx=i: self._remove_image(idx)),
                     bgcolor="#88000000", border_radius=15, width=24, height=24, top=2, right=2
@@ -494,6 +522,15 @@ class I2I_View:
             self.upload_content_container.update()
         except:
             pass
+        if missing_thumbs:
+            try: self.page.run_task(self._load_upload_thumbnails, missing_thumbs, thumb_width)
+            except Exception as e: print(f"Thumbnail schedule error: {e}")
+
+    async def _load_upload_thumbnails(self, paths, width):
+        """后台生成上传图片的缩略图，有新生成的才重绘上传区 (重绘时直接命中缓存)"""
+        thumbs = await asyncio.gather(*[thumbnails.ensure_thumbnail(p, width) for p in paths])
+        if any(t != p for p, t in zip(paths, thumbs)) and any(p in self.uploaded_files for p in paths):
+            self._update_upload_area()
 
     def _remove_image(self, idx):
         if 0 <= idx < len(self.uploaded_files):
@@ -570,6 +607,15 @@ class I2I_View:
             self.page.update()
             return
 
+        # 参数、模型与待上传图片在点击时取一次快照，上传期间及之后修改界面不影响这一批
+        current_model = self.model_dropdown.value
+        params = self._snapshot_params(current_model)
+        upload_files = list(self.uploaded_files)
+        upload_dims = None
+        try: upload_dims = utils.get_image_size(upload_files[0])
+        except Exception as ex: print(f"Size detection failed: {ex}")
+
+        # 仅在上传期间禁用按钮 (避免重复上传)，任务提交后即可继续排队下一批
         self.generate_btn.disabled = True
         self.generate_btn.text = "上传图片中..."
         self.generate_btn.update()
@@ -580,11 +626,9 @@ class I2I_View:
 
         try:
             if target_size == "AutoSize":
-                if self.uploaded_files:
-                    # 尝试读取第一张图片的尺寸
-                    dims = utils.get_image_size(self.uploaded_files[0])
-                    if dims and dims[1] != 0: 
-                        aspect_ratio = dims[0] / dims[1]
+                # 使用第一张图片的尺寸
+                if upload_dims and upload_dims[1] != 0: 
+                    aspect_ratio = upload_dims[0] / upload_dims[1]
             else:
                 # 兼容 "928x1664 (竖屏)" 这种带后缀的格式
                 clean_size = target_size.split()[0] 
@@ -602,12 +646,11 @@ class I2I_View:
 
         # 2. 上传图片
         image_url_param = None
-        current_model = self.model_dropdown.value
         is_multi = current_model in self.MODELS_REQUIRING_LIST_INPUT
 
         try:
             uploaded_urls = []
-            for path in self.uploaded_files:
+            for path in upload_files:
                 url = await utils.upload_image_to_host(path)
                 if url: uploaded_urls.append(url)
                 else: raise Exception(f"上传失败: {os.path.basename(path)}")
@@ -626,173 +669,45 @@ class I2I_View:
         if not self.is_wide_mode and self.switch_view_callback:
             self.switch_view_callback(1)
             
-        self.generate_btn.text = "任务提交中..."
-        self.generate_btn.update()
-
-        # 3. 准备任务
-        batch_count = int(self.batch_slider.value)
-        self.results_grid.controls.clear()
-        self.generated_images_objs = []
-        
-        tasks_ui = []
-        for i in range(batch_count):
-            # 注意：此处解构增加了 btn_edit
-            card, img, status, btn_dl, btn_info, btn_browser, btn_edit = self._create_result_card_ui()
-            self.results_grid.controls.append(card)
-            self.generated_images_objs.append(img)
-            tasks_ui.append((img, status, btn_dl, btn_info, btn_browser, btn_edit))
-        
-        self.results_grid.update()
-
-        # 4. 执行生成
-        tasks = []
-        for i in range(batch_count):
-            # 循环使用 Key
-            key_to_use = keys_to_use[i % len(keys_to_use)]
-            tasks.append(asyncio.create_task(
-                self._generate_single_image(i, key_to_use, tasks_ui[i], image_url_param, current_model)
-            ))
-            # 【新增】可配置的延时，防止触发 QPS 限制
-            delay_time = float(self.power_config.get("request_delay", 0.2))
-            await asyncio.sleep(delay_time)
-        
-        await asyncio.gather(*tasks, return_exceptions=True)
         self.generate_btn.disabled = False
         self.generate_btn.text = "开始编辑"
         self.generate_btn.update()
 
-    async def _generate_single_image(self, idx, api_key, ui_refs, image_url_val, model_val):
-        img_ref, status_ref, dl_ref, info_ref, browser_ref, edit_ref = ui_refs
-        
-        def toggle_ring(visible):
-            if hasattr(status_ref, "associated_ring"):
-                status_ref.associated_ring.visible = visible
-                try: status_ref.associated_ring.update()
-                except: pass
-
-        try:
-            toggle_ring(True)
-            status_ref.value = "提交中..."
-            status_ref.color = self.primary_color
-            status_ref.update()
-
-            headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-            
-            raw_seed = self.seed_input.value
-            try: seed_val = int(raw_seed) if raw_seed.strip() else -1
-            except: seed_val = -1
-            if seed_val == -1: seed_val = random.randint(1, 10000000)
-            current_seed = seed_val + idx
-
-            payload = {
-                "model": model_val,
-                "image_url": image_url_val, 
-                "prompt": self.prompt_input.value,
-                "negative_prompt": self.neg_prompt_input.value,
-                "num_inference_steps": int(self.steps_val_text.value), 
-                "guidance_scale": float(self.guidance_val_text.value),
-                "num_images_per_prompt": 1, 
-                "seed": current_seed
-            }
-            if self.size_dropdown.value != "AutoSize":
-                payload["size"] = self.size_dropdown.value
-
-            def do_post():
-                return requests.post(
-                    f"{utils.BASE_URL}v1/images/generations",
-                    headers={**headers, "X-ModelScope-Async-Mode": "true"},
-                    data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
-                    timeout=20
-                )
-            
-            res = await asyncio.to_thread(do_post)
-            res.raise_for_status()
-            task_id = res.json().get("task_id")
-            if not task_id: raise Exception("无TaskID")
-
-            for _ in range(60):
-                await asyncio.sleep(2)
-                def do_poll():
-                    return requests.get(
-                        f"{utils.BASE_URL}v1/tasks/{task_id}", 
-                        headers={**headers, "X-ModelScope-Task-Type": "image_generation"}, 
-                        timeout=10
-                    )
-                res_poll = await asyncio.to_thread(do_poll)
-                data = res_poll.json()
-                raw_status = data.get("task_status")
-                
-                if raw_status == "SUCCEED":
-                    toggle_ring(False)
-                    output_images = data.get("output_images", [])
-                    if not output_images and "results" in data: output_images = data["results"]
-                    
-                    if output_images:
-                        final_url = output_images[0].get("url", output_images[0]) if isinstance(output_images[0], dict) else output_images[0]
-                        
-                        # 构建包含尺寸信息的元数据
-                        final_meta = payload.copy()
-                        final_meta["task_type"] = "image-edit"
-                        if "size" not in final_meta and self.uploaded_files:
-                            try:
-                                dims = utils.get_image_size(self.uploaded_files[0])
-                                if dims:
-                                    final_meta["size"] = f"{dims[0]}x{dims[1]}"
-                            except Exception as e:
-                                print(f"Size injection failed: {e}")
-
-                        # =================【关键修改】自动缓存逻辑 =================
-                        status_ref.value = "缓存中..."
-                        status_ref.update()
-
-                        # 下载并保存到临时缓存
-                        local_cache_path = await utils.save_to_cache(final_url, final_meta)
-
-                        if local_cache_path:
-                            # 缓存成功，使用本地路径
-                            img_ref.src = local_cache_path
-                        else:
-                            # 降级：使用远程链接
-                            img_ref.src = final_url
-
-                        img_ref.data = final_meta
-                        
-                        img_ref.visible = True
-                        info_ref.visible = True
-                        edit_ref.visible = True 
-                        
-                        if self.is_wide_mode:
-                            dl_ref.visible = True
-                            browser_ref.visible = False
-                        else:
-                            dl_ref.visible = False
-                            browser_ref.visible = True
-                        
-                        status_ref.value = ""
-                        img_ref.update()
-                        dl_ref.update()
-                        info_ref.update()
-                        browser_ref.update()
-                        edit_ref.update()
-                        status_ref.update()
-
-                        # 记录 API Key 使用次数
-                        await utils.increment_api_usage(self.page, api_key)
-
-                    return True
-                elif raw_status == "FAILED": raise Exception(data.get("message", "API Error"))
-                else:
-                    status_ref.value = f"{utils.STATUS_TRANSLATIONS.get(raw_status, raw_status)}..."
-                    status_ref.update()
-            raise Exception("超时")
-
-        except Exception as e:
-            toggle_ring(False)
-            status_ref.value = "失败"
-            status_ref.tooltip = str(e)
-            status_ref.color = "red"
-            status_ref.update()
-            return False
+        # 3. 准备任务 (每次点击都是一个新批次，进入 T2I / I2I 共用的全局队列)
+        params["image_url"] = image_url_param
+        meta = self._build_meta(params, upload_dims)
+        def build_job(i, ctx):
+            payload = self._build_payload(params, i)
+            return gen_engine.GenJob(payload, keys_to_use, meta=dict(meta, seed=payload["seed"]), context=ctx)
+        await self._run_batch(params["prompt"], keys_to_use, is_power_mode, build_job)
+
+    def _snapshot_params(self, model_val):
+        """读取当前界面参数 (点击生成时调用一次)，种子为 None 表示每张随机，image_url 上传完成后补上"""
+        raw_seed = self.seed_input.value
+        try: seed_val = int(raw_seed) if raw_seed.strip() else -1
+        except: seed_val = -1
+
+        params = {
+            "model": model_val,
+            "image_url": None, 
+            "prompt": self.prompt_input.value,
+            "negative_prompt": self.neg_prompt_input.value,
+            "num_inference_steps": int(self.steps_val_text.value), 
+            "guidance_scale": float(self.guidance_val_text.value),
+            "num_images_per_prompt": 1, 
+            "seed": None if seed_val == -1 else seed_val
+        }
+        if self.size_dropdown.value != "AutoSize":
+            params["size"] = self.size_dropdown.value
+        return params
+
+    def _build_meta(self, params, upload_dims=None):
+        """构建包含尺寸信息的元数据 (AutoSize 时使用点击时第一张上传图片的尺寸)"""
+        final_meta = params.copy()
+        final_meta["task_type"] = "image-edit"
+        if "size" not in final_meta and upload_dims:
+            final_meta["size"] = f"{upload_dims[0]}x{upload_dims[1]}"
+        return final_meta
 
     def _create_result_card_ui(self):
         # 🟢 修正点：改为 COVER，强制填满卡片，消除边缘留白
@@ -802,9 +717,19 @@ class I2I_View:
         loading_ring = ft.ProgressRing(width=25, height=25, stroke_width=3, color=self.primary_color)
         status_text = ft.Text(f"排队中...", size=11, color=self.primary_color, text_align="center")
         status_text.associated_ring = loading_ring 
+        # 单卡取消按钮 (on_click 在创建任务后绑定)
+        btn_cancel = ft.IconButton(icon="close", icon_color="grey", icon_size=16, tooltip="取消此任务")
+        status_text.associated_cancel_btn = btn_cancel
+        # 结果缓存命中角标 (命中时显示)
+        cache_badge = ft.Container(
+            content=ft.Text("⚡ 缓存", size=10, color="white"), bgcolor=utils.get_opacity_color(0.45, "black"),
+            padding=ft.padding.symmetric(horizontal=6, vertical=2), border_radius=8,
+            right=4, top=4, visible=False, tooltip="相同参数已生成过，直接使用本地缓存 (未消耗额度)"
+        )
+        status_text.associated_cache_badge = cache_badge
 
         loading_col = ft.Column(
-            controls=[loading_ring, ft.Container(height=5), status_text],
+            controls=[loading_ring, ft.Container(height=5), status_text, btn_cancel],
             alignment=ft.MainAxisAlignment.CENTER, horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=0
         )
 
@@ -841,14 +766,14 @@ class I2I_View:
         async def on_edit_click(e):
             if img.src and self.transfer_callback:
                 # 调用传入的回调函数，将图片URL回传
-                await self.transfer_callback(img.src)
+                await self.transfer_callback(thumbnails.original_src(img))
 
         btn_edit.on_click = on_edit_click
 
         async def on_browser_click(e):
             if img.src:
                 meta = getattr(img, "data", None)
-                success = await utils.download_via_local_server(self.page, img.src, meta)
+                success = await utils.download_via_local_server(self.page, thumbnails.original_src(img), meta)
                 if success:
                     img.is_downloaded = True
                     # 1. 强制更新当前点击的按钮
@@ -864,7 +789,7 @@ class I2I_View:
                 meta = getattr(img, "data", None)
                 # 使用 I2I 文件夹
                 # 如果 img.src 已经是本地缓存，utils 内部会自动处理为复制操作
-                success = await utils.save_image_to_local_folder(self.page, img.src, utils.I2I_FOLDER, meta)
+                success = await utils.save_image_to_local_folder(self.page, thumbnails.original_src(img), utils.I2I_FOLDER, meta)
                 if success:
                     img.is_downloaded = True
                     # 1. 强制更新当前点击的按钮
@@ -889,7 +814,7 @@ class I2I_View:
         
         card_stack = ft.Stack([
             ft.Container(content=loading_col, alignment=ft.alignment.center, bgcolor=utils.get_opacity_color(0.05, "black"), border_radius=10, expand=True),
-            img_container, meta_overlay, ft.Container(content=action_bar, right=0, bottom=0) 
+            img_container, meta_overlay, ft.Container(content=action_bar, right=0, bottom=0), cache_badge
         ], expand=True)
 
         card = ft.Container(content=card_stack, bgcolor="transparent", border_radius=10, clip_behavior=ft.ClipBehavior.HARD_EDGE)
@@ -908,7 +833,7 @@ class I2I_View:
         if clicked_img in valid_imgs:
             idx = valid_imgs.index(clicked_img)
             # 仅将有效列表传递给查看器
-            self.viewer_callback(clicked_img.src, valid_imgs, idx)
+            self.viewer_callback(thumbnails.original_src(clicked_img), valid_imgs, idx)
 
     def _mark_btn_downloaded(self, btn):
         btn.icon = "check_circle"
@@ -1000,7 +925,7 @@ class I2I_View:
             if isinstance(content, list): # 复制的是文件
                 for path in content:
                     if path.lower().endswith('.png'):
-                        with open(path, "rb") as f: meta = utils.extract_metadata_from_png(f.read())
+                        meta = utils.read_metadata_from_file(path)
                         if meta: break
             elif content: # 复制的是图片位图
                 self.page.snack_bar = ft.SnackBar(ft.Text("仅支持复制PNG文件读取元数据，不支持直接复制图片内容"), open=True)
@@ -1038,10 +963,11 @@ class I2I_View:
             self.page.snack_bar = ft.SnackBar(ft.Text("✅ 已读取元数据"), open=True)
             self.page.update()
 
-    def _handle_translate(self, e, field, lang):
+    async def _handle_translate(self, e, field, lang):
         text = field.value
         if text:
-            res = utils.translate_text(self.page, text, self.baidu_config.get("appid"), self.baidu_config.get("key"), lang)
+            # 同步的翻译请求放到网络执行器，不占用事件循环
+            res = await executors.run_net(utils.translate_text, self.page, text, self.baidu_config.get("appid"), self.baidu_config.get("key"), lang)
             if res:
                 field.value = res
                 field.update()
@@ -1049,7 +975,7 @@ class I2I_View:
     def _apply_metadata_from_path(self, path):
         if not path: return
         try:
-            with open(path, 'rb') as f: meta = utils.extract_metadata_from_png(f.read())
+            meta = utils.read_metadata_from_file(path)
             if meta and isinstance(meta, dict):
                 if "prompt" in meta: self.prompt_input.value = meta["prompt"]
                 if "negative_prompt" in meta: self.neg_prompt_input.value = meta["negative_prompt"]
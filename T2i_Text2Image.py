@@ -1,15 +1,16 @@
 import flet as ft
-import requests
-import json
 import asyncio
-import random
 import utils  # 引入公共工具模块
+import gen_engine  # 无 UI 的生图引擎
+import executors  # 网络 / 磁盘 / 图片编解码 分类执行器
+import thumbnails  # 缩略图 (网格显示用)
+import gen_view  # T2I / I2I 共用的批次与结果区逻辑
 
 # ==========================================
 #      T2I 功能模块封装 (去布局版)
 # ==========================================
 
-class T2I_View:
+class T2I_View(gen_view.GenBatchMixin):
     def __init__(self, page: ft.Page, config: dict, viewer_callback, switch_view_callback, transfer_callback=None):
         """
         :param page: Flet Page 对象
@@ -31,10 +32,10 @@ class T2I_View:
         self.theme_mode = config.get("theme_mode", "dark")
         self.stored_custom_models = config.get("custom_models", "")
         self.power_config = config.get("power_mode_config", {}) # 新增：强力模式配置
+        self._init_batch_state() # 共用引擎与批次 / 结果区状态 (见 gen_view.GenBatchMixin)
 
         # 内部状态
         self.is_wide_mode = False
-        self.generated_images_objs = [] # 存储结果Grid中的Image对象，用于传递给查看器
 
         # 常量定义
         self.DEFAULT_MODEL_OPTIONS = [
@@ -67,8 +68,8 @@ class T2I_View:
         return self.page1_scroll_col
 
     def get_generate_btn(self):
-        """返回生成按钮，供 Main_App 放置在底部固定栏"""
-        return self.generate_btn
+        """返回生成按钮 (含暂停/停止)，供 Main_App 放置在底部固定栏"""
+        return self.generate_bar
 
     def get_results_content(self):
         """返回结果展示 Grid"""
@@ -90,6 +91,9 @@ class T2I_View:
         # --- 强力模式逻辑：更新 Slider 最大值与视觉样式 ---
         is_power_mode = self.power_config.get("enabled", False)
         
+        stream_total = self._stream_total(is_power_mode)
+        self.batch_slider.disabled = bool(stream_total) # 流式批量的张数由强力模式配置决定
+        
         if is_power_mode:
             # 强力模式下，最大值由配置决定 (1-50)
             new_max = int(self.power_config.get("batch_size", 10))
@@ -101,7 +105,7 @@ class T2I_View:
             
             # 【修改点】更新左侧标题样式
             if hasattr(self, 'batch_row'):
-                self.batch_row.controls[0].value = "⚡ 强力"
+                self.batch_row.controls[0].value = "⚡ 流式" if stream_total else "⚡ 强力"
                 self.batch_row.controls[0].color = "red"
                 self.batch_row.controls[0].weight = "bold"
         else:
@@ -124,7 +128,7 @@ class T2I_View:
         if self.batch_slider.value > new_max: 
             self.batch_slider.value = new_max
         
-        self.batch_val_text.value = str(int(self.batch_slider.value))
+        self.batch_val_text.value = str(stream_total or int(self.batch_slider.value))
         
         # 强制刷新一下 Batch Row 以显示文字变化
         try: self.batch_row.update()
@@ -140,6 +144,8 @@ class T2I_View:
         
         # 1. 更新生成按钮
         self.generate_btn.bgcolor = primary_color
+        self.pause_btn.icon_color = primary_color
+        if self.queue_priority == gen_engine.PRIORITY_NORMAL: self.priority_btn.icon_color = primary_color
         
         # 2. 更新 Slider 颜色
         # 【修改点】判断强力模式，防止主题切换覆盖红色警示
@@ -284,8 +290,8 @@ class T2I_View:
             [
              ft.IconButton("content_paste", icon_size=16, tooltip="读取剪贴板元数据", on_click=self._process_clipboard_metadata),
              ft.IconButton("folder_open", icon_size=16, tooltip="读取元数据文件", on_click=lambda _: self.meta_file_picker.pick_files(allow_multiple=False, allowed_extensions=["png"])),
-             ft.IconButton("language", icon_size=16, tooltip="转英文", on_click=lambda e: self._handle_translate(e, self.prompt_input, "en")),
-             ft.IconButton("translate", icon_size=16, tooltip="转中文", on_click=lambda e: self._handle_translate(e, self.prompt_input, "zh"))
+             ft.IconButton("language", icon_size=16, tooltip="转英文", on_click=lambda e: self.page.run_task(self._handle_translate, e, self.prompt_input, "en")),
+             ft.IconButton("translate", icon_size=16, tooltip="转中文", on_click=lambda e: self.page.run_task(self._handle_translate, e, self.prompt_input, "zh"))
             ], right=5, bottom=2, opacity=0, animate_opacity=300, visible=False 
         )
 
@@ -304,8 +310,8 @@ class T2I_View:
 
         self.neg_trans_row = ft.Row(
             [
-             ft.IconButton("language", icon_size=16, tooltip="转英文", on_click=lambda e: self._handle_translate(e, self.neg_prompt_input, "en")),
-             ft.IconButton("translate", icon_size=16, tooltip="转中文", on_click=lambda e: self._handle_translate(e, self.neg_prompt_input, "zh"))
+             ft.IconButton("language", icon_size=16, tooltip="转英文", on_click=lambda e: self.page.run_task(self._handle_translate, e, self.neg_prompt_input, "en")),
+             ft.IconButton("translate", icon_size=16, tooltip="转中文", on_click=lambda e: self.page.run_task(self._handle_translate, e, self.neg_prompt_input, "zh"))
             ], right=5, bottom=2, opacity=0, animate_opacity=300, visible=False 
         )
 
@@ -339,9 +345,23 @@ class T2I_View:
 
         # 6. 生成按钮
         self.generate_btn = ft.ElevatedButton(
-            "开始生成", icon="brush", bgcolor=self.primary_color, color="white", height=50, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=12)), width=float("inf"),
+            "开始生成", icon="brush", bgcolor=self.primary_color, color="white", height=50, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=12)), expand=True,
             on_click=self._run_gen
         )
+        # 批次控制：暂停 (挂起未提交的任务) / 停止 (取消整批)，仅在生成过程中显示
+        self.pause_btn = ft.IconButton(icon="pause", icon_color=self.primary_color, tooltip="暂停提交", visible=False, on_click=self._toggle_pause_batch)
+        self.stop_btn = ft.IconButton(icon="stop", icon_color="red", tooltip="停止全部", visible=False, on_click=self._stop_batch)
+        # 队列优先级：生成中也可以继续点击生成，新批次按优先级进入全局队列
+        self.priority_btn = ft.PopupMenuButton(
+            icon="low_priority", icon_color=self.primary_color, tooltip="队列优先级: 普通",
+            items=[
+                ft.PopupMenuItem(text="高优先级 (插队)", on_click=lambda e: self._set_queue_priority(gen_engine.PRIORITY_HIGH)),
+                ft.PopupMenuItem(text="普通", on_click=lambda e: self._set_queue_priority(gen_engine.PRIORITY_NORMAL)),
+                ft.PopupMenuItem(text="低优先级 (空闲时)", on_click=lambda e: self._set_queue_priority(gen_engine.PRIORITY_LOW)),
+            ]
+        )
+        self.stream_progress_text = ft.Text("", size=11, color="grey", visible=False, tooltip="流式批量进度 (已结束/总数)")
+        self.generate_bar = ft.Row([self.generate_btn, self.stream_progress_text, self.priority_btn, self.pause_btn, self.stop_btn], spacing=5, vertical_alignment="center")
 
         # 7. 结果区域
         self.results_grid = ft.GridView(expand=True, runs_count=None, max_extent=350, child_aspect_ratio=1.0, spacing=10, run_spacing=10, padding=10)
@@ -414,154 +434,28 @@ class T2I_View:
             self.results_grid.child_aspect_ratio = aspect_ratio
         except: self.results_grid.child_aspect_ratio = 1.0
         
-        self.generate_btn.disabled = True
-        self.generate_btn.update()
-        
-        batch_count = int(self.batch_slider.value)
-        self.results_grid.controls.clear()
-        self.generated_images_objs = [] # 清空数据引用
-        
-        tasks_ui = []
-        for i in range(batch_count):
-            # 注意：此处解构增加了 btn_edit
-            card, img, status, btn_dl, btn_info, btn_browser, btn_edit = self._create_result_card_ui()
-            self.results_grid.controls.append(card)
-            # 存下 Image 对象引用用于查看器
-            self.generated_images_objs.append(img)
-            tasks_ui.append((img, status, btn_dl, btn_info, btn_browser, btn_edit))
-        
-        self.results_grid.update()
-        
-        # 异步生成
-        tasks = []
-        for i in range(batch_count):
-            # 循环取 Key
-            key_to_use = keys_to_use[i % len(keys_to_use)]
-            
-            tasks.append(asyncio.create_task(self._generate_single_image(i, key_to_use, tasks_ui[i])))
-            
-            # 【新增】可配置的延时，防止触发 QPS 限制
-            delay_time = float(self.power_config.get("request_delay", 0.2))
-            await asyncio.sleep(delay_time)
-        
-        await asyncio.gather(*tasks, return_exceptions=True)
-        self.generate_btn.disabled = False
-        self.generate_btn.update()
-
-    async def _generate_single_image(self, idx, api_key, ui_refs):
-        img_ref, status_ref, dl_ref, info_ref, browser_ref, edit_ref = ui_refs
-        
-        def toggle_ring(visible):
-            if hasattr(status_ref, "associated_ring"):
-                status_ref.associated_ring.visible = visible
-                try: status_ref.associated_ring.update()
-                except: pass
-
-        try:
-            toggle_ring(True)
-            status_ref.value = "提交中..."
-            status_ref.color = self.primary_color
-            status_ref.update()
-            
-            headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-            
-            # Seed 处理
-            raw_seed = self.seed_input.value
-            try: seed_val = int(raw_seed) if raw_seed.strip() else -1
-            except ValueError: seed_val = -1
-            if seed_val == -1: seed_val = random.randint(1, 10000000)
-            current_seed = seed_val + idx 
-
-            payload = {
-                "model": self.model_dropdown.value, 
-                "prompt": self.prompt_input.value, 
-                "negative_prompt": self.neg_prompt_input.value,
-                "size": self.size_dropdown.value, 
-                "num_inference_steps": int(self.steps_val_text.value),  
-                "guidance_scale": float(self.guidance_val_text.value),  
-                "seed": current_seed
-            }
-
-            def do_post():
-                return requests.post(f"{utils.BASE_URL}v1/images/generations", headers={**headers, "X-ModelScope-Async-Mode": "true"}, data=json.dumps(payload, ensure_ascii=False).encode('utf-8'), timeout=20)
-            
-            res = await asyncio.to_thread(do_post)
-            res.raise_for_status()
-            task_id = res.json().get("task_id")
-            if not task_id: raise Exception("无TaskID")
-
-            for _ in range(60): 
-                await asyncio.sleep(2)
-                def do_poll():
-                    return requests.get(f"{utils.BASE_URL}v1/tasks/{task_id}", headers={**headers, "X-ModelScope-Task-Type": "image_generation"}, timeout=10)
-                res_poll = await asyncio.to_thread(do_poll)
-                data = res_poll.json()
-                raw_status = data.get("task_status")
-                
-                if raw_status == "SUCCEED":
-                    toggle_ring(False)
-                    output_images = data.get("output_images", [])
-                    if output_images:
-                        remote_url = output_images[0]
-                        
-                        # =================【关键修改】自动缓存逻辑 =================
-                        status_ref.value = "缓存中..."
-                        status_ref.update()
-                        
-                        # 下载并保存到临时缓存，注入元数据
-                        local_cache_path = await utils.save_to_cache(remote_url, payload)
-                        
-                        if local_cache_path:
-                            # 如果缓存成功，显示本地路径
-                            img_ref.src = local_cache_path
-                        else:
-                            # 降级：如果缓存失败，显示远程链接
-                            img_ref.src = remote_url
-                        
-                        # 无论哪种情况，数据对象都挂载上去
-                        img_ref.data = payload 
-                        img_ref.visible = True
-                        
-                        # 注意：虽然在缓存里，但对于“下载到 T2I 文件夹”这个按钮来说，它还没“下载”
-                        # 但为了体验，我们不自动禁用下载按钮，让用户决定是否保存到 T2I
-                        img_ref.is_downloaded = False
-                        
-                        info_ref.visible = True
-                        edit_ref.visible = True 
-                        
-                        # 更新下载按钮可见性
-                        if self.is_wide_mode:
-                            dl_ref.visible = True
-                            browser_ref.visible = False
-                        else:
-                            dl_ref.visible = False
-                            browser_ref.visible = True
-
-                        status_ref.value = "" 
-                        img_ref.update()
-                        dl_ref.update()
-                        info_ref.update()
-                        browser_ref.update()
-                        edit_ref.update()
-                        status_ref.update()
-                        
-                        # 记录 API Key 使用次数
-                        await utils.increment_api_usage(self.page, api_key)
-                        
-                    return True
-                elif raw_status == "FAILED": raise Exception(data.get("message", "API Error"))
-                else:
-                    status_ref.value = f"{utils.STATUS_TRANSLATIONS.get(raw_status, raw_status)}..." 
-                    status_ref.update()
-            raise Exception("超时")
-
-        except Exception as e:
-            toggle_ring(False)
-            status_ref.value = "失败"
-            status_ref.tooltip = str(e)
-            status_ref.color = "red"
-            status_ref.update()
-            return False
+        # 参数在点击时取一次快照，之后修改界面不影响这一批 (流式批量尤其会持续很久)
+        params = self._snapshot_params()
+        def build_job(i, ctx):
+            return gen_engine.GenJob(self._build_payload(params, i), keys_to_use, context=ctx)
+        await self._run_batch(params["prompt"], keys_to_use, is_power_mode, build_job)
+
+    def _snapshot_params(self):
+        """读取当前界面参数 (点击生成时调用一次)，种子为 None 表示每张随机"""
+        # Seed 处理
+        raw_seed = self.seed_input.value
+        try: seed_val = int(raw_seed) if raw_seed.strip() else -1
+        except ValueError: seed_val = -1
+
+        return {
+            "model": self.model_dropdown.value, 
+            "prompt": self.prompt_input.value, 
+            "negative_prompt": self.neg_prompt_input.value,
+            "size": self.size_dropdown.value, 
+            "num_inference_steps": int(self.steps_val_text.value),  
+            "guidance_scale": float(self.guidance_val_text.value),  
+            "seed": None if seed_val == -1 else seed_val
+        }
 
     def _create_result_card_ui(self):
         img = ft.Image(src="", fit=ft.ImageFit.CONTAIN, visible=False, expand=True, animate_opacity=300, border_radius=10)
@@ -570,9 +464,19 @@ class T2I_View:
         loading_ring = ft.ProgressRing(width=25, height=25, stroke_width=3, color=self.primary_color)
         status_text = ft.Text(f"排队中...", size=11, color=self.primary_color, text_align="center")
         status_text.associated_ring = loading_ring 
+        # 单卡取消按钮 (on_click 在创建任务后绑定)
+        btn_cancel = ft.IconButton(icon="close", icon_color="grey", icon_size=16, tooltip="取消此任务")
+        status_text.associated_cancel_btn = btn_cancel
+        # 结果缓存命中角标 (命中时显示)
+        cache_badge = ft.Container(
+            content=ft.Text("⚡ 缓存", size=10, color="white"), bgcolor=utils.get_opacity_color(0.45, "black"),
+            padding=ft.padding.symmetric(horizontal=6, vertical=2), border_radius=8,
+            right=4, top=4, visible=False, tooltip="相同参数已生成过，直接使用本地缓存 (未消耗额度)"
+        )
+        status_text.associated_cache_badge = cache_badge
 
         loading_col = ft.Column(
-            controls=[loading_ring, ft.Container(height=5), status_text],
+            controls=[loading_ring, ft.Container(height=5), status_text, btn_cancel],
             alignment=ft.MainAxisAlignment.CENTER, horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=0
         )
 
@@ -609,7 +513,7 @@ class T2I_View:
         async def on_edit_click(e):
             if img.src and self.transfer_callback:
                 # 调用传入的回调函数，将图片URL发送过去
-                await self.transfer_callback(img.src)
+                await self.transfer_callback(thumbnails.original_src(img))
         
         btn_edit.on_click = on_edit_click
 
@@ -617,7 +521,7 @@ class T2I_View:
         async def on_browser_click(e):
             if img.src:
                 meta = getattr(img, "data", None)
-                success = await utils.download_via_local_server(self.page, img.src, meta)
+                success = await utils.download_via_local_server(self.page, thumbnails.original_src(img), meta)
                 if success:
                     img.is_downloaded = True
                     # 1. 强制更新当前点击的按钮 (确保反应)
@@ -633,7 +537,7 @@ class T2I_View:
                 meta = getattr(img, "data", None)
                 # 调用 utils.save_image_to_local_folder
                 # 由于 img.src 现在是本地路径，utils 内部会自动处理为 copy 操作
-                success = await utils.save_image_to_local_folder(self.page, img.src, utils.T2I_FOLDER, meta)
+                success = await utils.save_image_to_local_folder(self.page, thumbnails.original_src(img), utils.T2I_FOLDER, meta)
                 if success:
                     img.is_downloaded = True
                     # 1. 强制更新当前点击的按钮
@@ -659,7 +563,7 @@ class T2I_View:
         
         card_stack = ft.Stack([
             ft.Container(content=loading_col, alignment=ft.alignment.center, bgcolor=utils.get_opacity_color(0.05, "black"), border_radius=10, expand=True),
-            img_container, meta_overlay, ft.Container(content=action_bar, right=0, bottom=0) 
+            img_container, meta_overlay, ft.Container(content=action_bar, right=0, bottom=0), cache_badge
         ], expand=True)
 
         card = ft.Container(content=card_stack, bgcolor="transparent", border_radius=10, clip_behavior=ft.ClipBehavior.HARD_EDGE)
@@ -678,7 +582,7 @@ class T2I_View:
         if clicked_img in valid_imgs:
             idx = valid_imgs.index(clicked_img)
             # 仅将有效列表传递给查看器，避免显示红框报错
-            self.viewer_callback(clicked_img.src, valid_imgs, idx)
+            self.viewer_callback(thumbnails.original_src(clicked_img), valid_imgs, idx)
 
     def _mark_btn_downloaded(self, btn):
         btn.icon = "check_circle"
@@ -770,10 +674,11 @@ class T2I_View:
         row.visible = False
         row.update()
 
-    def _handle_translate(self, e, field, lang):
+    async def _handle_translate(self, e, field, lang):
         text = field.value
         if text:
-            res = utils.translate_text(self.page, text, self.baidu_config.get("appid"), self.baidu_config.get("key"), lang)
+            # 同步的翻译请求放到网络执行器，不占用事件循环
+            res = await executors.run_net(utils.translate_text, self.page, text, self.baidu_config.get("appid"), self.baidu_config.get("key"), lang)
             if res:
                 field.value = res
                 field.update()
@@ -786,7 +691,7 @@ class T2I_View:
             if isinstance(content, list): # 文件列表
                 for path in content:
                     if path.lower().endswith('.png'):
-                        with open(path, "rb") as f: meta = utils.extract_metadata_from_png(f.read())
+                        meta = utils.read_metadata_from_file(path)
                         if meta: break
             elif content: # 图片对象
                 self.page.snack_bar = ft.SnackBar(ft.Text("仅支持复制PNG文件，不支持直接复制图片内容"), open=True)
@@ -801,9 +706,8 @@ class T2I_View:
 
     def _on_meta_file_picked(self, e):
         if e.files:
-            with open(e.files[0].path, "rb") as f:
-                meta = utils.extract_metadata_from_png(f.read())
-                if meta: self._apply_metadata(meta)
+            meta = utils.read_metadata_from_file(e.files[0].path)
+            if meta: self._apply_metadata(meta)
 
     def _apply_metadata(self, meta):
         if "prompt" in meta: self.prompt_input.value = meta["prompt"]
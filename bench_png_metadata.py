@@ -0,0 +1,101 @@
+import os
+import io
+import sys
+import time
+import zlib
+import struct
+import tempfile
+import argparse
+import tracemalloc
+import utils
+
+# ==========================================
+#      PNG 元数据注入基准测试
+# ==========================================
+# 说明：
+#   对比旧的 "切片拼接 + rfind(IEND)" 写法与按块写出的 write_png_with_metadata：
+#     - 内存字节 -> 内存字节 (add_metadata_to_png 的用法)
+#     - 文件 -> 文件 (_convert_file_with_metadata 的用法，整张图不进内存)
+#   每项输出平均耗时与 tracemalloc 统计的峰值内存，并校验写入的元数据能被读回。
+#   用法: python bench_png_metadata.py [--sizes 512,1024,2048] [--repeat 5]
+
+def legacy_add_metadata(image_bytes, metadata):
+    """旧实现 (仅 PNG 分支)：找到最后一个 IEND，前后切片再拼接"""
+    metadata_chunk = utils.build_metadata_chunk(metadata, b'tEXt')
+    iend_pos = image_bytes.rfind(b'IEND')
+    if iend_pos == -1: return image_bytes
+    return image_bytes[:iend_pos-4] + metadata_chunk + image_bytes[iend_pos-4:]
+
+def make_png(side, idat_size=64 * 1024):
+    """生成一张 side x side 的随机 RGB PNG (不依赖 Pillow)，IDAT 按常见编码器的方式切成多块"""
+    def chunk(ctype, data):
+        return struct.pack('>I', len(data)) + ctype + data + struct.pack('>I', zlib.crc32(ctype + data) & 0xffffffff)
+    row = side * 3
+    raw = b"".join(b"\x00" + os.urandom(row) for _ in range(side))
+    compressed = zlib.compress(raw, 1)
+    idats = [chunk(b'IDAT', compressed[i:i + idat_size]) for i in range(0, len(compressed), idat_size)]
+    ihdr = chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0))
+    return utils.PNG_SIGNATURE + ihdr + b"".join(idats) + chunk(b'IEND', b"")
+
+def measure(fn, repeat):
+    """返回 (平均耗时 ms, 峰值内存 MB)；峰值单独跑一次统计，避免 tracemalloc 拖慢计时"""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat): fn()
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="PNG 元数据注入基准测试")
+    parser.add_argument("--sizes", default="512,1024,2048", help="图片边长 (逗号分隔)")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数")
+    args = parser.parse_args()
+
+    metadata = {
+        "model": "Qwen/Qwen-Image", "prompt": "一只橘色小猫坐在窗台上，午后阳光，电影感光影 " * 20,
+        "negative_prompt": "噪点，模糊，低画质，色调艳丽，过曝", "size": "1024x1024",
+        "num_inference_steps": 30, "guidance_scale": 3.5, "seed": 123456
+    }
+    tmp_dir = tempfile.mkdtemp(prefix="bench_png_")
+    print(f"{'尺寸':>6} {'文件':>8} | {'方式':<22} {'耗时(ms)':>9} {'峰值内存(MB)':>12} {'元数据块':>8}")
+    print("-" * 76)
+    try:
+        for side in [int(s) for s in args.sizes.split(",") if s.strip()]:
+            png = make_png(side)
+            src_path = os.path.join(tmp_dir, f"src_{side}.png")
+            dst_path = os.path.join(tmp_dir, f"dst_{side}.png")
+            with open(src_path, "wb") as f: f.write(png)
+
+            def to_file(chunk_type=None):
+                with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+                    utils.write_png_with_metadata(src, dst, metadata, chunk_type)
+
+            cases = [
+                ("旧: 切片拼接", lambda: legacy_add_metadata(png, metadata), b'tEXt'),
+                ("新: 内存 tEXt", lambda: utils.write_png_with_metadata(png, io.BytesIO(), metadata, b'tEXt'), b'tEXt'),
+                ("新: 内存 iTXt 压缩", lambda: utils.write_png_with_metadata(png, io.BytesIO(), metadata, b'iTXt'), b'iTXt'),
+                ("新: 文件 -> 文件 (自动)", lambda: to_file(), None),
+            ]
+            for name, fn, chunk_type in cases:
+                elapsed, peak = measure(fn, args.repeat)
+                chunk_len = len(utils.build_metadata_chunk(metadata, chunk_type))
+                print(f"{side:>6} {len(png) / 1024 / 1024:>6.1f}MB | {name:<22} {elapsed:>9.2f} {peak:>12.2f} {chunk_len:>7}B")
+
+            # 校验：写出的文件能读回同样的元数据
+            to_file()
+            assert utils.read_metadata_from_file(dst_path) == metadata, "文件写出的元数据读回不一致"
+            out = io.BytesIO()
+            utils.write_png_with_metadata(png, out, metadata, b'zTXt')
+            assert utils.extract_metadata_from_png(out.getvalue()) == metadata, "zTXt 元数据读回不一致"
+            print("-" * 76)
+    finally:
+        for name in os.listdir(tmp_dir): os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    print("✅ 元数据读回校验通过")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import utils
+
+try:
+    import sqlite3
+    HAS_SQLITE = True
+except ImportError:
+    HAS_SQLITE = False
+
+# ==========================================
+#      结果缓存 (相同请求体直接复用本地图片)
+# ==========================================
+# 说明：
+#   固定种子时，同样的 模型/提示词/尺寸/步数/引导系数 生成的图片完全一致，
+#   再次提交只会白白消耗额度。这里以"规范化请求体"的 sha256 为键保存结果，
+#   命中时不调用 API。索引放在 SQLite 里，按最近使用时间 (LRU) 淘汰，总大小有上限。
+
+RESULT_CACHE_FOLDER = os.path.join(utils.ENGINE_DATA_FOLDER, "result_cache")
+RESULT_CACHE_DB = os.path.join(utils.ENGINE_DATA_FOLDER, "result_cache.db")
+DEFAULT_RESULT_CACHE_MB = 1024
+
+def normalize_payload(payload):
+    """规范化请求体：字符串去掉首尾空白，整数值的浮点数统一成整数，键排序"""
+    def norm(v):
+        if isinstance(v, str): return v.strip()
+        if isinstance(v, float) and v.is_integer(): return int(v)
+        if isinstance(v, dict): return {k: norm(x) for k, x in v.items() if x is not None}
+        if isinstance(v, (list, tuple)): return [norm(x) for x in v]
+        return v
+    return json.dumps(norm(payload), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+def payload_key(payload):
+    return hashlib.sha256(normalize_payload(payload).encode("utf-8")).hexdigest()
+
+class ResultCache:
+    def __init__(self, folder=RESULT_CACHE_FOLDER, db_path=RESULT_CACHE_DB, max_bytes=DEFAULT_RESULT_CACHE_MB * 1024 * 1024):
+        """
+        :param folder: 缓存图片目录 (按键的前两位分子目录)
+        :param max_bytes: 缓存总大小上限，超出后淘汰最久未使用的条目
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_used ON results(last_used)")
+
+    def _path_for(self, key):
+        return os.path.abspath(os.path.join(self.folder, key[:2], f"{key}.png"))
+
+    def get(self, key):
+        """命中时返回本地路径并刷新最近使用时间；文件已丢失的条目顺手删除"""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT path FROM results WHERE key = ?", (key,)).fetchone()
+            if row and os.path.exists(row[0]):
+                self._conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.hits += 1
+                return row[0]
+            if row: self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+
+    def put(self, key, src_path):
+        """把生成结果复制进缓存 (已存在则只刷新时间)，然后按大小上限淘汰"""
+        if not src_path or not os.path.isfile(src_path): return None
+        dest = self._path_for(key)
+        if not os.path.exists(dest):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            tmp = f"{dest}.part"
+            shutil.copyfile(src_path, tmp)
+            os.replace(tmp, dest)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, path, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, dest, os.path.getsize(dest), now, now)
+            )
+        self.evict()
+        return dest
+
+    def evict(self):
+        """淘汰最久未使用的条目直到总大小不超过上限"""
+        with self._lock, self._conn:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total <= self.max_bytes: return 0
+            removed = 0
+            for key, path, size in self._conn.execute("SELECT key, path, size FROM results ORDER BY last_used").fetchall():
+                if total <= self.max_bytes: break
+                try:
+                    if os.path.exists(path): os.remove(path)
+                except Exception as e:
+                    print(f"Result cache evict error: {e}")
+                    continue
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+            return removed
+
+    def get_stats(self):
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"entries": count, "bytes": total, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
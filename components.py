@@ -3,6 +3,7 @@ import asyncio
 import math
 import time
 import utils
+import thumbnails
 
 # ==========================================
 #      【兼容层】自动适配 Flet 版本
@@ -316,7 +317,7 @@ class ImageViewer:
         self.is_animating = True
         target_obj = self.current_images_data[new_index]
         
-        self.preload_img.src = target_obj.src
+        self.preload_img.src = thumbnails.original_src(target_obj)
         self.preload_container.visible = True
         
         start_x = 1.0 if delta > 0 else -1.0
@@ -345,7 +346,7 @@ class ImageViewer:
         await asyncio.sleep(0.35)
         
         self.current_index = new_index
-        self.inner_img.src = target_obj.src
+        self.inner_img.src = thumbnails.original_src(target_obj)
         self.reset_zoom(update_ui=False)
         
         self.swipe_container.animate_offset = None
@@ -391,7 +392,7 @@ class ImageViewer:
                 start_x = -1.0
             
             if 0 <= target_idx < len(self.current_images_data):
-                self.preload_img.src = self.current_images_data[target_idx].src
+                self.preload_img.src = thumbnails.original_src(self.current_images_data[target_idx])
                 if utils.MyOffset:
                     self.preload_container.offset = utils.MyOffset(start_x + ratio, 0)
             else:
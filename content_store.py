@@ -0,0 +1,123 @@
+import os
+import uuid
+import shutil
+import hashlib
+import threading
+
+# ==========================================
+#      内容寻址存储 (sha256 + 分片目录)
+# ==========================================
+# 说明：
+#   文件名就是内容的 sha256，放在前两位十六进制命名的子目录里 (ab/abcdef...png)，
+#   同样的字节只保存一份，按哈希查找只需一次 os.path.exists。
+#   写入统一先落到 root/.tmp 下的临时文件，算出哈希后 os.replace 原子改名，
+#   同一文件系统内不会出现半截文件，也不会出现时间戳文件名的重名覆盖。
+
+HASH_CHUNK_SIZE = 1024 * 1024
+TMP_DIR_NAME = ".tmp"
+
+def hash_file(path):
+    """分块计算文件的 sha256"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class ContentStore:
+    def __init__(self, root, ext=".png"):
+        """
+        :param root: 存储根目录
+        :param ext: 文件扩展名 (哈希本身不含扩展名)
+        """
+        self.root = os.path.abspath(root)
+        self.ext = ext
+        self.stored = 0   # 新写入的文件数
+        self.deduped = 0  # 内容已存在而跳过写入的次数
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}{self.ext}")
+
+    def lookup(self, digest):
+        """按哈希查找，存在时返回绝对路径"""
+        path = self.path_for(digest)
+        return path if os.path.exists(path) else None
+
+    def new_temp_path(self):
+        """与最终文件同一文件系统的临时路径，写完后交给 commit()"""
+        tmp_dir = os.path.join(self.root, TMP_DIR_NAME)
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, f"{uuid.uuid4().hex}.part")
+
+    def commit(self, tmp_path, digest=None):
+        """
+        把写好的临时文件按内容哈希归档
+        :param digest: 写入时已顺带算好的 sha256，为空时重新计算
+        :return: (最终路径, 是否与已有文件重复)
+        """
+        digest = digest or hash_file(tmp_path)
+        dest = self.path_for(digest)
+        if os.path.exists(dest):
+            # 重复内容：丢弃临时文件，刷新修改时间让它排到最新
+            os.remove(tmp_path)
+            try: os.utime(dest)
+            except OSError: pass
+            self.deduped += 1
+            return dest, True
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp_path, dest)
+        self.stored += 1
+        return dest, False
+
+    def put_bytes(self, data):
+        """写入一段字节，返回 (路径, 是否重复)"""
+        digest = hashlib.sha256(data).hexdigest()
+        existing = self.lookup(digest)
+        if existing:
+            try: os.utime(existing)
+            except OSError: pass
+            self.deduped += 1
+            return existing, True
+        tmp_path = self.new_temp_path()
+        with open(tmp_path, "wb") as f: f.write(data)
+        return self.commit(tmp_path, digest)
+
+    def put_file(self, src_path):
+        """复制一个已有文件进来 (先算哈希，重复时不复制)，返回 (路径, 是否重复)"""
+        digest = hash_file(src_path)
+        existing = self.lookup(digest)
+        if existing:
+            try: os.utime(existing)
+            except OSError: pass
+            self.deduped += 1
+            return existing, True
+        tmp_path = self.new_temp_path()
+        shutil.copyfile(src_path, tmp_path)
+        return self.commit(tmp_path, digest)
+
+    def iter_paths(self):
+        """遍历所有已归档文件 (跳过临时目录等以 . 开头的目录)"""
+        if not os.path.isdir(self.root): return
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name.startswith("."): continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and entry.name.endswith(self.ext):
+                    yield entry.path
+
+    def get_stats(self):
+        return {"stored": self.stored, "deduped": self.deduped}
+
+# ==========================================
+#      按目录共享的存储实例
+# ==========================================
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(root, ext=".png"):
+    key = (os.path.abspath(root), ext)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = ContentStore(root, ext)
+            _stores[key] = store
+        return store
@@ -0,0 +1,176 @@
+import os
+import time
+import asyncio
+import threading
+import functools
+import concurrent.futures
+import concurrent.futures.process
+
+# ==========================================
+#      分类执行器 (网络 / 磁盘 / 图片编解码)
+# ==========================================
+# 说明：
+#   asyncio.to_thread 全部挤在默认线程池里，一批 50 张的下载会把缓存写盘饿死，
+#   反过来也一样。这里按工作类型拆成三个独立的有界池，互不抢占，并各自统计排队深度。
+#   图片编解码 (Pillow) 是 CPU 密集型，默认用进程池绕开 GIL (提交的函数须为模块级函数)；
+#   进程池不可用 (如手机端) 或子进程起不来时自动退回线程池。
+
+NET = "net"
+DISK = "disk"
+CPU = "cpu"
+
+DEFAULT_EXECUTOR_CONFIG = {
+    "net_workers": 8,                                  # 同步网络调用 (如百度翻译)
+    "disk_workers": 4,                                 # 文件读写 / 复制 / SQLite
+    "cpu_workers": max(1, (os.cpu_count() or 2) - 1),  # Pillow 转码 / 缩略图
+    "cpu_use_processes": True,                         # 图片编解码是否使用进程池
+}
+
+class BoundedExecutor:
+    def __init__(self, name, max_workers, use_processes=False):
+        """
+        :param name: 池名称 (用于线程名与统计)
+        :param max_workers: 最大并发数，超出的任务在池内排队
+        :param use_processes: 是否使用进程池 (提交的函数与参数必须可被 pickle)
+        """
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.use_processes = False
+        self._executor = None
+        if use_processes:
+            try:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+                self.use_processes = True
+            except Exception as e:
+                print(f"进程池不可用，{name} 改用线程池: {e}")
+        if self._executor is None: self._executor = self._new_thread_pool()
+
+        # 排队统计 (提交 / 完成都可能来自不同线程)
+        self._lock = threading.Lock()
+        self.pending = 0       # 已提交未完成 (含正在执行)
+        self.peak_pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_time = 0.0  # 提交到完成的累计耗时 (含排队)
+
+    # ================= 提交 =================
+
+    def submit(self, fn, *args, **kwargs):
+        """提交任务，返回 concurrent.futures.Future"""
+        if kwargs: fn = functools.partial(fn, *args, **kwargs); args = ()
+        submitted_at = time.monotonic()
+        with self._lock:
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            try:
+                fut = self._executor.submit(fn, *args)
+            except concurrent.futures.process.BrokenProcessPool:
+                # 子进程启动失败 (如打包环境不支持 spawn)：本池改用线程池后重新提交
+                self._fallback_to_threads()
+                fut = self._executor.submit(fn, *args)
+        except Exception:
+            with self._lock: self.pending -= 1
+            raise
+        fut.add_done_callback(lambda f: self._on_done(f, submitted_at))
+        return fut
+
+    async def run(self, fn, *args, **kwargs):
+        """在本池中执行阻塞函数并等待结果 (asyncio.to_thread 的替代)"""
+        try:
+            return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+        except concurrent.futures.process.BrokenProcessPool:
+            # 子进程意外退出：之后的任务改用线程池 (本次不重试，避免同一个任务把主进程也带崩)
+            self._fallback_to_threads()
+            raise
+
+    def _new_thread_pool(self):
+        return concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"exec-{self.name}")
+
+    def _fallback_to_threads(self):
+        with self._lock:
+            if not self.use_processes: return
+            print(f"进程池异常，{self.name} 改用线程池")
+            broken, self._executor = self._executor, self._new_thread_pool()
+            self.use_processes = False
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def map(self, fn, items):
+        """同步代码中并行处理一组参数，按原顺序返回结果"""
+        futures = [self.submit(fn, item) for item in items]
+        return [f.result() for f in futures]
+
+    def _on_done(self, fut, submitted_at):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+            self.total_time += time.monotonic() - submitted_at
+            if not fut.cancelled() and fut.exception() is not None: self.failed += 1
+
+    def shutdown(self, wait=False, cancel_futures=True):
+        """
+        :param cancel_futures: 为 False 时排队中的任务也照常执行完 (池大小变更时旧池在后台排空)
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    # ================= 统计 =================
+
+    def get_stats(self):
+        with self._lock:
+            running = min(self.pending, self.max_workers)
+            return {
+                "workers": self.max_workers,
+                "processes": self.use_processes,
+                "running": running,
+                "queued": self.pending - running, # 等待空闲 worker 的任务数
+                "peak_pending": self.peak_pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_time": (self.total_time / self.completed) if self.completed else 0.0,
+            }
+
+# ==========================================
+#      全局执行器
+# ==========================================
+_config = dict(DEFAULT_EXECUTOR_CONFIG)
+_pools = {}
+_pools_lock = threading.Lock()
+
+def configure(**config):
+    """更新池大小 / 进程池开关；变化的池在下一次使用时重建，旧池中已提交的任务继续执行完"""
+    with _pools_lock:
+        for k, v in config.items():
+            if k not in DEFAULT_EXECUTOR_CONFIG or v is None or _config.get(k) == v: continue
+            _config[k] = v
+            kind = k.split("_")[0]
+            old = _pools.pop(kind, None)
+            if old is not None: old.shutdown(wait=False, cancel_futures=False)
+
+def get_pool(kind):
+    pool = _pools.get(kind)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(kind)
+            if pool is None:
+                use_processes = kind == CPU and bool(_config["cpu_use_processes"])
+                pool = BoundedExecutor(kind, _config[f"{kind}_workers"], use_processes=use_processes)
+                _pools[kind] = pool
+    return pool
+
+async def run_net(fn, *args, **kwargs):
+    return await get_pool(NET).run(fn, *args, **kwargs)
+
+async def run_disk(fn, *args, **kwargs):
+    return await get_pool(DISK).run(fn, *args, **kwargs)
+
+async def run_cpu(fn, *args, **kwargs):
+    """图片编解码等 CPU 任务；启用进程池时 fn 必须是模块级函数"""
+    return await get_pool(CPU).run(fn, *args, **kwargs)
+
+def get_stats():
+    return {kind: get_pool(kind).get_stats() for kind in (NET, DISK, CPU)}
+
+def shutdown():
+    with _pools_lock:
+        for pool in _pools.values(): pool.shutdown(wait=False)
+        _pools.clear()
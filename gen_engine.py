@@ -0,0 +1,1138 @@
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import threading
+import itertools
+import collections
+import httpx
+import utils  # 引入公共工具模块
+import http_client
+import executors
+import cache_store
+
+# 安全导入 sqlite3 (部分精简的移动端 Python 可能缺失)
+try:
+    import sqlite3
+    HAS_SQLITE = True
+except ImportError:
+    HAS_SQLITE = False
+
+# ==========================================
+#      生图引擎 (无 UI 依赖)
+# ==========================================
+# 说明：
+#   T2I / I2I 共用的 提交 -> 轮询 -> 缓存 流程。
+#   引擎只认识 GenJob (任务描述)，不接触任何 Flet 控件；
+#   视图通过 job.add_listener() 订阅事件，再自行刷新界面。
+
+# 引擎事件名
+EVENT_SUBMITTING = "submitting"   # 正在提交
+EVENT_SUBMITTED = "submitted"     # 已拿到 task_id
+EVENT_STATUS = "status"           # 轮询状态变化 (data = 原始 task_status)
+EVENT_CACHING = "caching"         # 正在下载到本地缓存
+EVENT_SUCCEEDED = "succeeded"     # 成功 (data = 本地路径或远程链接)
+EVENT_FAILED = "failed"           # 失败 (data = 错误描述)
+EVENT_RETRY = "retry"             # 准备重试 (data = 本次重试原因)
+EVENT_PAUSED = "paused"           # 所属批次已暂停，任务在提交前挂起 (不消耗额度)
+EVENT_CANCELED = "canceled"       # 已取消
+
+_job_counter = itertools.count(1)
+_batch_counter = itertools.count(1)
+
+class GenJob:
+    def __init__(self, payload, api_keys, meta=None, context=None):
+        """
+        :param payload: 提交给 v1/images/generations 的请求体
+        :param api_keys: 可用的 ModelScope Key 列表 (或单个 Key)，提交时由调度器挑选
+        :param meta: 写入 PNG 的元数据 (为空时使用 payload)
+        :param context: 调用方自定义数据 (例如视图的卡片引用)，引擎不会读取
+        """
+        self.job_id = next(_job_counter)
+        self.job_uid = uuid.uuid4().hex # 跨进程唯一，用于任务日志
+        self.candidate_keys = [api_keys] if isinstance(api_keys, str) else list(api_keys)
+        self.api_key = None # 实际使用的 Key，提交前由调度器决定
+        self.payload = payload
+        self.meta = meta if meta is not None else payload
+        self.context = context
+
+        # 运行状态
+        self.state = "PENDING"
+        self.task_id = None
+        self.remote_url = None
+        self.local_path = None
+        self.error = None
+        self.retries = [] # [(原因, 当时使用的 Key)]
+        self.future = None
+        self.batch = None # 所属批次 (GenBatch.add 设置)
+        self.canceled = False
+        self.finished = False # 结果已落地，之后不再响应取消
+        self.cache_hit = False # 结果来自本地结果缓存 (未调用 API)
+        self.bypass_cache = False # 为 True 时本任务不查结果缓存 (仍会写入)
+        self._task = None
+        self._listeners = []
+
+    @property
+    def retry_summary(self):
+        """重试记录的可读摘要，用于卡片 tooltip"""
+        if not self.retries: return ""
+        reasons = "、".join(r for r, _ in self.retries)
+        return f"重试 {len(self.retries)} 次: {reasons}"
+
+    @property
+    def priority(self):
+        return self.batch.priority if self.batch else PRIORITY_NORMAL
+
+    @property
+    def result_src(self):
+        """成功后用于显示的图片地址 (优先本地缓存)"""
+        return self.local_path or self.remote_url
+
+    def add_listener(self, listener):
+        """订阅事件：listener(job, event, data)，可为普通函数或协程函数"""
+        self._listeners.append(listener)
+
+    async def emit(self, event, data=None):
+        for listener in list(self._listeners):
+            try:
+                res = listener(self, event, data)
+                if asyncio.iscoroutine(res): await res
+            except Exception as e:
+                print(f"Job listener error: {e}")
+
+# 批次优先级 (数值越大越先提交)
+PRIORITY_HIGH = 1
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -1
+PRIORITY_LABELS = {PRIORITY_HIGH: "高", PRIORITY_NORMAL: "普通", PRIORITY_LOW: "低"}
+
+class GenBatch:
+    def __init__(self, label="", priority=PRIORITY_NORMAL):
+        """
+        一次点击"开始生成"产生的一组任务，用于整批暂停 / 继续 / 取消
+        暂停只挂起尚未提交的任务；已提交的任务服务端已在生成，继续轮询
+        :param priority: 在引擎全局队列中的优先级，可随时修改，对尚未提交的任务生效
+        """
+        self.batch_id = next(_batch_counter)
+        self.label = label
+        self.priority = priority
+        self.jobs = [] # 流式批次中只保留在途任务，已结束的会被移除
+        self.canceled = False
+        self.outcomes = collections.Counter() # 流式批次的结果统计: 最终状态 -> 数量
+        self._resume_event = asyncio.Event()
+        self._resume_event.set()
+
+    def add(self, job):
+        job.batch = self
+        self.jobs.append(job)
+        return job
+
+    @property
+    def paused(self):
+        return not self._resume_event.is_set()
+
+    def pause(self):
+        self._resume_event.clear()
+
+    def resume(self):
+        self._resume_event.set()
+
+    async def wait_if_paused(self):
+        await self._resume_event.wait()
+
+    @property
+    def active_jobs(self):
+        return [j for j in self.jobs if not (j.future and j.future.done())]
+
+# ==========================================
+#      模型耗时统计 (持久化)
+# ==========================================
+LATENCY_STATS_FILE = os.path.join(utils.ENGINE_DATA_FOLDER, "latency_stats.json")
+
+def _percentile(values, pct):
+    if not values: return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+class LatencyStats:
+    def __init__(self, path=LATENCY_STATS_FILE, max_samples=200):
+        """
+        按模型记录任务各阶段耗时 (排队 PENDING / 生成 RUNNING / 总耗时)
+        :param max_samples: 每个模型最多保留的样本数 (超出丢弃最旧的)
+        """
+        self.path = path
+        self.max_samples = max_samples
+        self.models = {} # model -> {"pending": [...], "running": [...], "total": [...]}
+        self._dirty = 0
+        self._lock = threading.Lock()      # 保护 models / _dirty (record 在事件循环线程，save 在磁盘线程池)
+        self._save_lock = threading.Lock() # 同一时间只有一个线程写文件
+        self.load()
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict): self.models = data
+        except Exception as e:
+            print(f"Latency stats load error: {e}")
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty: return
+                data = json.dumps(self.models)
+                dirty = self._dirty
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+                # 写文件期间新记的样本留到下次保存
+                with self._lock: self._dirty -= dirty
+            except Exception as e:
+                print(f"Latency stats save error: {e}")
+
+    @property
+    def unsaved_count(self):
+        return self._dirty
+
+    def record(self, model, pending, running, total):
+        with self._lock:
+            entry = self.models.setdefault(model or "unknown", {"pending": [], "running": [], "total": []})
+            for name, value in (("pending", pending), ("running", running), ("total", total)):
+                if value is None: continue
+                samples = entry.setdefault(name, [])
+                samples.append(round(value, 2))
+                del samples[:-self.max_samples]
+            self._dirty += 1
+
+    def percentile(self, model, phase, pct):
+        with self._lock: values = list(self.models.get(model or "unknown", {}).get(phase, []))
+        return _percentile(values, pct)
+
+    def sample_count(self, model):
+        with self._lock: return len(self.models.get(model or "unknown", {}).get("total", []))
+
+# ==========================================
+#      单 Key 令牌桶限流
+# ==========================================
+DEFAULT_RATE_QPS = 2.0   # 每个 Key 每秒允许提交的任务数
+DEFAULT_RATE_BURST = 3   # 每个 Key 允许的瞬时突发数
+
+class TokenBucket:
+    def __init__(self, qps=DEFAULT_RATE_QPS, burst=DEFAULT_RATE_BURST):
+        self.qps = max(0.01, float(qps))
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self._lock = None
+
+    def configure(self, qps, burst):
+        self._refill()
+        self.qps = max(0.01, float(qps))
+        self.burst = max(1, int(burst))
+        self.tokens = min(self.tokens, float(self.burst))
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated_at) * self.qps)
+        self.updated_at = now
+
+    async def acquire(self):
+        """取一个令牌，不足时等待补充 (同一个桶内按先来后到排队)"""
+        if self._lock is None: self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.qps)
+
+# ==========================================
+#      错误分类 (决定是否重试 / 换 Key)
+# ==========================================
+class GenError(Exception):
+    def __init__(self, message, reason=None, retryable=False, failover=False, throttled=False):
+        """
+        :param reason: 简短的错误分类，用于重试记录与统计
+        :param retryable: 是否可以安全重试 (不会重复扣额度)
+        :param failover: 重试时是否应换一个 Key
+        :param throttled: 服务端明确表示过载 (429/503)，用于收缩该 Key 的并发窗口
+        """
+        super().__init__(message)
+        self.reason = reason or message
+        self.retryable = retryable
+        self.failover = failover
+        self.throttled = throttled
+
+def classify_submit_error(exc):
+    """
+    把提交阶段的异常归类。只有确定服务端没有创建任务时才允许重试：
+    返回了 429/401/403/5xx，或连接阶段就失败 (请求根本没发出去)。
+    读超时等“请求可能已送达”的情况不重试，避免同一张图扣两次额度。
+    """
+    if isinstance(exc, GenError): return exc
+    if isinstance(exc, httpx.HTTPStatusError):
+        code = exc.response.status_code
+        if code == 429: return GenError("HTTP 429 限流", "限流换Key", retryable=True, failover=True, throttled=True)
+        if code in (401, 403): return GenError(f"HTTP {code} Key 无效", "Key无效换Key", retryable=True, failover=True)
+        if code >= 500: return GenError(f"HTTP {code} 服务器错误", "服务器错误", retryable=True, throttled=(code == 503))
+        return GenError(f"HTTP {code} 请求被拒绝")
+    if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return GenError(f"网络连接失败: {exc}", "网络错误", retryable=True)
+    if isinstance(exc, httpx.TimeoutException):
+        return GenError("提交超时 (可能已提交，为免重复扣额度未重试)")
+    return GenError(str(exc) or exc.__class__.__name__)
+
+def is_transient_poll_error(exc):
+    """轮询失败是否只是暂时的 (轮询本身不扣额度，可以放心重试)"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        code = exc.response.status_code
+        return code == 429 or code >= 500
+    return isinstance(exc, (httpx.TransportError, ValueError))
+
+# ==========================================
+#      自适应并发窗口 (AIMD)
+# ==========================================
+DEFAULT_AIMD_CONFIG = {
+    "initial": None,           # 初始在途上限 (None 表示从 maximum 开始，只在真正遇到背压后收缩)
+    "minimum": 1.0,
+    "maximum": 32.0,
+    "increase": 1.0,           # 每满一个窗口的成功提交，上限 +increase
+    "decrease": 0.5,           # 429/503 时上限乘以该系数
+    "slow_decrease": 0.75,     # 排队明显变慢时上限乘以该系数
+    "decrease_interval": 2.0,  # 两次收缩的最小间隔 (秒)，避免一波 429 把窗口压到底
+}
+
+class AimdWindow:
+    def __init__(self, initial=None, minimum=1.0, maximum=32.0, increase=1.0, decrease=0.5,
+                 slow_decrease=0.75, decrease_interval=2.0):
+        """
+        单个 Key 的在途任务上限：提交成功时线性增长，遇到背压时按比例收缩
+        :param initial: 初始上限，None 表示从 maximum 开始 (批量不会在没有任何 429 / 排队变慢时被限流)
+        """
+        self.value = float(maximum if initial is None else initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.slow_decrease = float(slow_decrease)
+        self.decrease_interval = float(decrease_interval)
+        self._last_decrease = 0.0
+
+    @property
+    def limit(self):
+        return max(1, int(self.value))
+
+    def on_success(self):
+        # 每个成功提交 +increase/value，即每满一个窗口约 +increase
+        self.value = min(self.maximum, self.value + self.increase / max(1.0, self.value))
+
+    def on_backpressure(self, slow=False):
+        """slow=True 表示排队变慢 (温和收缩)，否则为 429/503 (减半)"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_interval: return False
+        self._last_decrease = now
+        factor = self.slow_decrease if slow else self.decrease
+        self.value = max(self.minimum, self.value * factor)
+        return True
+
+# ==========================================
+#      Key 调度器 (额度 + 健康度)
+# ==========================================
+class KeyScheduler:
+    def __init__(self, window=20, error_threshold=0.5, cooldown=60, aimd_config=None):
+        """
+        :param window: 每个 Key 统计最近多少次结果 / 耗时
+        :param error_threshold: 最近失败率超过该值 (且样本 >= 4) 时暂停使用
+        :param cooldown: 暂停使用的时长 (秒)
+        :param aimd_config: 每个 Key 自适应并发窗口的参数 (见 DEFAULT_AIMD_CONFIG)
+        """
+        self.window = window
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.aimd_config = dict(DEFAULT_AIMD_CONFIG)
+        self.aimd_config.update(aimd_config or {})
+        self.on_capacity = None # 有 Key 释放在途名额时回调 (引擎用来唤醒等待的任务)
+        self._keys = {} # api_key -> 状态
+
+    def _state(self, api_key):
+        state = self._keys.get(api_key)
+        if state is None:
+            state = {
+                "used": 0,            # 今日已用次数
+                "daily_limit": None,  # 每日额度 (None 表示不限制)
+                "in_flight": 0,       # 已分配但未结束的任务数
+                "outcomes": collections.deque(maxlen=self.window),  # True=成功 False=失败
+                "latencies": collections.deque(maxlen=self.window), # 成功任务的耗时
+                "cooldown_until": 0.0,
+                "aimd": AimdWindow(**self.aimd_config), # 在途任务上限
+            }
+            self._keys[api_key] = state
+        return state
+
+    def set_usage(self, api_key, used, daily_limit=None):
+        """同步今日用量 (来自 utils.get_api_usage) 与每日额度"""
+        state = self._state(api_key)
+        state["used"] = int(used or 0)
+        state["daily_limit"] = int(daily_limit) if daily_limit else None
+
+    def remaining(self, api_key):
+        state = self._state(api_key)
+        if state["daily_limit"] is None: return None
+        return max(0, state["daily_limit"] - state["used"] - state["in_flight"])
+
+    def error_rate(self, api_key):
+        outcomes = self._state(api_key)["outcomes"]
+        if not outcomes: return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    def is_available(self, api_key):
+        state = self._state(api_key)
+        if time.monotonic() < state["cooldown_until"]: return False
+        if state["in_flight"] >= state["aimd"].limit: return False
+        remaining = self.remaining(api_key)
+        return remaining is None or remaining > 0
+
+    def window_full(self, candidate_keys):
+        """是否有 Key 只是因为在途任务达到并发窗口上限而暂不可用"""
+        for k in candidate_keys:
+            state = self._state(k)
+            remaining = self.remaining(k)
+            if remaining is not None and remaining <= 0: continue
+            if state["in_flight"] >= state["aimd"].limit: return True
+        return False
+
+    def on_submit_ok(self, api_key):
+        """提交成功：扩大该 Key 的并发窗口"""
+        if api_key: self._state(api_key)["aimd"].on_success()
+
+    def on_backpressure(self, api_key, slow=False):
+        """
+        429/503 或排队明显变慢：收缩该 Key 的并发窗口
+        :return: 窗口已在下限、无法再靠收缩消化时返回 True (此时才计入健康度)
+        """
+        if not api_key: return False
+        aimd = self._state(api_key)["aimd"]
+        at_minimum = aimd.value <= aimd.minimum
+        aimd.on_backpressure(slow)
+        return at_minimum
+
+    def _score(self, api_key):
+        state = self._state(api_key)
+        remaining = self.remaining(api_key)
+        # 额度越充足越优先；无额度限制时视为满额
+        quota_score = 1.0 if remaining is None else remaining / max(1, state["daily_limit"])
+        latency = sum(state["latencies"]) / len(state["latencies"]) if state["latencies"] else 0.0
+        return (
+            quota_score
+            - self.error_rate(api_key) * 2.0
+            - min(latency, 300) / 300.0 * 0.5
+            - state["in_flight"] * 0.1
+        )
+
+    def pick(self, candidate_keys):
+        """从候选 Key 中挑出当前最合适的一个，全部不可用时返回 None"""
+        available = [k for k in candidate_keys if self.is_available(k)]
+        if not available: return None
+        best = max(available, key=self._score)
+        self._state(best)["in_flight"] += 1
+        return best
+
+    def acquire(self, api_key):
+        """不经挑选直接占用指定 Key 的在途名额 (恢复已提交的任务时使用，结束时同样要 release)"""
+        self._state(api_key)["in_flight"] += 1
+        return api_key
+
+    def next_available_in(self, candidate_keys):
+        """候选 Key 都在冷却时，返回最早恢复的等待秒数；额度全部用完时返回 None"""
+        now = time.monotonic()
+        waits = []
+        for k in candidate_keys:
+            remaining = self.remaining(k)
+            if remaining is not None and remaining <= 0: continue
+            waits.append(max(0.0, self._state(k)["cooldown_until"] - now))
+        return min(waits) if waits else None
+
+    def release(self, api_key, success, latency=None, count_outcome=True):
+        """
+        任务结束时回报结果，用于更新额度与健康度
+        :param count_outcome: 为 False 时不计入健康度 (例如与 Key 无关的网络错误)
+        """
+        if not api_key: return
+        state = self._state(api_key)
+        state["in_flight"] = max(0, state["in_flight"] - 1)
+        if self.on_capacity: self.on_capacity()
+        if not success and not count_outcome: return
+        state["outcomes"].append(bool(success))
+        if success:
+            state["used"] += 1
+            if latency is not None: state["latencies"].append(latency)
+        elif len(state["outcomes"]) >= 4 and self.error_rate(api_key) > self.error_threshold:
+            # 连续异常的 Key 暂停一段时间，并清空样本以便冷却后重新评估
+            state["cooldown_until"] = time.monotonic() + self.cooldown
+            state["outcomes"].clear()
+
+    def snapshot(self):
+        return {
+            k: {"used": s["used"], "daily_limit": s["daily_limit"], "in_flight": s["in_flight"],
+                "window": round(s["aimd"].value, 1),
+                "error_rate": round(self.error_rate(k), 2), "cooling": time.monotonic() < s["cooldown_until"]}
+            for k, s in self._keys.items()
+        }
+
+# ==========================================
+#      统一任务轮询器
+# ==========================================
+class TaskPoller:
+    def __init__(self, stats=None, min_interval=0.5, max_interval=8.0, backoff=1.5,
+                 default_timeout=120, max_concurrency=8, max_poll_errors=5):
+        """
+        所有未完成的 task_id 由同一个循环轮询，间隔按模型历史耗时自适应
+        :param stats: LatencyStats，为空时自动加载持久化数据
+        :param min_interval: / max_interval: 轮询间隔上下限 (秒)
+        :param backoff: 每次轮询后间隔的放大倍数 (指数退避)
+        :param default_timeout: 无历史数据时的超时 (秒)
+        :param max_concurrency: 同一时刻最多并发的轮询请求数
+        :param max_poll_errors: 连续轮询失败多少次后放弃该任务
+        """
+        self.stats = stats or LatencyStats()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.default_timeout = default_timeout
+        self.max_concurrency = max_concurrency
+        self.max_poll_errors = max_poll_errors
+
+        self._entries = {} # task_id -> 轮询条目
+        self._wakeup = None
+        self._loop_task = None
+
+    # ================= 节奏计算 =================
+
+    def _base_interval(self, model):
+        """首次检查的间隔：历史中位耗时的 1/8，无数据时 1 秒"""
+        p50 = self.stats.percentile(model, "total", 50)
+        base = 1.0 if p50 is None else p50 / 8.0
+        return min(self.max_interval, max(self.min_interval, base))
+
+    def _next_interval(self, entry):
+        """指数退避 + 抖动，避免大量任务在同一时刻一起醒来"""
+        delay = entry["base_interval"] * (self.backoff ** entry["polls"])
+        delay = min(self.max_interval, delay)
+        return delay * random.uniform(0.85, 1.15)
+
+    def timeout_for(self, model):
+        """超时按该模型的 p99 总耗时放宽 50%，样本不足时使用默认值"""
+        if self.stats.sample_count(model) < 10: return self.default_timeout
+        p99 = self.stats.percentile(model, "total", 99)
+        return min(900, max(60, p99 * 1.5 + 10))
+
+    def watch(self, task_id, api_key, model=None):
+        """
+        登记一个任务，返回 asyncio.Queue，依次收到：
+          ("status", raw_status)  状态变化
+          ("done", data)          成功，data 为任务详情
+          ("failed", message)     失败或超时
+        """
+        now = time.monotonic()
+        queue = asyncio.Queue()
+        base_interval = self._base_interval(model)
+        self._entries[task_id] = {
+            "task_id": task_id,
+            "api_key": api_key,
+            "model": model,
+            "queue": queue,
+            "last_status": None,
+            "polls": 0,
+            "errors": 0, # 连续轮询失败次数
+            "base_interval": base_interval,
+            "submitted_at": now,
+            "running_at": None,
+            "deadline": now + self.timeout_for(model),
+            "next_poll_at": now + base_interval,
+        }
+        self._ensure_loop()
+        self._wakeup.set()
+        return queue
+
+    def unwatch(self, task_id):
+        self._entries.pop(task_id, None)
+
+    @property
+    def pending_count(self):
+        return len(self._entries)
+
+    # ================= 内部循环 =================
+
+    def _ensure_loop(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        sem = asyncio.Semaphore(self.max_concurrency)
+        while True:
+            while self._entries:
+                now = time.monotonic()
+                due = [e for e in self._entries.values() if e["next_poll_at"] <= now]
+                if due:
+                    await asyncio.gather(*[self._poll_one(e, sem) for e in due], return_exceptions=True)
+                    continue
+
+                # 睡到最近一个任务到期，期间有新任务登记会被提前唤醒
+                next_at = min(e["next_poll_at"] for e in self._entries.values())
+                self._wakeup.clear()
+                try: await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, next_at - now))
+                except asyncio.TimeoutError: pass
+
+                if self.stats.unsaved_count >= 10:
+                    await executors.run_disk(self.stats.save)
+
+            # 队列清空后落盘耗时统计
+            await executors.run_disk(self.stats.save)
+            # 落盘期间登记的新任务 watch() 不会另起循环，这里接着处理
+            if not self._entries: return
+
+    async def _poll_one(self, entry, sem):
+        task_id = entry["task_id"]
+        try:
+            async with sem:
+                res_poll = await http_client.get_client().get(
+                    f"{utils.BASE_URL}v1/tasks/{task_id}",
+                    headers={"Authorization": f"Bearer {entry['api_key']}", "X-ModelScope-Task-Type": "image_generation"},
+                    timeout=10
+                )
+                res_poll.raise_for_status()
+                data = res_poll.json()
+        except Exception as e:
+            # 暂时性错误 (网络抖动 / 5xx / 429) 只推迟下一次轮询，任务已提交不能放弃
+            now = time.monotonic()
+            entry["errors"] += 1
+            if is_transient_poll_error(e) and entry["errors"] <= self.max_poll_errors and now < entry["deadline"]:
+                entry["polls"] += 1
+                entry["next_poll_at"] = now + self._next_interval(entry)
+            else:
+                self._finish(entry, ("failed", f"轮询失败: {e}"))
+            return
+
+        now = time.monotonic()
+        entry["errors"] = 0
+        entry["polls"] += 1
+        raw_status = data.get("task_status")
+        if raw_status == "SUCCEED":
+            self._record_latency(entry, now)
+            self._finish(entry, ("done", data))
+        elif raw_status == "FAILED":
+            self._finish(entry, ("failed", data.get("message", "API Error")))
+        else:
+            if raw_status != entry["last_status"]:
+                entry["last_status"] = raw_status
+                if raw_status != "PENDING" and entry["running_at"] is None:
+                    entry["running_at"] = now
+                entry["queue"].put_nowait(("status", raw_status))
+            if now >= entry["deadline"]:
+                self._finish(entry, ("failed", "超时"))
+            else:
+                entry["next_poll_at"] = now + self._next_interval(entry)
+
+    def _record_latency(self, entry, now):
+        # 阶段耗时只能精确到轮询粒度，足够用于估算节奏
+        running_at = entry["running_at"] or now
+        pending = running_at - entry["submitted_at"]
+        running = now - running_at
+        self.stats.record(entry["model"], pending, running, now - entry["submitted_at"])
+
+    def _finish(self, entry, message):
+        self._entries.pop(entry["task_id"], None)
+        entry["queue"].put_nowait(message)
+
+# ==========================================
+#      任务日志 (SQLite，重启后可恢复)
+# ==========================================
+JOB_JOURNAL_FILE = os.path.join(utils.ENGINE_DATA_FOLDER, "job_journal.db")
+
+# 日志中的任务状态
+JOURNAL_QUEUED = "QUEUED"        # 已创建，未提交 (没有花费额度)
+JOURNAL_SUBMITTED = "SUBMITTED"  # 已拿到 task_id，服务端在生成
+JOURNAL_SUCCEED = "SUCCEED"
+JOURNAL_FAILED = "FAILED"
+JOURNAL_CANCELED = "CANCELED"
+
+class JobJournal:
+    def __init__(self, path=JOB_JOURNAL_FILE, keep_days=7):
+        """
+        记录每个任务的 payload / Key / task_id / 状态
+        应用中途关闭时，已提交的任务可以在下次启动时继续轮询并下载
+        :param keep_days: 已结束的记录保留天数
+        """
+        self.path = path
+        self.keep_days = keep_days
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _get_conn(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_uid TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    meta TEXT,
+                    api_key TEXT,
+                    task_id TEXT,
+                    status TEXT NOT NULL,
+                    local_path TEXT,
+                    error TEXT,
+                    created_at REAL,
+                    updated_at REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+            self._conn.commit()
+        return self._conn
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            conn = self._get_conn()
+            cur = conn.execute(sql, params)
+            conn.commit()
+            return cur
+
+    def record_queued(self, job):
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO jobs (job_uid, payload, meta, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job.job_uid, json.dumps(job.payload, ensure_ascii=False), json.dumps(job.meta, ensure_ascii=False), JOURNAL_QUEUED, now, now)
+        )
+
+    def record_submitted(self, job):
+        self._execute(
+            "UPDATE jobs SET api_key = ?, task_id = ?, status = ?, updated_at = ? WHERE job_uid = ?",
+            (job.api_key, job.task_id, JOURNAL_SUBMITTED, time.time(), job.job_uid)
+        )
+
+    def record_finished(self, job, status):
+        self._execute(
+            "UPDATE jobs SET status = ?, local_path = ?, error = ?, updated_at = ? WHERE job_uid = ?",
+            (status, job.local_path, job.error, time.time(), job.job_uid)
+        )
+
+    def load_unfinished(self):
+        """
+        读取上次未完成的任务：
+          已提交的返回 (job_uid, payload, meta, api_key, task_id) 列表，用于恢复；
+          未提交的直接标记为已取消 (没有花费额度，不自动补交)
+        """
+        rows = self._execute(
+            "SELECT job_uid, payload, meta, api_key, task_id FROM jobs WHERE status = ? AND task_id IS NOT NULL",
+            (JOURNAL_SUBMITTED,)
+        ).fetchall()
+        self._execute("UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?", (JOURNAL_CANCELED, time.time(), JOURNAL_QUEUED))
+        self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+            (JOURNAL_SUCCEED, JOURNAL_FAILED, JOURNAL_CANCELED, time.time() - self.keep_days * 86400)
+        )
+        result = []
+        for job_uid, payload, meta, api_key, task_id in rows:
+            try:
+                result.append((job_uid, json.loads(payload), json.loads(meta) if meta else None, api_key, task_id))
+            except Exception as e:
+                print(f"Journal row skipped: {e}")
+        return result
+
+# ==========================================
+#      生图引擎
+# ==========================================
+class GenerationEngine:
+    def __init__(self, poller=None, rate_qps=DEFAULT_RATE_QPS, rate_burst=DEFAULT_RATE_BURST,
+                 max_retries=3, retry_base_delay=1.0, journal=None, max_active_submits=8, result_cache=None):
+        """
+        :param journal: / result_cache: 为 None 时自动创建 (需要 sqlite3)，传 False 表示不使用
+        """
+        self.poller = poller or TaskPoller()
+        self.journal = journal if journal is not None else (JobJournal() if HAS_SQLITE else None)
+        self.result_cache = result_cache if result_cache is not None else self._open_result_cache()
+        self.use_result_cache = True # 关闭后不查缓存，每次都调用 API (结果仍会写入缓存)
+        self.scheduler = KeyScheduler()
+        self.scheduler.on_capacity = self._notify_capacity
+        self._capacity_waiters = [] # 等待 Key 并发窗口空出名额的 Future
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_stats = collections.Counter() # 重试原因 -> 次数
+        self.rate_qps = rate_qps
+        self.rate_burst = rate_burst
+        self._buckets = {} # api_key -> TokenBucket
+
+        # 全局提交队列：T2I / I2I 的所有批次在这里按优先级排队领取提交名额
+        self.max_active_submits = max_active_submits
+        self._active_submits = 0
+        self._slot_waiters = [] # [(seq, job, future)]
+        self._slot_seq = itertools.count()
+
+    # ================= 外部接口 =================
+
+    def configure_rate_limit(self, qps, burst):
+        """设置每个 Key 的提交限流 (不同 Key 之间互不影响)"""
+        self.rate_qps = qps
+        self.rate_burst = burst
+        for bucket in self._buckets.values():
+            bucket.configure(qps, burst)
+
+    def configure_result_cache(self, enabled, max_mb=None):
+        """设置结果缓存开关与大小上限 (MB)"""
+        self.use_result_cache = bool(enabled)
+        if self.result_cache and max_mb:
+            self.result_cache.max_bytes = int(max_mb) * 1024 * 1024
+
+    def _open_result_cache(self):
+        if not cache_store.HAS_SQLITE: return None
+        try: return cache_store.ResultCache()
+        except Exception as e:
+            print(f"Result cache unavailable: {e}")
+            return None
+
+    def _get_bucket(self, api_key):
+        bucket = self._buckets.get(api_key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate_qps, self.rate_burst)
+            self._buckets[api_key] = bucket
+        return bucket
+
+    async def load_unfinished_jobs(self):
+        """
+        从任务日志恢复上次退出时仍在生成的任务 (已带 task_id)
+        返回 GenJob 列表，调用方挂好监听后再 submit()，引擎会跳过提交直接轮询
+        """
+        if not self.journal: return []
+        try:
+            rows = await executors.run_disk(self.journal.load_unfinished)
+        except Exception as e:
+            print(f"Journal load error: {e}")
+            return []
+        jobs = []
+        for job_uid, payload, meta, api_key, task_id in rows:
+            job = GenJob(payload, [api_key], meta=meta)
+            job.job_uid = job_uid
+            job.task_id = task_id
+            jobs.append(job)
+        return jobs
+
+    async def _journal(self, method_name, *args):
+        """写任务日志 (放到线程里，不阻塞事件循环；失败只打印)"""
+        if not self.journal: return
+        try: await executors.run_disk(getattr(self.journal, method_name), *args)
+        except Exception as e: print(f"Journal write error: {e}")
+
+    def submit(self, job):
+        """提交任务，返回 Future (完成时结果为 job 本身，失败不会抛异常)"""
+        loop = asyncio.get_running_loop()
+        job.future = loop.create_future()
+        job._task = asyncio.create_task(self._run_job(job))
+        return job.future
+
+    def cancel(self, job):
+        """
+        取消单个任务：立即中断提交 / 轮询 / 下载
+        (已提交的任务服务端仍会生成，但不再等待结果)
+        """
+        if job.future is None or job.future.done() or job.finished: return False
+        job.canceled = True
+        if job._task and not job._task.done(): job._task.cancel()
+        return True
+
+    def cancel_batch(self, batch):
+        """取消整批任务 (流式批次也不再创建新任务)，返回实际取消的数量"""
+        batch.canceled = True
+        batch.resume() # 让挂起中的流式循环醒来并退出
+        return sum(1 for job in list(batch.jobs) if self.cancel(job))
+
+    async def run_windowed(self, batch, total, make_job, window, on_done=None):
+        """
+        流式批量：同一批次最多保持 window 个任务在途，结束一个才创建下一个
+        适合成百上千张的批量，内存与并发只和 window 有关，与 total 无关
+        :param make_job: make_job(i) -> GenJob，任务真正开始时才调用 (调用方可在此创建卡片)
+        :param on_done: on_done(job)，任务结束后调用，之后引擎不再持有该任务
+        :return: batch.outcomes (最终状态 -> 数量)
+        """
+        slots = asyncio.Semaphore(max(1, int(window)))
+
+        def finished(job):
+            batch.outcomes[job.state] += 1
+            if job in batch.jobs: batch.jobs.remove(job)
+            slots.release()
+            if on_done:
+                try: on_done(job)
+                except Exception as e: print(f"Stream on_done error: {e}")
+
+        for i in range(total):
+            await slots.acquire()
+            # 暂停时连卡片都不创建，取消后停止派发
+            if batch.paused and not batch.canceled: await batch.wait_if_paused()
+            if batch.canceled:
+                slots.release()
+                break
+            job = batch.add(make_job(i))
+            self.submit(job).add_done_callback(lambda f, j=job: finished(j))
+
+        while batch.jobs:
+            # 用 wait 而不是 gather：调用方被取消时 gather 会连带取消任务的 future，任务就再也取消不掉了
+            await asyncio.wait([j.future for j in list(batch.jobs)])
+        return batch.outcomes
+
+    @property
+    def queued_count(self):
+        """在全局队列中等待提交的任务数"""
+        return len(self._slot_waiters)
+
+    async def iter_results(self, jobs):
+        """异步迭代器：按完成顺序依次产出 job"""
+        futures = [j.future if j.future else self.submit(j) for j in jobs]
+        for fut in asyncio.as_completed(futures):
+            yield await fut
+
+    # ================= 内部流程 =================
+
+    async def _run_job(self, job):
+        started_at = time.monotonic()
+        try:
+            if job.task_id:
+                # 从日志恢复的任务：已经提交过，直接继续轮询
+                # 任务已在服务端生成，Key 暂不可用 (冷却 / 额度 / 窗口已满) 也不等待，照常计入在途数
+                job.api_key = self.scheduler.pick(job.candidate_keys) or self.scheduler.acquire(job.candidate_keys[0])
+            elif await self._try_result_cache(job):
+                return
+            else:
+                await self._journal("record_queued", job)
+                await self._submit_with_retry(job)
+                await self._journal("record_submitted", job)
+            await self._wait_for_result(job)
+            self.scheduler.release(job.api_key, True, time.monotonic() - started_at)
+            await self._journal("record_finished", job, JOURNAL_SUCCEED)
+        except asyncio.CancelledError:
+            self.scheduler.release(job.api_key, False, count_outcome=False)
+            if not job.canceled:
+                # 不是用户取消 (例如程序退出时事件循环取消所有任务)：
+                # 日志保持 SUBMITTED，下次启动由 load_unfinished_jobs 恢复轮询
+                raise
+            # 由 cancel() 触发：任务归我们自己所有，这里吞掉取消并收尾
+            job.state = "CANCELED"
+            await self._journal("record_finished", job, JOURNAL_CANCELED)
+            await job.emit(EVENT_CANCELED)
+        except Exception as e:
+            self.scheduler.release(job.api_key, False)
+            job.state = "FAILED"
+            job.error = str(e)
+            if job.retries: job.error = f"{job.error} ({job.retry_summary})"
+            await self._journal("record_finished", job, JOURNAL_FAILED)
+            await job.emit(EVENT_FAILED, job.error)
+        finally:
+            if job.future and not job.future.done():
+                job.future.set_result(job)
+
+    async def _try_result_cache(self, job):
+        """请求体与某次已完成的任务完全一致时直接返回缓存图片，不提交也不占额度"""
+        if not (self.result_cache and self.use_result_cache) or job.bypass_cache: return False
+        try: path = await executors.run_disk(self.result_cache.get, cache_store.payload_key(job.payload))
+        except Exception as e:
+            print(f"Result cache lookup error: {e}")
+            return False
+        if not path: return False
+        job.state = "SUCCEED"
+        job.cache_hit = True
+        job.local_path = path
+        job.finished = True
+        await job.emit(EVENT_SUCCEEDED, path)
+        return True
+
+    async def _submit_with_retry(self, job):
+        """提交任务；限流/Key 异常换 Key 重试，5xx/网络错误退避后重试"""
+        excluded_keys = set()
+        while True:
+            # 批次暂停时在拿 Key 之前挂起，不占用额度也不占令牌
+            if job.batch and job.batch.paused:
+                await job.emit(EVENT_PAUSED)
+                await job.batch.wait_if_paused()
+            candidates = [k for k in job.candidate_keys if k not in excluded_keys] or job.candidate_keys
+
+            # 领到提交名额后再挑 Key，名额只覆盖 "挑 Key -> 拿到 task_id" 这一段
+            submitted, error = False, None
+            await self._acquire_submit_slot(job)
+            try:
+                # 排队期间批次被暂停：直接归还名额
+                if job.batch and job.batch.paused: continue
+                job.api_key = self.scheduler.pick(candidates)
+                if job.api_key: submitted = await self._submit(job)
+            except Exception as e:
+                error = e
+            finally:
+                self._release_submit_slot()
+
+            if submitted: return
+            if error is None:
+                if job.api_key:
+                    # 等令牌期间批次被暂停：归还 Key，回到循环开头挂起
+                    self.scheduler.release(job.api_key, False, count_outcome=False)
+                    job.api_key = None
+                    continue
+                # Key 只是在冷却就等它恢复，额度全部用完才真正失败
+                wait = self.scheduler.next_available_in(job.candidate_keys)
+                if wait is None: raise GenError("无可用 Key (今日额度已用完)")
+                if self.scheduler.window_full(job.candidate_keys):
+                    # 在途任务已达 AIMD 窗口上限：等有任务结束 (或冷却结束) 再试
+                    await self._wait_for_capacity(max(wait, 1.0))
+                else:
+                    await asyncio.sleep(wait + 0.05)
+                excluded_keys.clear()
+                continue
+
+            err = classify_submit_error(error)
+            if not err.retryable or len(job.retries) >= self.max_retries: raise err
+
+            # 服务端过载：先收缩该 Key 的并发窗口，窗口已到下限仍被限流才算 Key 的健康问题
+            count_outcome = err.failover
+            if err.throttled:
+                count_outcome = self.scheduler.on_backpressure(job.api_key) and err.failover
+            self.scheduler.release(job.api_key, False, count_outcome=count_outcome)
+            if err.failover: excluded_keys.add(job.api_key)
+            job.retries.append((err.reason, job.api_key))
+            self.retry_stats[err.reason] += 1
+            job.api_key = None
+            await job.emit(EVENT_RETRY, err.reason)
+
+            # 指数退避 + 抖动；换 Key 的情况只需短暂等待
+            delay = self.retry_base_delay * (2 ** (len(job.retries) - 1))
+            if err.failover and len(excluded_keys) < len(job.candidate_keys): delay = 0.1
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+
+    def _notify_capacity(self):
+        waiters, self._capacity_waiters = self._capacity_waiters, []
+        for fut in waiters:
+            if not fut.done(): fut.set_result(True)
+
+    async def _wait_for_capacity(self, timeout):
+        fut = asyncio.get_running_loop().create_future()
+        self._capacity_waiters.append(fut)
+        try: await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError: pass
+
+    async def _acquire_submit_slot(self, job):
+        """按批次优先级排队领取提交名额 (高优先级先提交，同级先来先到)"""
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (next(self._slot_seq), job, waiter)
+        self._slot_waiters.append(entry)
+        self._grant_submit_slots()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if entry in self._slot_waiters:
+                self._slot_waiters.remove(entry)
+            elif waiter.done() and not waiter.cancelled():
+                self._release_submit_slot() # 名额已发放但任务被取消，归还
+            raise
+
+    def _release_submit_slot(self):
+        self._active_submits = max(0, self._active_submits - 1)
+        self._grant_submit_slots()
+
+    def _grant_submit_slots(self):
+        # 优先级在排队期间可能被修改，每次发放时重新比较
+        while self._slot_waiters and self._active_submits < self.max_active_submits:
+            entry = min(self._slot_waiters, key=lambda w: (-w[1].priority, w[0]))
+            self._slot_waiters.remove(entry)
+            if entry[2].done(): continue
+            self._active_submits += 1
+            entry[2].set_result(True)
+
+    async def _submit(self, job):
+        """真正发出提交请求；拿到令牌时批次已暂停则不提交，返回 False"""
+        headers = {"Authorization": f"Bearer {job.api_key}", "Content-Type": "application/json"}
+
+        # 同一个 Key 按令牌桶限流，不同 Key 并行提交
+        await self._get_bucket(job.api_key).acquire()
+        if job.batch and job.batch.paused: return False
+        await job.emit(EVENT_SUBMITTING)
+
+        res = await http_client.get_client().post(
+            f"{utils.BASE_URL}v1/images/generations",
+            headers={**headers, "X-ModelScope-Async-Mode": "true"},
+            content=json.dumps(job.payload, ensure_ascii=False).encode('utf-8'),
+            timeout=20
+        )
+        res.raise_for_status()
+        job.task_id = res.json().get("task_id")
+        if not job.task_id: raise GenError("无TaskID")
+        self.scheduler.on_submit_ok(job.api_key)
+        await job.emit(EVENT_SUBMITTED, job.task_id)
+        return True
+
+    async def _wait_for_result(self, job):
+        # 交给统一轮询器，这里只等待状态变化
+        model = job.payload.get("model")
+        updates = self.poller.watch(job.task_id, job.api_key, model)
+        submitted_at = time.monotonic()
+        try:
+            while True:
+                kind, data = await updates.get()
+                if kind == "status":
+                    if job.state == "PENDING" and data != "PENDING":
+                        self._check_queue_time(job, model, time.monotonic() - submitted_at)
+                    job.state = data
+                    await job.emit(EVENT_STATUS, data)
+                elif kind == "done":
+                    await self._handle_success(job, data)
+                    return
+                else:
+                    raise GenError(data)
+        finally:
+            self.poller.unwatch(job.task_id)
+
+    def _check_queue_time(self, job, model, pending):
+        """排队时间明显高于该模型的历史中位数时，视为服务端背压，温和收缩窗口"""
+        stats = self.poller.stats
+        if stats.sample_count(model) < 10: return
+        baseline = stats.percentile(model, "pending", 50)
+        if baseline is not None and pending > max(baseline * 2.0, baseline + 5.0):
+            self.scheduler.on_backpressure(job.api_key, slow=True)
+
+    async def _handle_success(self, job, data):
+        job.state = "SUCCEED"
+        job.remote_url = extract_output_url(data)
+        if not job.remote_url: raise Exception("无输出图片")
+
+        await job.emit(EVENT_CACHING)
+        # 下载并保存到临时缓存，注入元数据；失败时降级为远程链接
+        job.local_path = await utils.save_to_cache(job.remote_url, job.meta)
+        job.finished = True
+        if self.result_cache and job.local_path:
+            try: await executors.run_disk(self.result_cache.put, cache_store.payload_key(job.payload), job.local_path)
+            except Exception as e: print(f"Result cache store error: {e}")
+        await job.emit(EVENT_SUCCEEDED, job.result_src)
+
+def extract_output_url(data):
+    """从任务结果中取出第一张图片的地址 (兼容 output_images / results 两种格式)"""
+    output_images = data.get("output_images", [])
+    if not output_images and "results" in data: output_images = data["results"]
+    if not output_images: return None
+    first = output_images[0]
+    return first.get("url", first) if isinstance(first, dict) else first
+
+# ==========================================
+#      全局共享引擎
+# ==========================================
+_shared_engine = None
+
+def get_engine():
+    """T2I / I2I 共用同一个引擎实例"""
+    global _shared_engine
+    if _shared_engine is None:
+        _shared_engine = GenerationEngine()
+    return _shared_engine
@@ -0,0 +1,347 @@
+import flet as ft
+import asyncio
+import random
+import collections
+import utils  # 引入公共工具模块
+import gen_engine  # 无 UI 的生图引擎
+import thumbnails  # 缩略图 (网格显示用)
+
+# ==========================================
+#      T2I / I2I 共用的批次与结果区逻辑
+# ==========================================
+# 说明：
+#   两个视图生成流程相同：点击一次 = 一个批次，交给共享引擎，按事件刷新结果卡片。
+#   批次的排队 / 角标 / 暂停取消 / 流式批量 / 结果分组都放在这里，视图只负责
+#   收集参数 (_snapshot_params) 与创建卡片 (_create_result_card_ui)。
+
+class GenBatchMixin:
+    """
+    使用方需要提供：page, power_config, primary_color, is_wide_mode,
+    results_grid, batch_slider, priority_btn, pause_btn, stop_btn, stream_progress_text, generate_bar,
+    以及 _create_result_card_ui() -> (card, img, status, btn_dl, btn_info, btn_browser, btn_edit)
+    """
+
+    def _init_batch_state(self):
+        self.engine = gen_engine.get_engine() # T2I / I2I 共用的生图引擎
+        self.generated_images_objs = [] # 存储结果Grid中的Image对象，用于传递给查看器
+        self.active_batches = [] # 本视图正在运行的批次 (用于暂停 / 取消)
+        self.result_groups = [] # 结果分组 (新批次在前): {"batch", "cards", "imgs"}
+        self.queue_priority = gen_engine.PRIORITY_NORMAL # 新批次的队列优先级
+        self.MAX_RESULT_GROUPS = 5 # 结果区最多保留的批次数 (旧结果可在历史记录查看)
+        self.STREAM_KEEP_CARDS = 60 # 流式批量中保留在界面上的已完成卡片数
+        self.stream_totals = {} # 运行中的流式批次 -> 总张数 (用于进度显示)
+
+    async def _run_batch(self, label, keys_to_use, is_power_mode, build_job):
+        """
+        新建一个批次并运行到结束 (每次点击都是一个新批次，进入 T2I / I2I 共用的全局队列)
+        :param build_job: build_job(i, context) -> GenJob，参数应来自点击时的快照
+        """
+        batch_count = int(self.batch_slider.value)
+        batch = gen_engine.GenBatch(label=label, priority=self.queue_priority)
+        queued_before = self.engine.queued_count
+        self.active_batches.append(batch)
+
+        try:
+            stream_total = self._stream_total(is_power_mode)
+            if stream_total:
+                # 流式超大批量：卡片与任务按窗口逐个创建
+                await self._sync_key_usage(keys_to_use, is_power_mode)
+                await self._run_stream_batch(batch, stream_total, build_job)
+            else:
+                await self._run_fixed_batch(batch, batch_count, queued_before, keys_to_use, is_power_mode, build_job)
+        except BaseException:
+            # 视图协程被取消或中途出错：已派发的任务一并取消，不留下无人管理的任务
+            self.engine.cancel_batch(batch)
+            raise
+        finally:
+            # 无论如何结束都要移出运行列表，暂停 / 取消按钮与结果分组回收才不会作用于已结束的批次
+            if batch in self.active_batches: self.active_batches.remove(batch)
+            self._set_batch_controls()
+
+    async def _run_fixed_batch(self, batch, batch_count, queued_before, keys_to_use, is_power_mode, build_job):
+        """普通批量：一次创建全部卡片并提交，等待全部结束"""
+        tasks_ui = []
+        cards = []
+        for i in range(batch_count):
+            # 注意：此处解构增加了 btn_edit
+            card, img, status, btn_dl, btn_info, btn_browser, btn_edit = self._create_result_card_ui()
+            card.content.controls.append(self._create_batch_badge(batch))
+            cards.append(card)
+            tasks_ui.append((img, status, btn_dl, btn_info, btn_browser, btn_edit))
+        
+        self._add_result_group(batch, cards, [t[0] for t in tasks_ui])
+        self.results_grid.update()
+        if queued_before:
+            self.page.snack_bar = ft.SnackBar(ft.Text(f"已加入队列 (优先级: {gen_engine.PRIORITY_LABELS[batch.priority]})，前面还有 {queued_before} 个任务"), open=True)
+            self.page.update()
+        
+        # 异步生成 (交给共享引擎，视图只负责订阅事件刷新卡片)
+        await self._sync_key_usage(keys_to_use, is_power_mode)
+        self._set_batch_controls()
+        for i in range(batch_count):
+            # Key 不再轮流分配，由引擎调度器按剩余额度与健康度挑选
+            job = batch.add(build_job(i, tasks_ui[i]))
+            job.add_listener(self._on_job_event)
+            tasks_ui[i][1].associated_cancel_btn.on_click = lambda e, j=job: self.engine.cancel(j)
+            # 提交节奏由引擎按 Key 令牌桶限流，这里不再固定 sleep
+            self.engine.submit(job)
+        
+        # 用 wait 而不是 gather：本协程被取消时不连带取消任务的 future，_run_batch 才能通过引擎取消这些任务
+        if batch.jobs: await asyncio.wait([j.future for j in batch.jobs])
+
+    def _stream_total(self, is_power_mode):
+        """强力模式开启流式批量时返回总张数，否则返回 0"""
+        if not (is_power_mode and self.power_config.get("stream_enabled", False)): return 0
+        return max(1, int(self.power_config.get("stream_total", 200)))
+
+    async def _run_stream_batch(self, batch, total, build_job):
+        """
+        流式超大批量：同时在途的任务数由 stream_window 限制
+        卡片在任务开始时才创建，完成的卡片超过 STREAM_KEEP_CARDS 后移出界面 (图片仍在缓存/历史记录中)
+        :param build_job: build_job(i, context) -> GenJob
+        """
+        group = self._add_result_group(batch, [], [])
+        self.results_grid.update()
+        self.stream_totals[batch] = total
+        self._set_batch_controls()
+
+        live_cards = {} # job_id -> (card, img)
+        done_cards = collections.deque()
+
+        def make_job(i):
+            card, img, status, btn_dl, btn_info, btn_browser, btn_edit = self._create_result_card_ui()
+            badge = self._create_batch_badge(batch)
+            card.content.controls.append(badge)
+            card.batch_badge = badge
+            job = build_job(i, (img, status, btn_dl, btn_info, btn_browser, btn_edit))
+            job.add_listener(self._on_job_event)
+            status.associated_cancel_btn.on_click = lambda e, j=job: self.engine.cancel(j)
+            live_cards[job.job_id] = (card, img)
+            group["cards"].append(card)
+            group["imgs"].append(img)
+            self._refresh_result_controls()
+            return job
+
+        def on_done(job):
+            done_cards.append(live_cards.pop(job.job_id))
+            while len(done_cards) > self.STREAM_KEEP_CARDS:
+                card, img = done_cards.popleft()
+                group["cards"].remove(card)
+                group["imgs"].remove(img)
+                if card.batch_badge.badge_text in batch.badge_texts: batch.badge_texts.remove(card.batch_badge.badge_text)
+            self._refresh_result_controls()
+            self._set_batch_controls()
+
+        window = int(self.power_config.get("stream_window", 10))
+        try:
+            outcomes = await self.engine.run_windowed(batch, total, make_job, window, on_done)
+        finally:
+            self.stream_totals.pop(batch, None)
+        self.page.snack_bar = ft.SnackBar(ft.Text(f"流式批量 #{batch.batch_id} 结束: 成功 {outcomes['SUCCEED']}，失败 {outcomes['FAILED']}，取消 {outcomes['CANCELED']}"), open=True)
+        self.page.update()
+
+    def _add_result_group(self, batch, cards, imgs):
+        """新批次的结果组放在最前面，超出上限时移除最旧的已结束组"""
+        group = {"batch": batch, "cards": cards, "imgs": imgs}
+        self.result_groups.insert(0, group)
+        while len(self.result_groups) > self.MAX_RESULT_GROUPS:
+            old = next((g for g in reversed(self.result_groups) if g is not group and g["batch"] not in self.active_batches), None)
+            if old is None: break
+            self.result_groups.remove(old)
+        self._refresh_result_controls(update=False)
+        return group
+
+    def _refresh_result_controls(self, update=True):
+        """按分组顺序重建结果区"""
+        self.results_grid.controls = [c for g in self.result_groups for c in g["cards"]]
+        # 查看器按界面顺序浏览
+        self.generated_images_objs = [img for g in self.result_groups for img in g["imgs"]]
+        if update:
+            try: self.results_grid.update()
+            except: pass
+
+    def _create_batch_badge(self, batch):
+        """卡片左上角的批次角标，点击可单独控制该批次"""
+        def toggle_pause(e):
+            if batch.paused: batch.resume()
+            else: batch.pause()
+            self._set_batch_controls()
+
+        def set_priority(priority):
+            batch.priority = priority
+            for t in batch.badge_texts:
+                t.value = self._batch_badge_text(batch)
+                try: t.update()
+                except: pass
+
+        badge_text = ft.Text(self._batch_badge_text(batch), size=10, color="white")
+        if not hasattr(batch, "badge_texts"): batch.badge_texts = []
+        batch.badge_texts.append(badge_text)
+        menu = ft.PopupMenuButton(
+            content=ft.Container(content=badge_text, bgcolor=utils.get_opacity_color(0.45, "black"), padding=ft.padding.symmetric(horizontal=6, vertical=2), border_radius=8),
+            tooltip="批次操作",
+            items=[
+                ft.PopupMenuItem(text="暂停 / 继续本批", on_click=toggle_pause),
+                ft.PopupMenuItem(text="取消本批", on_click=lambda e: self.engine.cancel_batch(batch)),
+                ft.PopupMenuItem(text="设为高优先级", on_click=lambda e: set_priority(gen_engine.PRIORITY_HIGH)),
+                ft.PopupMenuItem(text="设为普通优先级", on_click=lambda e: set_priority(gen_engine.PRIORITY_NORMAL)),
+            ]
+        )
+        badge = ft.Container(content=menu, left=4, top=4)
+        badge.badge_text = badge_text
+        return badge
+
+    def _batch_badge_text(self, batch):
+        label = f"#{batch.batch_id}"
+        if batch.priority != gen_engine.PRIORITY_NORMAL: label += f" {gen_engine.PRIORITY_LABELS[batch.priority]}"
+        return label
+
+    def _set_queue_priority(self, priority):
+        self.queue_priority = priority
+        self.priority_btn.tooltip = f"队列优先级: {gen_engine.PRIORITY_LABELS[priority]}"
+        self.priority_btn.icon_color = {gen_engine.PRIORITY_HIGH: "amber", gen_engine.PRIORITY_LOW: "grey"}.get(priority, self.primary_color)
+        self.priority_btn.update()
+
+    def _set_batch_controls(self):
+        """有批次运行时显示暂停/停止按钮 (作用于本视图所有运行中的批次)"""
+        running = bool(self.active_batches)
+        all_paused = running and all(b.paused for b in self.active_batches)
+        self.pause_btn.visible = running
+        self.pause_btn.icon = "play_arrow" if all_paused else "pause"
+        self.pause_btn.tooltip = "继续提交" if all_paused else "暂停提交"
+        self.stop_btn.visible = running
+        # 流式批量进度
+        self.stream_progress_text.visible = bool(self.stream_totals)
+        if self.stream_totals:
+            finished = sum(sum(b.outcomes.values()) for b in self.stream_totals)
+            self.stream_progress_text.value = f"{finished}/{sum(self.stream_totals.values())}"
+        try: self.generate_bar.update()
+        except: pass
+
+    def _toggle_pause_batch(self, e):
+        if not self.active_batches: return
+        if all(b.paused for b in self.active_batches):
+            for b in self.active_batches: b.resume()
+        else:
+            for b in self.active_batches: b.pause()
+        self._set_batch_controls()
+
+    def _stop_batch(self, e):
+        if not self.active_batches: return
+        count = sum(self.engine.cancel_batch(b) for b in list(self.active_batches))
+        self.page.snack_bar = ft.SnackBar(ft.Text(f"已取消 {count} 个任务"), open=True)
+        self.page.update()
+
+    async def _sync_key_usage(self, keys, is_power_mode):
+        """把今日用量与每日额度同步给调度器 (额度仅在强力模式下生效)"""
+        daily_limit = int(self.power_config.get("daily_limit", 200)) if is_power_mode else None
+        for k in keys:
+            used = await utils.get_api_usage(self.page, k)
+            self.engine.scheduler.set_usage(k, used, daily_limit)
+
+    def _build_payload(self, params, idx):
+        """由参数快照构建第 idx 张图的请求体，只有种子随序号变化"""
+        seed_val = params["seed"]
+        if seed_val is None: seed_val = random.randint(1, 10000000)
+        payload = dict(params)
+        payload["seed"] = seed_val + idx
+        return payload
+
+    async def _on_job_event(self, job, event, data):
+        """引擎事件回调：把任务进度映射到结果卡片"""
+        img_ref, status_ref, dl_ref, info_ref, browser_ref, edit_ref = job.context
+        
+        def toggle_ring(visible):
+            if hasattr(status_ref, "associated_ring"):
+                status_ref.associated_ring.visible = visible
+                try: status_ref.associated_ring.update()
+                except: pass
+
+        def hide_cancel_btn():
+            # 任务结束 (成功/失败/取消) 后不再需要取消按钮
+            if hasattr(status_ref, "associated_cancel_btn"):
+                status_ref.associated_cancel_btn.visible = False
+                try: status_ref.associated_cancel_btn.update()
+                except: pass
+
+        if event == gen_engine.EVENT_SUBMITTING:
+            toggle_ring(True)
+            status_ref.value = "提交中..."
+            status_ref.color = self.primary_color
+            status_ref.update()
+
+        elif event == gen_engine.EVENT_RETRY:
+            status_ref.value = f"重试中({len(job.retries)})..."
+            status_ref.tooltip = job.retry_summary
+            status_ref.update()
+
+        elif event == gen_engine.EVENT_STATUS:
+            status_ref.value = f"{utils.STATUS_TRANSLATIONS.get(data, data)}..." 
+            status_ref.update()
+
+        elif event == gen_engine.EVENT_PAUSED:
+            status_ref.value = "已暂停"
+            status_ref.update()
+
+        elif event == gen_engine.EVENT_CACHING:
+            toggle_ring(False)
+            status_ref.value = "缓存中..."
+            status_ref.update()
+
+        elif event == gen_engine.EVENT_SUCCEEDED:
+            hide_cancel_btn()
+            # 缓存成功时为本地路径，失败时降级为远程链接
+            # 卡片显示缩略图，查看器 / 下载 / 发送到编辑使用原图
+            img_ref.original_src = data
+            img_ref.src = await thumbnails.ensure_thumbnail(data, thumbnails.GRID_THUMB_WIDTH)
+            # 无论哪种情况，数据对象都挂载上去
+            img_ref.data = job.meta 
+            img_ref.visible = True
+            
+            # 注意：虽然在缓存里，但对于“下载到 T2I 文件夹”这个按钮来说，它还没“下载”
+            # 但为了体验，我们不自动禁用下载按钮，让用户决定是否保存到 T2I
+            img_ref.is_downloaded = False
+            
+            info_ref.visible = True
+            edit_ref.visible = True 
+            
+            # 更新下载按钮可见性
+            if self.is_wide_mode:
+                dl_ref.visible = True
+                browser_ref.visible = False
+            else:
+                dl_ref.visible = False
+                browser_ref.visible = True
+
+            status_ref.value = "" 
+            status_ref.tooltip = job.retry_summary or None
+            img_ref.update()
+            dl_ref.update()
+            info_ref.update()
+            browser_ref.update()
+            edit_ref.update()
+            status_ref.update()
+            
+            if job.cache_hit:
+                # 命中结果缓存：没有调用 API，不计入 Key 用量
+                if hasattr(status_ref, "associated_cache_badge"):
+                    status_ref.associated_cache_badge.visible = True
+                    status_ref.associated_cache_badge.update()
+            else:
+                # 记录 API Key 使用次数
+                await utils.increment_api_usage(self.page, job.api_key)
+
+        elif event == gen_engine.EVENT_FAILED:
+            toggle_ring(False)
+            hide_cancel_btn()
+            status_ref.value = "失败"
+            status_ref.tooltip = data
+            status_ref.color = "red"
+            status_ref.update()
+
+        elif event == gen_engine.EVENT_CANCELED:
+            toggle_ring(False)
+            hide_cancel_btn()
+            status_ref.value = "已取消"
+            status_ref.color = "grey"
+            status_ref.update()
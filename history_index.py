@@ -0,0 +1,234 @@
+import os
+import re
+import json
+import time
+import threading
+
+try:
+    import sqlite3
+    HAS_SQLITE = True
+except ImportError:
+    HAS_SQLITE = False
+
+# ==========================================
+#      历史记录索引 (路径 / 大小 / 尺寸 / 修改时间 / 元数据)
+# ==========================================
+# 说明：
+#   历史页每次刷新都要把缓存里的 PNG 整张读一遍再解析元数据，图一多就卡 UI。
+#   这里把每张图的基本信息与解析好的元数据存进 SQLite，
+#   写入缓存时顺手更新 (utils.save_to_cache)，刷新历史只需一次按时间倒序的查询。
+#   手动删除 / 淘汰造成的差异由后台的 utils.sync_history_index 定期对账。
+#   另有一张倒排表 terms(词, 路径)，覆盖元数据里的 提示词 / 负面提示词 / 模型，
+#   搜索时每个词按前缀在主键上做范围查找：有罕见词时取交集，全是常见词时沿时间顺序逐条确认。
+
+SEARCH_FIELDS = ("prompt", "negative_prompt", "model")
+SELECTIVE_TERM_LIMIT = 2000  # 命中数少于该值的词走倒排表取候选，否则沿时间顺序逐条确认
+_WORD_RE = re.compile(r"[0-9a-z_]+|[\u3400-\u9fff\uf900-\ufaff]+")
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+
+def tokenize(text, unigrams=False):
+    """
+    拆词：英文 / 数字按单词 (小写)，中文没有空格，按相邻两字切分 (单字成词时保留单字)
+    例如 "a cat, 橘色小猫" -> a, cat, 橘色, 色小, 小猫
+    :param unigrams: 为 True 时中文再额外拆出每个单字 (建索引用，这样单字搜索 "猫" 也能命中 "小猫")
+    """
+    terms = []
+    for word in _WORD_RE.findall((text or "").lower()):
+        if _CJK_RE.match(word) and len(word) > 1:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+            if unigrams: terms.extend(word)
+        else:
+            terms.append(word)
+    return terms
+
+def _prefix_range(token):
+    """前缀匹配转成主键上的范围 [token, token + 最大字符)"""
+    return token, token + "\U0010ffff"
+
+def metadata_terms(metadata):
+    """元数据中可搜索字段的词集合"""
+    if not isinstance(metadata, dict): return set()
+    terms = set()
+    for field in SEARCH_FIELDS:
+        value = metadata.get(field)
+        if isinstance(value, str): terms.update(tokenize(value, unigrams=True))
+    return terms
+
+def metadata_model(metadata):
+    return metadata.get("model") if isinstance(metadata, dict) and isinstance(metadata.get("model"), str) else None
+
+def matches(entry, text=None, model=None, size=None, since=None):
+    """内存中判断一条记录是否满足搜索条件 (与 HistoryIndex.query 的规则一致，用于增量插入)"""
+    if model and metadata_model(entry.get("metadata")) != model: return False
+    if size and (entry.get("width"), entry.get("height")) != tuple(size): return False
+    if since and entry.get("mtime", 0) < since: return False
+    if text:
+        terms = metadata_terms(entry.get("metadata"))
+        for token in tokenize(text):
+            if not any(term.startswith(token) for term in terms): return False
+    return True
+
+class HistoryIndex:
+    def __init__(self, db_path):
+        """
+        :param db_path: SQLite 数据库文件路径
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL,"
+                " width INTEGER, height INTEGER, metadata TEXT, model TEXT, indexed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_images_mtime ON images(mtime)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_images_model ON images(model)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS terms (term TEXT NOT NULL, path TEXT NOT NULL,"
+                " PRIMARY KEY (term, path)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_terms_path ON terms(path, term)")
+
+    # ================= 写入 =================
+
+    def upsert(self, path, size, mtime, width=None, height=None, metadata=None):
+        """新增或覆盖一条记录 (metadata 为已解析的字典)"""
+        self.upsert_many([(path, size, mtime, width, height, metadata)])
+
+    def upsert_many(self, rows):
+        """批量写入 [(路径, 大小, 修改时间, 宽, 高, 元数据)]"""
+        now = time.time()
+        params = [
+            (path, size, mtime, width, height, json.dumps(metadata, ensure_ascii=False) if metadata is not None else None,
+             metadata_model(metadata), now)
+            for path, size, mtime, width, height, metadata in rows
+        ]
+        if not params: return
+        terms = [(term, row[0]) for row in rows for term in metadata_terms(row[5])]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM terms WHERE path = ?", [(p[0],) for p in params])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO images (path, size, mtime, width, height, metadata, model, indexed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", params
+            )
+            self._conn.executemany("INSERT OR IGNORE INTO terms (term, path) VALUES (?, ?)", terms)
+
+    def touch(self, path, mtime):
+        """内容未变只刷新修改时间 (重复保存时排到最前)，返回是否存在该记录"""
+        with self._lock, self._conn:
+            cur = self._conn.execute("UPDATE images SET mtime = ? WHERE path = ?", (mtime, path))
+            return cur.rowcount > 0
+
+    def remove(self, paths):
+        """删除一批路径对应的记录"""
+        if not paths: return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in paths])
+            self._conn.executemany("DELETE FROM terms WHERE path = ?", [(p,) for p in paths])
+
+    # ================= 查询 =================
+
+    def query(self, limit=None, offset=0, text=None, model=None, size=None, since=None):
+        """
+        按修改时间倒序返回 [{path, size, mtime, width, height, metadata}]
+        :param text: 搜索词，拆词后每个词都要 (按前缀) 出现在 提示词 / 负面提示词 / 模型 中
+        :param model: 只要该模型生成的图片
+        :param size: (宽, 高)
+        :param since: 只要修改时间不早于该时间戳的图片
+        """
+        where, params = [], []
+        tokens = sorted(set(tokenize(text))) if text else []
+        if tokens:
+            with self._lock:
+                counts = [self._count_term(token) for token in tokens]
+            if min(counts) < SELECTIVE_TERM_LIMIT:
+                # 有罕见词：先用倒排表取出少量候选 (每个词一次主键范围扫描，INTERSECT 取交集)，再按时间排序
+                subqueries = " INTERSECT ".join(["SELECT path FROM terms WHERE term >= ? AND term < ?"] * len(tokens))
+                where.append(f"path IN ({subqueries})")
+                for token in tokens: params.extend(_prefix_range(token))
+            else:
+                # 全是常见词：沿时间索引从新到旧扫描，逐条用 (路径, 词) 索引确认，凑够一页即停
+                for token in tokens:
+                    where.append("EXISTS (SELECT 1 FROM terms t WHERE t.path = images.path AND t.term >= ? AND t.term < ?)")
+                    params.extend(_prefix_range(token))
+        if model:
+            where.append("model = ?")
+            params.append(model)
+        if size:
+            where.append("width = ? AND height = ?")
+            params.extend(size)
+        if since:
+            where.append("mtime >= ?")
+            params.append(since)
+
+        sql = "SELECT path, size, mtime, width, height, metadata FROM images"
+        if where: sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY mtime DESC"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend((int(limit), int(offset)))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def _count_term(self, token):
+        """前缀匹配的记录数 (数到 SELECTIVE_TERM_LIMIT 为止)，用于选择查询方式"""
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM terms WHERE term >= ? AND term < ? LIMIT ?)",
+            (*_prefix_range(token), SELECTIVE_TERM_LIMIT)
+        ).fetchone()[0]
+
+    def facets(self):
+        """筛选项：{models: [模型], sizes: [(宽, 高)]}，按图片数量从多到少"""
+        with self._lock:
+            models = [row[0] for row in self._conn.execute(
+                "SELECT model FROM images WHERE model IS NOT NULL GROUP BY model ORDER BY COUNT(*) DESC")]
+            sizes = [(w, h) for w, h in self._conn.execute(
+                "SELECT width, height FROM images WHERE width IS NOT NULL GROUP BY width, height ORDER BY COUNT(*) DESC")]
+        return {"models": models, "sizes": sizes}
+
+    def get(self, path):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, size, mtime, width, height, metadata FROM images WHERE path = ?", (path,)
+            ).fetchone()
+        return self._row_to_entry(row) if row else None
+
+    def known(self):
+        """{路径: (修改时间, 大小)}，供对账使用"""
+        with self._lock:
+            return {path: (mtime, size) for path, mtime, size in self._conn.execute("SELECT path, mtime, size FROM images")}
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    @staticmethod
+    def _row_to_entry(row):
+        path, size, mtime, width, height, metadata = row
+        try: meta = json.loads(metadata) if metadata else None
+        except ValueError: meta = None
+        return {"path": path, "size": size, "mtime": mtime, "width": width, "height": height, "metadata": meta}
+
+# ==========================================
+#      按数据库文件共享的索引实例
+# ==========================================
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(db_path):
+    """打开 (或复用) 索引；没有 sqlite3 或数据库无法打开时返回 None"""
+    if not HAS_SQLITE: return None
+    key = os.path.abspath(db_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            try:
+                index = HistoryIndex(key)
+            except Exception as e:
+                print(f"History index unavailable: {e}")
+                return None
+            _indexes[key] = index
+        return index
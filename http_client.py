@@ -0,0 +1,218 @@
+import asyncio
+import contextlib
+import collections
+import httpx
+from urllib.parse import urlsplit
+
+# ==========================================
+#      共享异步 HTTP 客户端 (连接池 + Keep-Alive)
+# ==========================================
+# 说明：
+#   所有对 utils.BASE_URL 的提交/轮询，以及图片上传/下载都走这里。
+#   同一个 Host 的请求复用 TLS 连接，不再每次握手，也不占用线程池。
+
+DEFAULT_POOL_CONFIG = {
+    "max_connections": 32,     # 全局连接上限
+    "max_keepalive": 16,       # 空闲保活连接上限
+    "per_host_limit": 16,      # 单个 Host 的并发请求上限
+    "keepalive_expiry": 30.0,  # 空闲连接保活时间 (秒)
+}
+
+class PooledHttpClient:
+    def __init__(self, **pool_config):
+        self.pool_config = dict(DEFAULT_POOL_CONFIG)
+        self.pool_config.update({k: v for k, v in pool_config.items() if k in DEFAULT_POOL_CONFIG})
+
+        self._client = None
+        self._client_loop = None
+        self._client_users = {}    # 客户端 -> 正在使用它的请求数
+        self._retiring = set()     # 配置变更后被替换、等在途请求结束再关闭的旧客户端
+        self._host_active = collections.Counter() # Host -> 正在进行的请求数 (新旧客户端合计)
+        self._host_waiters = {}    # Host -> 等待名额的 Future 队列
+
+        # 连接复用统计
+        self.total_requests = 0
+        self.new_connections = 0
+        self.host_stats = {} # host -> {"requests": n, "connections": n}
+
+    # ================= 配置 =================
+
+    def configure(self, **pool_config):
+        """
+        更新连接池配置：之后的请求使用新连接池，旧连接池上的请求 (提交 / 轮询 / 流式下载) 照常完成后再关闭
+        单 Host 并发上限立即生效，正在进行的请求仍计入新上限
+        """
+        changed = False
+        for k, v in pool_config.items():
+            if k in DEFAULT_POOL_CONFIG and v is not None and self.pool_config.get(k) != v:
+                self.pool_config[k] = v
+                changed = True
+        if changed:
+            old_client = self._client
+            self._client = None
+            if old_client is not None: self._retire(old_client)
+            # 上限可能调大了：唤醒所有等待者重新判断
+            for host in list(self._host_waiters): self._wake_host(host, wake_all=True)
+
+    def _get_client(self):
+        loop = asyncio.get_running_loop()
+        # 客户端与事件循环绑定，循环变化时重建
+        if self._client is None or self._client_loop is not loop:
+            limits = httpx.Limits(
+                max_connections=int(self.pool_config["max_connections"]),
+                max_keepalive_connections=int(self.pool_config["max_keepalive"]),
+                keepalive_expiry=float(self.pool_config["keepalive_expiry"]),
+            )
+            if self._client_loop is not loop:
+                # 旧事件循环上的计数与等待者已经失效
+                self._client_users = {}
+                self._retiring = set()
+                self._host_active = collections.Counter()
+                self._host_waiters = {}
+            self._client = httpx.AsyncClient(limits=limits, follow_redirects=True)
+            self._client_loop = loop
+        return self._client
+
+    # ================= 旧客户端延迟关闭 =================
+
+    def _use_client(self):
+        client = self._get_client()
+        self._client_users[client] = self._client_users.get(client, 0) + 1
+        return client
+
+    def _release_client(self, client):
+        users = self._client_users.get(client, 0) - 1
+        if users > 0:
+            self._client_users[client] = users
+            return
+        self._client_users.pop(client, None)
+        if client in self._retiring:
+            self._retiring.discard(client)
+            self._close_later(client)
+
+    def _retire(self, client):
+        """配置变更替换下来的客户端：没有在途请求就立即关闭，否则等最后一个请求结束"""
+        if self._client_users.get(client): self._retiring.add(client)
+        else: self._close_later(client)
+
+    @staticmethod
+    def _close_later(client):
+        try: asyncio.get_running_loop().create_task(client.aclose())
+        except RuntimeError: pass
+
+    # ================= 单 Host 并发上限 =================
+
+    async def _acquire_host(self, host):
+        # 每次都读取当前配置，configure 之后正在进行的请求照样占用新上限的名额
+        while self._host_active[host] >= max(1, int(self.pool_config["per_host_limit"])):
+            fut = asyncio.get_running_loop().create_future()
+            waiters = self._host_waiters.setdefault(host, collections.deque())
+            waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut in waiters: waiters.remove(fut)
+                elif fut.done() and not fut.cancelled(): self._wake_host(host) # 已被唤醒却取消了，让给下一个
+                raise
+        self._host_active[host] += 1
+
+    def _release_host(self, host):
+        self._host_active[host] -= 1
+        if self._host_active[host] <= 0: del self._host_active[host]
+        self._wake_host(host)
+
+    def _wake_host(self, host, wake_all=False):
+        waiters = self._host_waiters.get(host)
+        while waiters:
+            fut = waiters.popleft()
+            if fut.done(): continue
+            fut.set_result(True)
+            if not wake_all: break
+        if not waiters: self._host_waiters.pop(host, None)
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, host):
+        """占用一个 Host 名额与当前客户端，结束时归还 (旧客户端最后一个请求结束时关闭)"""
+        await self._acquire_host(host)
+        try:
+            client = self._use_client()
+            try: yield client
+            finally: self._release_client(client)
+        finally:
+            self._release_host(host)
+
+    # ================= 请求 =================
+
+    async def request(self, method, url, timeout=30, **kwargs):
+        """
+        发送请求并读取完整响应体
+        :param kwargs: 透传给 httpx (headers / content / json / files / params)
+        """
+        host = urlsplit(url).netloc
+        self._count_request(host)
+        extensions = {"trace": self._make_tracer(host)}
+        async with self._slot(host) as client:
+            return await client.request(method, url, timeout=timeout, extensions=extensions, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, url, timeout=30, **kwargs):
+        """
+        流式请求：响应体不预先读入内存，调用方用 response.aiter_bytes() 分块读取
+        用法: async with client.stream("GET", url) as res: ...
+        """
+        host = urlsplit(url).netloc
+        self._count_request(host)
+        extensions = {"trace": self._make_tracer(host)}
+        async with self._slot(host) as client:
+            async with client.stream(method, url, timeout=timeout, extensions=extensions, **kwargs) as res:
+                yield res
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        retiring, self._retiring = list(self._retiring), set()
+        for client in retiring: await client.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ================= 统计 =================
+
+    def _count_request(self, host):
+        self.total_requests += 1
+        stats = self.host_stats.setdefault(host, {"requests": 0, "connections": 0})
+        stats["requests"] += 1
+
+    def _make_tracer(self, host):
+        async def trace(event_name, info):
+            # 只有新建 TCP 连接时才会触发 connect_tcp，复用的连接不会
+            if event_name == "connection.connect_tcp.complete":
+                self.new_connections += 1
+                self.host_stats.setdefault(host, {"requests": 0, "connections": 0})["connections"] += 1
+        return trace
+
+    def get_stats(self):
+        """返回连接复用统计 (reused = 请求数 - 新建连接数)"""
+        reused = max(0, self.total_requests - self.new_connections)
+        return {
+            "requests": self.total_requests,
+            "new_connections": self.new_connections,
+            "reused": reused,
+            "reuse_rate": (reused / self.total_requests) if self.total_requests else 0.0,
+            "hosts": {h: dict(s) for h, s in self.host_stats.items()},
+        }
+
+# ==========================================
+#      全局共享客户端
+# ==========================================
+_shared_client = None
+
+def get_client():
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = PooledHttpClient()
+    return _shared_client
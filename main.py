@@ -1,6 +1,10 @@
 import flet as ft
 import asyncio
 import utils
+import http_client
+import gen_engine
+import executors
+import cache_store
 from components import ImageViewer
 
 # 引入功能模块
@@ -22,7 +26,7 @@ async def main(page: ft.Page):
     # 启动本地图片服务器
     utils.start_local_server()
     
-    # 【新增】启动时初始化缓存系统 (清理旧缓存)
+    # 启动时只确保缓存文件夹存在；清理 / 淘汰在首帧显示后于后台进行
     utils.init_cache_system()
 
     # ================= 2. 读取全局配置 =================
@@ -34,6 +38,24 @@ async def main(page: ft.Page):
     current_theme_color_name = config["theme_color_name"]
     current_theme_mode = config["theme_mode"]
     current_power_config = config["power_mode_config"] 
+    current_http_pool_config = config["http_pool_config"]
+    current_executor_config = config["executor_config"]
+    current_session_cache_config = config["session_cache_config"]
+    
+    # 应用连接池配置 (所有 ModelScope 请求共用)
+    http_client.get_client().configure(**current_http_pool_config)
+    # 应用网络 / 磁盘 / 图片编解码执行器配置
+    executors.configure(**current_executor_config)
+    # 应用每个 Key 的提交限流
+    gen_engine.get_engine().configure_rate_limit(
+        float(current_power_config.get("rate_qps", gen_engine.DEFAULT_RATE_QPS)),
+        int(current_power_config.get("rate_burst", gen_engine.DEFAULT_RATE_BURST))
+    )
+    # 应用结果缓存开关与大小上限
+    gen_engine.get_engine().configure_result_cache(
+        current_power_config.get("result_cache_enabled", True),
+        current_power_config.get("result_cache_mb", cache_store.DEFAULT_RESULT_CACHE_MB)
+    )
     
     current_primary_color = utils.MORANDI_COLORS.get(current_theme_color_name, "#D0A467")
     current_text_color = utils.get_text_color(current_theme_mode)
@@ -143,7 +165,7 @@ async def main(page: ft.Page):
             dots_row.visible = False
             
             # 刷新历史记录
-            history_app.refresh_history()
+            page.run_task(history_app.refresh_history)
         else:
             t2i_slider_container.visible = True
             history_container.visible = False
@@ -683,10 +705,18 @@ async def main(page: ft.Page):
     api_keys_field = ft.TextField(label="ModelScope Keys (每行一个)", value="\n".join(current_api_keys), multiline=True, min_lines=10, max_lines=25, text_size=12, content_padding=15, border_color=utils.get_border_color(current_theme_mode))
     baidu_config_field = ft.TextField(label="百度翻译配置 (第一行AppID，第二行密钥)", value=f"{current_baidu_config.get('appid','')}\n{current_baidu_config.get('key','')}", multiline=True, text_size=12, content_padding=10, height=90, border_color=utils.get_border_color(current_theme_mode))
 
+    cache_clear_on_start_switch = ft.Switch(label="启动时清空会话缓存", value=False, active_color="amber")
+    cache_max_mb_field = ft.TextField(label="会话缓存上限 (MB，超出后自动删除最旧的图片)", value="2048", keyboard_type="number", text_size=12, height=40, content_padding=10, border_color=utils.get_border_color(current_theme_mode))
+
     async def save_settings(e):
         nonlocal current_api_keys, current_baidu_config
         await utils.save_config_to_storage(page, "api_keys", api_keys_field.value)
         await utils.save_config_to_storage(page, "baidu_config", baidu_config_field.value)
+        # 会话缓存配置原地更新，后台淘汰任务下一轮即生效
+        current_session_cache_config["clear_on_start"] = cache_clear_on_start_switch.value
+        try: current_session_cache_config["max_mb"] = max(64, int(cache_max_mb_field.value))
+        except: pass
+        await utils.save_config_to_storage(page, "session_cache_config", dict(current_session_cache_config))
         new_config = await utils.load_global_config(page)
         current_api_keys = new_config["api_keys"]
         current_baidu_config = new_config["baidu_config"]
@@ -699,19 +729,38 @@ async def main(page: ft.Page):
     def open_settings_dialog(e):
         api_keys_field.value = "\n".join(current_api_keys)
         baidu_config_field.value = f"{current_baidu_config.get('appid','')}\n{current_baidu_config.get('key','')}"
-        settings_dialog.content = ft.Column([api_keys_field, ft.Container(height=15), baidu_config_field], tight=True, scroll=ft.ScrollMode.AUTO, width=300, spacing=0)
+        cache_clear_on_start_switch.value = current_session_cache_config.get("clear_on_start", False)
+        cache_max_mb_field.value = str(current_session_cache_config.get("max_mb", utils.DEFAULT_SESSION_CACHE_CONFIG["max_mb"]))
+        settings_dialog.content = ft.Column([
+            api_keys_field, ft.Container(height=15), baidu_config_field,
+            ft.Container(height=15), cache_max_mb_field, cache_clear_on_start_switch
+        ], tight=True, scroll=ft.ScrollMode.AUTO, width=300, spacing=0)
         settings_dialog.actions = [ft.TextButton("保存", on_click=save_settings)]
         utils.safe_open_dialog(page, settings_dialog)
 
     # ------------------ 强力模式相关逻辑 ------------------
     pm_enabled_switch = ft.Switch(label="启用强力生图", value=False, active_color="amber")
     pm_batch_slider = ft.Slider(min=1, max=50, divisions=49, label="{value}", value=10, active_color="amber")
-    pm_delay_slider = ft.Slider(min=0.1, max=3.0, divisions=29, label="{value}秒", value=0.2, active_color="amber")
+    pm_qps_slider = ft.Slider(min=0.2, max=10.0, divisions=49, label="{value}次/秒", value=2.0, active_color="amber")
+    pm_burst_slider = ft.Slider(min=1, max=10, divisions=9, label="{value}", value=3, active_color="amber")
+    pm_stream_switch = ft.Switch(label="流式超大批量 (边生成边创建卡片)", value=False, active_color="amber")
+    pm_stream_total_field = ft.TextField(label="流式总张数 (最多 10000)", value="200", keyboard_type="number", text_size=12, height=40, content_padding=10)
+    pm_stream_window_slider = ft.Slider(min=1, max=50, divisions=49, label="在途 {value}", value=10, active_color="amber")
     pm_keys_container = ft.Column([], spacing=2)
     pm_limit_field = ft.TextField(label="每日API Key可调用的次数", value="200", keyboard_type="number", text_size=12, height=40, content_padding=10)
+    pm_pool_size_field = ft.TextField(label="连接池大小", value="32", keyboard_type="number", text_size=12, height=40, content_padding=10, expand=True)
+    pm_host_limit_field = ft.TextField(label="单Host并发", value="16", keyboard_type="number", text_size=12, height=40, content_padding=10, expand=True)
+    pm_pool_stats_text = ft.Text("", size=10, color="grey")
+    pm_aimd_text = ft.Text("", size=10, color="grey")
+    aimd_refresh_task = None # 对话框打开期间的状态刷新循环 (page.run_task 返回的 Future)
+    pm_result_cache_switch = ft.Switch(label="结果缓存 (相同参数直接复用，不消耗额度)", value=True, active_color="amber")
+    pm_result_cache_mb_field = ft.TextField(label="结果缓存上限 (MB)", value="1024", keyboard_type="number", text_size=12, height=40, content_padding=10)
+    pm_result_cache_stats_text = ft.Text("", size=10, color="grey")
+    pm_cpu_process_switch = ft.Switch(label="图片编解码使用多进程", value=False, active_color="amber")
+    pm_executor_text = ft.Text("", size=10, color="grey")
 
     async def save_power_mode_settings(e=None):
-        nonlocal current_power_config
+        nonlocal current_power_config, current_http_pool_config, current_executor_config
         selected_keys_list = []
         for chk in pm_keys_container.controls:
             if isinstance(chk, ft.Checkbox) and chk.value:
@@ -719,29 +768,80 @@ async def main(page: ft.Page):
         
         try: daily_limit = int(pm_limit_field.value)
         except: daily_limit = 200
+        try: stream_total = max(1, min(10000, int(pm_stream_total_field.value)))
+        except: stream_total = 200
+        try: result_cache_mb = max(16, int(pm_result_cache_mb_field.value))
+        except: result_cache_mb = cache_store.DEFAULT_RESULT_CACHE_MB
 
         new_power_config = {
             "enabled": pm_enabled_switch.value,
             "batch_size": int(pm_batch_slider.value),
             "selected_keys": selected_keys_list,
             "daily_limit": daily_limit,
-            "request_delay": float(pm_delay_slider.value)
+            "rate_qps": round(float(pm_qps_slider.value), 1),
+            "rate_burst": int(pm_burst_slider.value),
+            "stream_enabled": pm_stream_switch.value,
+            "stream_total": stream_total,
+            "stream_window": int(pm_stream_window_slider.value),
+            "result_cache_enabled": pm_result_cache_switch.value,
+            "result_cache_mb": result_cache_mb
         }
         
         await utils.save_config_to_storage(page, "power_mode_config", new_power_config)
         config["power_mode_config"] = new_power_config
         current_power_config = new_power_config
+        gen_engine.get_engine().configure_rate_limit(new_power_config["rate_qps"], new_power_config["rate_burst"])
+        gen_engine.get_engine().configure_result_cache(new_power_config["result_cache_enabled"], result_cache_mb)
+
+        # 连接池配置
+        new_http_pool_config = dict(current_http_pool_config)
+        try: new_http_pool_config["max_connections"] = max(1, int(pm_pool_size_field.value))
+        except: pass
+        try: new_http_pool_config["per_host_limit"] = max(1, int(pm_host_limit_field.value))
+        except: pass
+        new_http_pool_config["max_keepalive"] = min(new_http_pool_config["max_keepalive"], new_http_pool_config["max_connections"])
+        await utils.save_config_to_storage(page, "http_pool_config", new_http_pool_config)
+        config["http_pool_config"] = new_http_pool_config
+        current_http_pool_config = new_http_pool_config
+        http_client.get_client().configure(**new_http_pool_config)
+
+        # 执行器配置
+        new_executor_config = dict(current_executor_config)
+        new_executor_config["cpu_use_processes"] = pm_cpu_process_switch.value
+        await utils.save_config_to_storage(page, "executor_config", new_executor_config)
+        config["executor_config"] = new_executor_config
+        current_executor_config = new_executor_config
+        executors.configure(**new_executor_config)
         t2i_app.update_config(config)
         i2i_app.update_config(config)
-        utils.safe_close_dialog(page, power_mode_dialog)
+        close_power_mode_dialog()
         page.snack_bar = ft.SnackBar(ft.Text("强力模式配置已保存"), open=True)
         page.update()
 
     async def _init_power_mode_ui():
         pm_enabled_switch.value = current_power_config.get("enabled", False)
         pm_batch_slider.value = float(current_power_config.get("batch_size", 10))
-        pm_delay_slider.value = float(current_power_config.get("request_delay", 0.2))
+        pm_qps_slider.value = float(current_power_config.get("rate_qps", gen_engine.DEFAULT_RATE_QPS))
+        pm_burst_slider.value = float(current_power_config.get("rate_burst", gen_engine.DEFAULT_RATE_BURST))
+        pm_stream_switch.value = current_power_config.get("stream_enabled", False)
+        pm_stream_total_field.value = str(current_power_config.get("stream_total", 200))
+        pm_stream_window_slider.value = float(current_power_config.get("stream_window", 10))
         pm_limit_field.value = str(current_power_config.get("daily_limit", 200))
+        pm_result_cache_switch.value = current_power_config.get("result_cache_enabled", True)
+        pm_result_cache_mb_field.value = str(current_power_config.get("result_cache_mb", cache_store.DEFAULT_RESULT_CACHE_MB))
+        result_cache = gen_engine.get_engine().result_cache
+        if result_cache:
+            rc = await executors.run_disk(result_cache.get_stats)
+            pm_result_cache_stats_text.value = f"结果缓存: {rc['entries']} 张，{rc['bytes'] / 1024 / 1024:.1f} MB；本次运行命中 {rc['hits']} 次"
+        else:
+            pm_result_cache_stats_text.value = "结果缓存不可用 (缺少 sqlite3)"
+        pm_pool_size_field.value = str(current_http_pool_config.get("max_connections", 32))
+        pm_host_limit_field.value = str(current_http_pool_config.get("per_host_limit", 16))
+        pm_cpu_process_switch.value = bool(current_executor_config.get("cpu_use_processes", executors.DEFAULT_EXECUTOR_CONFIG["cpu_use_processes"]))
+        stats = http_client.get_client().get_stats()
+        retry_stats = gen_engine.get_engine().retry_stats
+        retry_line = "，".join(f"{r} {n} 次" for r, n in retry_stats.most_common()) or "无"
+        pm_pool_stats_text.value = f"连接复用: {stats['reused']}/{stats['requests']} 次请求，新建连接 {stats['new_connections']} 个\n自动重试: {retry_line}"
         saved_selected = [k.strip() for k in current_power_config.get("selected_keys", []) if k]
         
         controls_list = []
@@ -764,6 +864,51 @@ async def main(page: ft.Page):
         pm_keys_container.controls = controls_list
         power_mode_dialog.content.update()
 
+    def _aimd_status_line():
+        # 各 Key 的自适应并发窗口 (只显示引擎已经用过的 Key)
+        snapshot = gen_engine.get_engine().scheduler.snapshot()
+        lines = []
+        for idx, raw_k in enumerate(current_api_keys):
+            s = snapshot.get(raw_k.strip())
+            if not s: continue
+            cooling = " 冷却中" if s["cooling"] else ""
+            lines.append(f"Key {idx+1}: 窗口 {s['window']} (在途 {s['in_flight']}){cooling}")
+        return "自适应并发:\n" + "\n".join(lines) if lines else "自适应并发: 暂无任务"
+
+    def _executor_status_line():
+        # 各执行器的在执行 / 排队数量
+        names = {executors.NET: "网络", executors.DISK: "磁盘", executors.CPU: "编解码"}
+        parts = []
+        for kind, st in executors.get_stats().items():
+            mode = "进程" if st["processes"] else "线程"
+            parts.append(f"{names[kind]} {st['running']}/{st['workers']}{mode} 排队 {st['queued']} (峰值 {st['peak_pending']})")
+        return "执行器: " + "；".join(parts)
+
+    async def _refresh_aimd_status():
+        # 对话框打开期间每秒刷新一次窗口大小与执行器排队深度
+        while True:
+            pm_aimd_text.value = _aimd_status_line()
+            pm_executor_text.value = _executor_status_line()
+            try:
+                pm_aimd_text.update()
+                pm_executor_text.update()
+            except (RuntimeError, AssertionError): pass # 控件尚未挂载 / 已随对话框移除
+            await asyncio.sleep(1.0)
+            if not power_mode_dialog.open: break
+
+    def _start_aimd_refresh():
+        # 同一时间只保留一个刷新循环，重复打开对话框不再叠加
+        nonlocal aimd_refresh_task
+        if aimd_refresh_task is not None and not aimd_refresh_task.done(): return
+        aimd_refresh_task = page.run_task(_refresh_aimd_status)
+
+    def close_power_mode_dialog():
+        nonlocal aimd_refresh_task
+        if aimd_refresh_task is not None:
+            aimd_refresh_task.cancel()
+            aimd_refresh_task = None
+        utils.safe_close_dialog(page, power_mode_dialog)
+
     def open_power_mode_dialog(e):
         power_mode_dialog.content = ft.Container(
             width=320,
@@ -774,8 +919,19 @@ async def main(page: ft.Page):
                 ft.Text("您一次想生成的图片数量:", size=12),
                 pm_batch_slider,
                 ft.Container(height=5),
-                ft.Text("任务创建间隔 (防止QPS超限):", size=12),
-                pm_delay_slider,
+                ft.Text("单个Key提交速率 (令牌桶，防止QPS超限):", size=12),
+                pm_qps_slider,
+                ft.Text("单个Key突发数:", size=12),
+                pm_burst_slider,
+                ft.Divider(height=20, thickness=0.5),
+                pm_stream_switch,
+                pm_stream_total_field,
+                ft.Text("同时在途的任务数 (超出部分排队，完成的卡片自动移出):", size=12),
+                pm_stream_window_slider,
+                ft.Divider(height=20, thickness=0.5),
+                pm_result_cache_switch,
+                pm_result_cache_mb_field,
+                pm_result_cache_stats_text,
                 ft.Divider(height=20, thickness=0.5),
                 ft.Text("配置 API Key:", size=12),
                 ft.Container(
@@ -787,16 +943,25 @@ async def main(page: ft.Page):
                 ), 
                 ft.Container(height=10),
                 pm_limit_field,
-                ft.Text("提示: 此限制仅用于本地统计显示，不代表官方实际限制。", size=10, color="grey")
+                ft.Text("提示: 此限制仅用于本地统计显示，不代表官方实际限制。", size=10, color="grey"),
+                ft.Divider(height=20, thickness=0.5),
+                ft.Text("网络连接池:", size=12),
+                ft.Row([pm_pool_size_field, pm_host_limit_field], spacing=10),
+                pm_pool_stats_text,
+                pm_aimd_text,
+                ft.Divider(height=20, thickness=0.5),
+                pm_cpu_process_switch,
+                pm_executor_text
             ], tight=True, scroll=ft.ScrollMode.AUTO)
         )
         pm_keys_container.scroll = ft.ScrollMode.AUTO
         power_mode_dialog.actions = [
-            ft.TextButton("取消", on_click=lambda e: utils.safe_close_dialog(page, power_mode_dialog)),
+            ft.TextButton("取消", on_click=lambda e: close_power_mode_dialog()),
             ft.ElevatedButton("保存", on_click=lambda e: page.run_task(save_power_mode_settings), bgcolor="amber", color="black")
         ]
         utils.safe_open_dialog(page, power_mode_dialog)
         page.run_task(_init_power_mode_ui)
+        _start_aimd_refresh()
 
     # ----------------------------------------------------
 
@@ -866,6 +1031,11 @@ async def main(page: ft.Page):
             api_keys_field.border_color = border_c
             baidu_config_field.border_color = border_c
             pm_limit_field.border_color = border_c
+            pm_pool_size_field.border_color = border_c
+            pm_host_limit_field.border_color = border_c
+            pm_stream_total_field.border_color = border_c
+            pm_result_cache_mb_field.border_color = border_c
+            cache_max_mb_field.border_color = border_c
             
             # 更新功能菜单颜色
             func_menu_card.bgcolor = utils.get_dropdown_bgcolor(mode)
@@ -949,4 +1119,27 @@ async def main(page: ft.Page):
 
     if not current_api_keys: open_settings_dialog(None)
 
-ft.app(target=main)
\ No newline at end of file
+    # 首帧已显示：后台维护会话缓存 (可选清空 + 定期按大小 / 时间淘汰)
+    page.run_task(utils.maintain_session_cache, current_session_cache_config)
+
+    # 恢复上次退出时仍在生成的任务 (结果下载到会话缓存，可在历史记录中查看)
+    async def resume_unfinished_jobs():
+        engine = gen_engine.get_engine()
+        jobs = await engine.load_unfinished_jobs()
+        if not jobs: return
+
+        async def on_resumed_job_event(job, event, data):
+            if event == gen_engine.EVENT_SUCCEEDED:
+                await utils.increment_api_usage(page, job.api_key)
+
+        for job in jobs:
+            job.add_listener(on_resumed_job_event)
+            engine.submit(job)
+        page.snack_bar = ft.SnackBar(ft.Text(f"正在恢复 {len(jobs)} 个上次未完成的任务，完成后可在历史记录查看"), open=True)
+        page.update()
+
+    page.run_task(resume_unfinished_jobs)
+
+# 进程池 (spawn) 会重新导入主模块，必须加 __main__ 保护
+if __name__ == "__main__":
+    ft.app(target=main)
\ No newline at end of file
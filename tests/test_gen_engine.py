@@ -0,0 +1,108 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gen_engine
+
+# ================= AimdWindow =================
+
+def test_aimd_window_starts_at_maximum_and_shrinks_on_backpressure():
+    window = gen_engine.AimdWindow(maximum=16, decrease_interval=0)
+    assert window.limit == 16
+    assert window.on_backpressure()
+    assert window.limit == 8
+    assert window.on_backpressure(slow=True)
+    assert window.limit == 6
+    for _ in range(10): window.on_backpressure()
+    assert window.limit == 1 # 不会低于 minimum
+
+def test_aimd_window_decrease_is_rate_limited():
+    window = gen_engine.AimdWindow(maximum=16, decrease_interval=60)
+    window._last_decrease = -1e9 # 进程刚启动时 monotonic 可能小于间隔
+    assert window.on_backpressure()
+    assert not window.on_backpressure() # 同一波 429 只收缩一次
+    assert window.limit == 8
+
+def test_aimd_window_grows_about_one_per_window_of_successes():
+    window = gen_engine.AimdWindow(initial=4, maximum=6)
+    for _ in range(4): window.on_success()
+    assert window.limit == 4 and window.value > 4.9
+    for _ in range(100): window.on_success()
+    assert window.value == 6.0 # 不超过 maximum
+
+# ================= KeyScheduler =================
+
+def test_acquire_and_release_track_in_flight():
+    scheduler = gen_engine.KeyScheduler(aimd_config={"maximum": 2})
+    woken = []
+    scheduler.on_capacity = lambda: woken.append(True)
+
+    assert scheduler.acquire("k1") == "k1"
+    assert scheduler.pick(["k1"]) == "k1"
+    assert scheduler.snapshot()["k1"]["in_flight"] == 2
+    assert not scheduler.is_available("k1")
+    assert scheduler.window_full(["k1"])
+    assert scheduler.pick(["k1"]) is None
+
+    scheduler.release("k1", success=True, latency=3.0)
+    assert scheduler.is_available("k1")
+    assert woken == [True]
+    scheduler.release("k1", success=False, count_outcome=False)
+    scheduler.release("k1", success=False, count_outcome=False) # 多余的 release 不会变成负数
+    assert scheduler.snapshot()["k1"]["in_flight"] == 0
+    assert scheduler.snapshot()["k1"]["used"] == 1
+    assert scheduler.error_rate("k1") == 0.0 # count_outcome=False 不计入健康度
+
+def test_in_flight_counts_against_daily_quota():
+    scheduler = gen_engine.KeyScheduler()
+    scheduler.set_usage("k1", used=8, daily_limit=10)
+    scheduler.acquire("k1")
+    scheduler.acquire("k1")
+    assert scheduler.remaining("k1") == 0
+    assert scheduler.pick(["k1", "k2"]) == "k2"
+    scheduler.release("k1", success=False, count_outcome=False)
+    assert scheduler.remaining("k1") == 1
+
+# ================= JobJournal =================
+
+def _job(prompt, api_key="k1"):
+    job = gen_engine.GenJob({"prompt": prompt, "model": "Qwen/Qwen-Image"}, [api_key], meta={"prompt": prompt})
+    job.api_key = api_key
+    return job
+
+def test_journal_resumes_only_submitted_jobs(tmp_path):
+    path = str(tmp_path / "journal.db")
+    journal = gen_engine.JobJournal(path)
+    queued, submitted, done, canceled = _job("a"), _job("b", "k2"), _job("c"), _job("d")
+    for job in (queued, submitted, done, canceled): journal.record_queued(job)
+    for job in (submitted, done, canceled):
+        job.task_id = f"task-{job.job_uid[:6]}"
+        journal.record_submitted(job)
+    journal.record_finished(done, gen_engine.JOURNAL_SUCCEED)
+    journal.record_finished(canceled, gen_engine.JOURNAL_CANCELED)
+
+    # 模拟重启：新实例读同一个文件
+    rows = gen_engine.JobJournal(path).load_unfinished()
+    assert rows == [(submitted.job_uid, submitted.payload, submitted.meta, "k2", submitted.task_id)]
+
+    # 未提交的任务已被标记为取消，再次启动不会重复出现
+    reopened = gen_engine.JobJournal(path)
+    assert [r[0] for r in reopened.load_unfinished()] == [submitted.job_uid]
+    status = dict(reopened._execute("SELECT job_uid, status FROM jobs").fetchall())
+    assert status[queued.job_uid] == gen_engine.JOURNAL_CANCELED
+
+def test_engine_rebuilds_jobs_from_journal(tmp_path):
+    journal = gen_engine.JobJournal(str(tmp_path / "journal.db"))
+    job = _job("小猫", "k9")
+    journal.record_queued(job)
+    job.task_id = "task-1"
+    journal.record_submitted(job)
+
+    engine = gen_engine.GenerationEngine(journal=gen_engine.JobJournal(journal.path), result_cache=False)
+    jobs = asyncio.run(engine.load_unfinished_jobs())
+    assert len(jobs) == 1
+    resumed = jobs[0]
+    assert (resumed.job_uid, resumed.task_id, resumed.candidate_keys) == (job.job_uid, "task-1", ["k9"])
+    assert resumed.payload == job.payload and resumed.meta == job.meta
@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import history_index
+
+META = {"model": "Qwen/Qwen-Image", "prompt": "窗台上的一只小猫", "negative_prompt": "模糊"}
+
+def test_single_cjk_character_matches_inside_bigram(tmp_path):
+    entry = {"path": "a.png", "mtime": 1.0, "width": 512, "height": 512, "metadata": META}
+    assert history_index.matches(entry, text="猫")
+    assert history_index.matches(entry, text="小猫")
+    assert not history_index.matches(entry, text="狗")
+
+    index = history_index.HistoryIndex(str(tmp_path / "index.db"))
+    index.upsert("a.png", 100, 1.0, 512, 512, META)
+    index.upsert("b.png", 100, 2.0, 512, 512, {"prompt": "一只小狗"})
+    assert [e["path"] for e in index.query(text="猫")] == ["a.png"]
+    assert [e["path"] for e in index.query(text="小")] == ["b.png", "a.png"]
+    assert [e["path"] for e in index.query(text="窗台 猫")] == ["a.png"]
+
+def test_model_filter_uses_model_column(tmp_path):
+    index = history_index.HistoryIndex(str(tmp_path / "index.db"))
+    index.upsert("a.png", 100, 1.0, 512, 512, META)
+    index.upsert("b.png", 100, 2.0, 512, 512, {"model": "Kwai-Kolors/Kolors", "prompt": "小猫"})
+    index.upsert("c.png", 100, 3.0, 512, 512, None)
+    assert [e["path"] for e in index.query(model="Qwen/Qwen-Image")] == ["a.png"]
+    assert [e["path"] for e in index.query(text="猫", model="Kwai-Kolors/Kolors")] == ["b.png"]
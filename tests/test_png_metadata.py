@@ -0,0 +1,78 @@
+import os
+import sys
+import zlib
+import random
+import struct
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+
+META = {"prompt": "窗台上的一只小猫", "model": "Qwen/Qwen-Image", "seed": 42}
+
+def _png(*extra_chunks):
+    # 1x1 灰度图：IHDR + 额外的块 + IDAT + IEND
+    ihdr = utils._make_chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 0, 0, 0, 0))
+    idat = utils._make_chunk(b'IDAT', zlib.compress(b'\x00\x80'))
+    iend = utils._make_chunk(b'IEND', b'')
+    return utils.PNG_SIGNATURE + ihdr + b''.join(extra_chunks) + idat + iend
+
+def _chunk_types(data):
+    types, offset = [], len(utils.PNG_SIGNATURE)
+    while offset < len(data):
+        length = struct.unpack('>I', data[offset:offset + 4])[0]
+        types.append(data[offset + 4:offset + 8])
+        offset += 12 + length
+    return types
+
+def _feed_split(data, cuts, metadata=META):
+    writer = utils.PngMetadataWriter(metadata)
+    out, start = bytearray(), 0
+    for end in list(cuts) + [len(data)]:
+        for piece in writer.feed(data[start:end]): out += piece
+        start = end
+    assert writer.finish() == len(out)
+    return bytes(out)
+
+def test_feed_with_arbitrary_splits_matches_whole_buffer():
+    stale = utils.build_metadata_chunk({"prompt": "旧的元数据"})
+    foreign = utils._make_chunk(b'tEXt', b'Software\x00other')
+    src = _png(stale, foreign)
+    expected = _feed_split(src, [])
+
+    assert _feed_split(src, range(1, len(src))) == expected
+    rng = random.Random(0)
+    for _ in range(200):
+        cuts = sorted(rng.sample(range(1, len(src)), rng.randint(1, 12)))
+        assert _feed_split(src, cuts) == expected
+
+    # 旧的本程序元数据被替换，其他文本块保留，新元数据在第一个 IDAT 之前
+    assert _chunk_types(expected) == [b'IHDR', b'tEXt', b'tEXt', b'IDAT', b'IEND']
+    assert utils.extract_metadata_from_png(expected) == META
+    assert b'Software\x00other' in expected
+    assert "旧的元数据".encode('utf-8') not in expected
+
+def test_compressed_metadata_round_trips():
+    big = dict(META, prompt="小猫" * 2000)
+    out = _feed_split(_png(), [3, 20, 41])
+    assert utils.extract_metadata_from_png(out) == META
+    out = _feed_split(_png(), [9, 10, 33], metadata=big)
+    assert b'iTXt' in out
+    assert utils.extract_metadata_from_png(out) == big
+
+def test_input_after_iend_is_ignored():
+    src = _png()
+    writer = utils.PngMetadataWriter(META)
+    out = b''.join(bytes(p) for p in writer.feed(src + b'trailing garbage'))
+    assert writer.done
+    assert out.endswith(utils._make_chunk(b'IEND', b''))
+
+def test_invalid_or_truncated_png_raises():
+    with pytest.raises(ValueError):
+        utils.PngMetadataWriter(META).feed(b'not a png at all')
+    writer = utils.PngMetadataWriter(META)
+    writer.feed(_png()[:-5])
+    with pytest.raises(ValueError):
+        writer.finish()
@@ -0,0 +1,121 @@
+import os
+import re
+import asyncio
+import utils
+import executors
+import content_store
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except (ImportError, OSError):
+    HAS_PIL = False
+
+# ==========================================
+#      缩略图流水线 (按内容哈希缓存，多档宽度)
+# ==========================================
+# 说明：
+#   结果网格 / 历史瀑布流 / 上传预览只需要几百像素宽的图，
+#   直接指向原图会让 Flet 为每个小格子解码几百万像素。
+#   这里一次解码原图生成全部档位的缩略图 (在图片编解码执行器里，可为进程池)，
+#   存放在 会话缓存/.thumbs/<宽度>/<哈希前两位>/<哈希>.jpg。
+#   只有大图查看器加载原图 (控件的 original_src)。
+
+THUMB_WIDTHS = (128, 256, 512, 1024)
+GRID_THUMB_WIDTH = 512     # 结果卡片 / 历史瀑布流
+PREVIEW_THUMB_WIDTH = 256  # 上传区小方块
+THUMB_QUALITY = 85
+
+_HEX_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+_digest_cache = {}   # (路径, 修改时间, 大小) -> sha256 (非内容寻址命名的文件)
+_in_flight = {}      # sha256 -> asyncio.Future (同一张图只生成一次)
+
+def thumb_folder():
+    return os.path.join(utils.TEMP_CACHE_FOLDER, utils.THUMB_DIR_NAME)
+
+def pick_width(display_width):
+    """挑选不小于显示宽度的最小档位"""
+    for w in THUMB_WIDTHS:
+        if w >= display_width: return w
+    return THUMB_WIDTHS[-1]
+
+def original_src(img):
+    """图片控件对应的原图地址 (缩略图控件上挂着 original_src)"""
+    return getattr(img, "original_src", None) or img.src
+
+def _thumb_path(digest, width):
+    return os.path.abspath(os.path.join(thumb_folder(), str(width), digest[:2], f"{digest}.jpg"))
+
+def _is_local(path):
+    return bool(path) and not path.startswith(("http://", "https://")) and os.path.isfile(path)
+
+def _known_digest(path):
+    """不读文件就能确定的哈希：内容寻址文件名本身，或之前算过的结果"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if _HEX_DIGEST.match(stem): return stem
+    try: st = os.stat(path)
+    except OSError: return None
+    return _digest_cache.get((path, st.st_mtime_ns, st.st_size))
+
+def _compute_digest(path):
+    digest = _known_digest(path)
+    if digest: return digest
+    st = os.stat(path)
+    digest = content_store.hash_file(path)
+    _digest_cache[(path, st.st_mtime_ns, st.st_size)] = digest
+    return digest
+
+def thumbnail_path(path, width=GRID_THUMB_WIDTH):
+    """只查询不生成：缩略图已存在时返回其路径，否则返回 None (可在 UI 线程调用)"""
+    if not (HAS_PIL and _is_local(path)): return None
+    digest = _known_digest(path)
+    if not digest: return None
+    thumb = _thumb_path(digest, pick_width(width))
+    return thumb if os.path.exists(thumb) else None
+
+async def ensure_thumbnail(path, width=GRID_THUMB_WIDTH):
+    """
+    返回用于显示的缩略图路径，不存在时在后台生成
+    远程链接 / 没有 Pillow / 生成失败时返回原路径
+    """
+    if not (HAS_PIL and _is_local(path)): return path
+    width = pick_width(width)
+    try:
+        digest = await executors.run_disk(_compute_digest, path)
+        thumb = _thumb_path(digest, width)
+        if os.path.exists(thumb): return thumb
+
+        fut = _in_flight.get(digest)
+        if fut is None:
+            fut = asyncio.ensure_future(executors.run_cpu(render_thumbnails, path, [_thumb_path(digest, w) for w in THUMB_WIDTHS], THUMB_WIDTHS))
+            _in_flight[digest] = fut
+            fut.add_done_callback(lambda f, d=digest: _in_flight.pop(d, None))
+        await asyncio.shield(fut)
+        return thumb if os.path.exists(thumb) else path
+    except Exception as e:
+        print(f"Thumbnail error: {e}")
+        return path
+
+def render_thumbnails(src_path, dest_paths, widths):
+    """
+    (在图片编解码执行器中运行，必须是模块级函数) 解码一次原图，从大到小依次缩放写出各档缩略图
+    比目标档位还窄的原图不放大，直接按原尺寸保存
+    """
+    with Image.open(src_path) as im:
+        im.draft("RGB", (max(widths), max(widths))) # JPEG 可在解码时直接降采样
+        im = im.convert("RGBA") if im.mode in ("P", "LA", "PA") else im
+        if im.mode == "RGBA":
+            # 透明背景铺成白色，JPEG 不支持透明
+            bg = Image.new("RGB", im.size, (255, 255, 255))
+            bg.paste(im, mask=im.split()[-1])
+            im = bg
+        elif im.mode != "RGB":
+            im = im.convert("RGB")
+        for width, dest in sorted(zip(widths, dest_paths), reverse=True):
+            if im.width > width:
+                im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            tmp = f"{dest}.{os.getpid()}.part"
+            im.save(tmp, "JPEG", quality=THUMB_QUALITY, optimize=True)
+            os.replace(tmp, dest)
+    return dest_paths
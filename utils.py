@@ -14,8 +14,11 @@ import socketserver
 import threading
 import uuid
 import datetime
-import shutil  # 用于删除文件夹
 import glob    # 用于文件查找
+import http_client  # 共享连接池客户端
+import executors    # 网络 / 磁盘 / 图片编解码 分类执行器
+import content_store  # sha256 内容寻址存储
+import history_index  # 历史记录索引 (SQLite)
 
 # ==========================================
 #      【安全导入层】防止手机端崩溃
@@ -57,6 +60,7 @@ T2I_FOLDER = "T2I"
 I2I_FOLDER = "I2I_Edits"
 TEMP_CACHE_FOLDER = "Temp_Session_Cache" # 会话临时缓存
 TEMP_TRANSFER_FOLDER = "temp_transfer"   # 模块间传输临时文件夹
+ENGINE_DATA_FOLDER = "Engine_Data"       # 生图引擎的持久化数据 (耗时统计等)
 
 # 确保持久化文件夹存在
 if not os.path.exists(T2I_FOLDER):
@@ -94,71 +98,257 @@ BG_DARK_DIALOG = "#2C2C2E"
 #      【缓存系统逻辑 (修改版)】
 # ==========================================
 
+# 会话缓存默认配置 (跨次启动保留，后台按大小 / 时间淘汰)
+DEFAULT_SESSION_CACHE_CONFIG = {
+    "max_mb": 2048,           # 会话缓存总大小上限
+    "max_age_days": 30,       # 超过该天数未使用的图片直接淘汰
+    "clear_on_start": False,  # 启动后 (首帧显示之后) 在后台清空会话缓存
+}
+TRANSFER_MAX_AGE_HOURS = 24   # 模块间传输文件只是中转，保留一天即可
+STALE_TMP_SECONDS = 3600      # 超过该时间的下载临时文件视为残留
+THUMB_DIR_NAME = ".thumbs"    # 缩略图放在会话缓存下 (见 thumbnails.py)
+CACHE_EVICT_INTERVAL = 600    # 后台淘汰的间隔 (秒)
+
 def init_cache_system():
-    """初始化缓存系统：启动时清空所有临时文件夹"""
-    
-    # 1. 清理会话缓存 (历史记录用)
-    if os.path.exists(TEMP_CACHE_FOLDER):
+    """初始化缓存系统：只确保文件夹存在，不在启动路径上做任何清理"""
+    for folder in (TEMP_CACHE_FOLDER, os.path.join(os.getcwd(), TEMP_TRANSFER_FOLDER)):
+        try: os.makedirs(folder, exist_ok=True)
+        except Exception as e: print(f"❌ 缓存文件夹创建失败: {e}")
+
+def _list_cached_files(folder):
+    """[(路径, 修改时间, 大小)]，包含分片子目录、旧版本的平铺文件与下载残留的临时文件"""
+    entries = []
+    store = content_store.get_store(folder)
+    paths = list(store.iter_paths()) + glob.glob(os.path.join(folder, "*.png"))
+    paths += glob.glob(os.path.join(store.root, content_store.TMP_DIR_NAME, "*.part"))
+    for path in paths:
         try:
-            shutil.rmtree(TEMP_CACHE_FOLDER)
-            print(f"✅ 会话缓存已清理: {TEMP_CACHE_FOLDER}")
-        except Exception as e:
-            print(f"❌ 会话缓存清理失败: {e}")
-    
-    # 2. 【新增】清理传输缓存 (编辑中转用)
-    # 获取 temp_transfer 的绝对路径，确保在手机/电脑都能找到
+            st = os.stat(path)
+            entries.append((path, st.st_mtime, st.st_size))
+        except OSError: pass
+    return entries
+
+def evict_cache_folder(folder, max_bytes=None, max_age_seconds=None):
+    """
+    按时间 / 大小淘汰缓存文件 (修改时间即最近使用时间，重复保存时会刷新)
+    先删掉过期文件与下载残留，再从最旧的开始删，直到总大小不超过 max_bytes
+    :return: (删除数量, 释放字节数)
+    """
+    now = time.time()
+    entries = sorted(_list_cached_files(folder), key=lambda e: e[1])
+    removed, freed = 0, 0
+
+    def remove(path, size):
+        nonlocal removed, freed
+        try:
+            os.remove(path)
+            removed += 1
+            freed += size
+            return True
+        except OSError as e:
+            print(f"Cache evict error: {e}")
+            return False
+
+    kept = []
+    for path, mtime, size in entries:
+        is_tmp = path.endswith(".part")
+        expired = (now - mtime > STALE_TMP_SECONDS) if is_tmp else (max_age_seconds is not None and now - mtime > max_age_seconds)
+        if expired and remove(path, size): continue
+        kept.append((path, mtime, size))
+
+    if max_bytes is not None:
+        total = sum(e[2] for e in kept)
+        for path, mtime, size in kept:
+            if total <= max_bytes: break
+            # 正在下载的临时文件不参与按大小淘汰
+            if path.endswith(".part"): continue
+            if remove(path, size): total -= size
+    return removed, freed
+
+def evict_thumbnail_folder(folder, max_bytes, max_age_seconds=None):
+    """缩略图目录 (<宽度>/<分片>/<哈希>.jpg) 同样按修改时间淘汰，原图被删后留下的缩略图也会随时间清掉"""
+    if not os.path.isdir(folder): return 0, 0
+    now = time.time()
+    entries = []
+    for dirpath, _, filenames in os.walk(folder):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+                entries.append((path, st.st_mtime, st.st_size))
+            except OSError: pass
+    entries.sort(key=lambda e: e[1])
+    total = sum(e[2] for e in entries)
+    removed, freed = 0, 0
+    for path, mtime, size in entries:
+        expired = max_age_seconds is not None and now - mtime > max_age_seconds
+        if not expired and total <= max_bytes: break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+            freed += size
+        except OSError: pass
+    return removed, freed
+
+def clear_cache_folder(folder):
+    """清空缓存文件夹 (保留文件夹本身)"""
+    removed = 0
+    for path, _, _ in _list_cached_files(folder):
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError: pass
+    thumb_root = os.path.join(folder, THUMB_DIR_NAME)
+    if os.path.isdir(thumb_root):
+        removed += evict_thumbnail_folder(thumb_root, 0)[0]
+    return removed
+
+async def maintain_session_cache(cache_config):
+    """
+    后台维护会话缓存：可选的启动清空，之后定期按大小 / 时间淘汰
+    应在首帧显示之后通过 page.run_task 启动，所有文件操作都在磁盘执行器中进行
+    :param cache_config: 会话缓存配置 (设置保存时原地更新，下一轮淘汰即生效)
+    """
     transfer_path = os.path.join(os.getcwd(), TEMP_TRANSFER_FOLDER)
-    if os.path.exists(transfer_path):
+    if cache_config.get("clear_on_start", False):
         try:
-            shutil.rmtree(transfer_path)
-            print(f"✅ 传输缓存已清理: {transfer_path}")
+            removed = await executors.run_disk(clear_cache_folder, TEMP_CACHE_FOLDER)
+            removed += await executors.run_disk(clear_cache_folder, transfer_path)
+            print(f"✅ 缓存已清理: {removed} 个文件")
         except Exception as e:
-            print(f"❌ 传输缓存清理失败: {e}")
-
-    # 等待文件系统释放句柄
-    time.sleep(0.1)
-    
-    # 重新创建必要的缓存文件夹
-    if not os.path.exists(TEMP_CACHE_FOLDER):
-        try: os.makedirs(TEMP_CACHE_FOLDER)
-        except: pass
+            print(f"❌ 缓存清理失败: {e}")
+    while True:
+        try:
+            max_bytes = int(cache_config.get("max_mb", DEFAULT_SESSION_CACHE_CONFIG["max_mb"])) * 1024 * 1024
+            max_age = float(cache_config.get("max_age_days", DEFAULT_SESSION_CACHE_CONFIG["max_age_days"])) * 86400
+            removed, freed = await executors.run_disk(evict_cache_folder, TEMP_CACHE_FOLDER, max_bytes, max_age)
+            t_removed, t_freed = await executors.run_disk(evict_cache_folder, transfer_path, None, TRANSFER_MAX_AGE_HOURS * 3600)
+            # 缩略图预算为原图的 1/8
+            th_removed, th_freed = await executors.run_disk(evict_thumbnail_folder, os.path.join(TEMP_CACHE_FOLDER, THUMB_DIR_NAME), max_bytes // 8, max_age)
+            removed += t_removed + th_removed
+            freed += t_freed + th_freed
+            if removed:
+                print(f"✅ 缓存淘汰: {removed} 个文件，释放 {freed / 1024 / 1024:.1f} MB")
+        except Exception as e:
+            print(f"❌ 缓存淘汰失败: {e}")
+        try:
+            # 淘汰 / 手动增删后与历史索引对账 (首轮即为旧缓存建立索引)
+            added, dropped = await executors.run_disk(sync_history_index, TEMP_CACHE_FOLDER)
+            if added or dropped:
+                print(f"✅ 历史索引: 新增 {len(added)} 条，移除 {len(dropped)} 条")
+                notify_history_changed(added, dropped)
+        except Exception as e:
+            print(f"❌ 历史索引对账失败: {e}")
+        await asyncio.sleep(CACHE_EVICT_INTERVAL)
 
 async def save_to_cache(url, metadata=None):
     """
     下载图片并保存到临时缓存文件夹，注入元数据
+    文件按内容 sha256 命名 (分片目录)，相同图片只保存一份
     返回本地绝对路径
     """
     if not url: return None
+    # 边下载边写盘 (复用共享连接池)，不在内存中缓存整张图
+    path, _ = await download_image_to_store(url, content_store.get_store(TEMP_CACHE_FOLDER), metadata)
+    # 写入历史索引 (元数据已知，无需回读文件)，历史页刷新时直接查询
+    if path:
+        entry = await executors.run_disk(index_cached_image, path, metadata)
+        if entry: notify_history_changed(added=[entry])
+    return path
+
+# ==========================================
+#      【流式下载】(分块写入临时文件 + 按内容哈希归档)
+# ==========================================
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+async def download_image_to_store(url, store, metadata=None, timeout=30):
+    """
+    分块下载图片到内容寻址存储：先写入 store 的临时文件，边写边算 sha256，
+    PNG 边下载边经 PngMetadataWriter 插入元数据块 (第一个 IDAT 之前，丢弃旧的元数据块)，完成后按哈希原子改名归档。
+    每张图同一时刻只在内存中保留一个分块。
+    :param store: content_store.ContentStore
+    :return: (本地绝对路径, 是否与已有文件重复)；失败返回 (None, False)，不会留下半截文件
+    """
+    tmp_path = None
+    f = None
     try:
-        # 下载图片
-        res = await asyncio.to_thread(requests.get, url, timeout=30)
-        if res.status_code == 200:
-            image_bytes = res.content
-            # 注入元数据
-            if metadata:
-                image_bytes = add_metadata_to_png(image_bytes, metadata)
-            
-            # 生成文件名 (使用时间戳确保唯一)
-            filename = f"cache_{int(time.time())}_{random.randint(1000,9999)}.png"
-            save_path = os.path.join(TEMP_CACHE_FOLDER, filename)
-            abs_path = os.path.abspath(save_path)
-
-            # 写入文件
-            with open(abs_path, "wb") as f:
-                f.write(image_bytes)
-            
-            return abs_path
-        return None
+        tmp_path = await executors.run_disk(store.new_temp_path)
+        f = await executors.run_disk(open, tmp_path, "wb")
+
+        hasher = hashlib.sha256()
+        is_png = None    # None: 还没读够文件签名
+        head = b""       # 文件签名缓冲 (最多 8 字节)
+        writer = None    # PNG 且需要写元数据时，按块插入元数据 (与 write_png_with_metadata 同一套逻辑)
+        async with http_client.get_client().stream("GET", url, timeout=timeout) as res:
+            if res.status_code != 200:
+                print(f"Download failed: HTTP {res.status_code}")
+                return None, False
+            async for chunk in res.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                if is_png is None and metadata:
+                    head += chunk
+                    if len(head) < len(PNG_SIGNATURE): continue
+                    is_png = head.startswith(PNG_SIGNATURE)
+                    if is_png: writer = PngMetadataWriter(metadata)
+                    chunk, head = head, b""
+                if writer is not None:
+                    chunk = b"".join(writer.feed(chunk))
+                    if not chunk: continue
+                hasher.update(chunk)
+                await executors.run_disk(f.write, chunk)
+            if head:
+                hasher.update(head)
+                await executors.run_disk(f.write, head)
+            if writer is not None: writer.finish()
+        await executors.run_disk(f.close)
+        f = None
+
+        digest = hasher.hexdigest()
+        # 非 PNG (如 JPG) 需要整体转码才能写入元数据，这种情况很少见，交给图片编解码池
+        if metadata and not is_png:
+            await executors.run_cpu(_convert_file_with_metadata, tmp_path, metadata)
+            digest = None # 内容变了，归档时重新计算哈希
+
+        path, deduped = await executors.run_disk(store.commit, tmp_path, digest)
+        tmp_path = None
+        return path, deduped
     except Exception as e:
         print(f"Cache save error: {e}")
-        return None
+        return None, False
+    finally:
+        if f is not None:
+            try: f.close()
+            except: pass
+        if tmp_path and os.path.exists(tmp_path):
+            try: os.remove(tmp_path)
+            except: pass
+
+def _convert_file_with_metadata(file_path, metadata):
+    """给文件注入元数据：PNG 按块流式重写，其他格式先转成 PNG，写完后原子替换"""
+    tmp_path = f"{file_path}.meta.part"
+    try:
+        with open(file_path, "rb") as src:
+            is_png = src.read(8) == PNG_SIGNATURE
+            src.seek(0)
+            if is_png:
+                with open(tmp_path, "wb") as dst: write_png_with_metadata(src, dst, metadata)
+            elif HAS_PIL:
+                buf = io.BytesIO()
+                Image.open(src).save(buf, format="PNG")
+                with open(tmp_path, "wb") as dst: write_png_with_metadata(buf.getbuffer(), dst, metadata)
+            else:
+                return # 不是 PNG 且没有 PIL，无法注入元数据
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
 
 def get_cached_history():
-    """获取缓存文件夹内的所有图片，按时间倒序排列"""
+    """获取缓存文件夹内的所有图片 (含分片子目录)，按时间倒序排列"""
     if not os.path.exists(TEMP_CACHE_FOLDER): return []
     try:
-        # 获取所有 png 文件
+        # 获取所有 png 文件 (兼容旧版本留在根目录下的文件)
         files = glob.glob(os.path.join(TEMP_CACHE_FOLDER, "*.png"))
+        files.extend(content_store.get_store(TEMP_CACHE_FOLDER).iter_paths())
         # 按修改时间倒序排列 (最新的在前)
         files.sort(key=os.path.getmtime, reverse=True)
         # 返回绝对路径列表
@@ -167,6 +357,116 @@ def get_cached_history():
         print(f"History load error: {e}")
         return []
 
+# ==========================================
+#      【历史记录索引】(见 history_index.py)
+# ==========================================
+HISTORY_INDEX_DB = os.path.join(ENGINE_DATA_FOLDER, "history_index.db")
+
+def get_history_index():
+    """共享的历史索引，不可用时返回 None (调用方退回扫描目录)"""
+    return history_index.get_index(HISTORY_INDEX_DB)
+
+def describe_image_file(path, metadata=None):
+    """
+    (在磁盘执行器中运行) 生成一条索引记录，尺寸只读文件头
+    :param metadata: 已知的元数据；为 None 时按块扫描文件读取
+    :return: (绝对路径, 大小, 修改时间, 宽, 高, 元数据)
+    """
+    st = os.stat(path)
+    width, height = get_image_size(path) or (None, None)
+    if metadata is None:
+        metadata = read_metadata_from_file(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime, width, height, metadata)
+
+def _row_to_entry(row):
+    path, size, mtime, width, height, metadata = row
+    return {"path": path, "size": size, "mtime": mtime, "width": width, "height": height, "metadata": metadata}
+
+def index_cached_image(path, metadata=None):
+    """把刚写入缓存的图片加入历史索引，返回该条记录 (供增量刷新使用)"""
+    if not path: return None
+    try:
+        row = describe_image_file(path, metadata)
+        index = get_history_index()
+        if index is not None: index.upsert(*row)
+        return _row_to_entry(row)
+    except Exception as e:
+        print(f"History index error: {e}")
+        return None
+
+def sync_history_index(folder=TEMP_CACHE_FOLDER):
+    """
+    索引与缓存目录对账：只 stat 不读文件，新增 / 变化的文件才解析元数据
+    缓存文件按内容命名、写入后不再修改，大小相同只是修改时间变了 (重复保存) 时只刷新时间
+    :return: (新增或更新的记录列表, 移除的路径列表)
+    """
+    index = get_history_index()
+    if index is None: return [], []
+    known = index.known()
+    on_disk = {os.path.abspath(p): (mtime, size) for p, mtime, size in _list_cached_files(folder) if not p.endswith(".part")}
+
+    stale = [p for p in known if p not in on_disk]
+    index.remove(stale)
+
+    rows, touched = [], []
+    for path, (mtime, size) in on_disk.items():
+        old = known.get(path)
+        if old == (mtime, size): continue
+        if old and old[1] == size and index.touch(path, mtime):
+            touched.append(path)
+            continue
+        try: rows.append(describe_image_file(path))
+        except Exception as e: print(f"History index error: {e}")
+    index.upsert_many(rows)
+    changed = [_row_to_entry(row) for row in rows] + [e for e in map(index.get, touched) if e]
+    changed.sort(key=lambda e: e["mtime"], reverse=True)
+    return changed, stale
+
+def _describe_entry(path):
+    try:
+        return _row_to_entry(describe_image_file(path))
+    except Exception:
+        return {"path": path, "size": 0, "mtime": 0, "width": None, "height": None, "metadata": None}
+
+# 历史变化监听 (历史页据此增量增删卡片)，回调在事件循环中执行：callback(added_entries, removed_paths)
+_history_listeners = []
+
+def add_history_listener(callback):
+    if callback not in _history_listeners: _history_listeners.append(callback)
+
+def remove_history_listener(callback):
+    if callback in _history_listeners: _history_listeners.remove(callback)
+
+def notify_history_changed(added=(), removed=()):
+    """通知监听者：added 为记录列表 (最新的在前)，removed 为路径列表"""
+    for callback in list(_history_listeners):
+        try: callback(list(added), list(removed))
+        except Exception as e: print(f"History listener error: {e}")
+
+async def get_history_entries(limit=None, offset=0, **filters):
+    """
+    历史记录 (最新的在前)：[{path, size, mtime, width, height, metadata}]
+    优先查询索引；索引不可用时退回扫描目录并逐个解析 (旧逻辑)，都在磁盘池中执行，不阻塞界面
+    :param filters: 搜索条件 text / model / size / since (见 history_index.HistoryIndex.query)
+    """
+    index = get_history_index()
+    if index is not None:
+        try: return await executors.run_disk(index.query, limit, offset, **filters)
+        except Exception as e: print(f"History index query error: {e}")
+    paths = await executors.run_disk(get_cached_history)
+    entries = await asyncio.gather(*[executors.run_disk(_describe_entry, path) for path in paths])
+    if any(filters.values()):
+        entries = [e for e in entries if history_index.matches(e, **filters)]
+    return entries[offset:] if limit is None else entries[offset:offset + limit]
+
+async def get_history_facets():
+    """历史搜索的筛选项 {models, sizes}"""
+    index = get_history_index()
+    if index is not None:
+        try: return await executors.run_disk(index.facets)
+        except Exception as e: print(f"History index query error: {e}")
+    return {"models": [], "sizes": []}
+
 # ==========================================
 #      【本地微型图片服务器】(解决0KB问题)
 # ==========================================
@@ -241,6 +541,138 @@ def start_local_server():
 # ==========================================
 #      【元数据处理函数】(PNG Info)
 # ==========================================
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+METADATA_KEYWORD = "zsyAI"
+METADATA_KEYWORDS = ("ZhaishengyuanAI", METADATA_KEYWORD)
+TEXT_CHUNK_TYPES = (b'tEXt', b'zTXt', b'iTXt')
+MAX_TEXT_CHUNK_SIZE = 16 * 1024 * 1024   # 文本块超过该大小视为损坏，直接跳过
+METADATA_COMPRESS_THRESHOLD = 1024       # 元数据 JSON 超过该字节数时默认写压缩的 iTXt
+PNG_COPY_BLOCK_SIZE = 1024 * 1024        # 从文件复制图像块时每次读取的大小
+
+def _make_chunk(chunk_type, chunk_data):
+    """长度 + 类型 + 数据 + CRC"""
+    crc = zlib.crc32(chunk_data, zlib.crc32(chunk_type)) & 0xffffffff
+    return struct.pack('>I', len(chunk_data)) + chunk_type + chunk_data + struct.pack('>I', crc)
+
+def build_metadata_chunk(metadata, chunk_type=None):
+    """
+    生成包含元数据的完整文本块 (长度 + 类型 + 数据 + CRC)
+    :param chunk_type: b'tEXt' 不压缩；b'zTXt' / b'iTXt' 用 zlib 压缩；
+                       None 时自动选择 (JSON 较大时用 iTXt，否则 tEXt)
+    """
+    metadata_payload = {
+        "source": "ZhaishengyuanAI",
+        "data": metadata
+    }
+    text = json.dumps(metadata_payload, ensure_ascii=False).encode('utf-8')
+    keyword = METADATA_KEYWORD.encode('latin-1')
+    if chunk_type is None:
+        chunk_type = b'iTXt' if len(text) > METADATA_COMPRESS_THRESHOLD else b'tEXt'
+    if chunk_type == b'zTXt':
+        # 关键字\0 + 压缩方式 (0 = zlib) + 压缩文本
+        return _make_chunk(chunk_type, keyword + b'\x00\x00' + zlib.compress(text, 9))
+    if chunk_type == b'iTXt':
+        # 关键字\0 + 压缩标志 (1) + 压缩方式 (0) + 语言标签\0 + 翻译关键字\0 + 压缩文本 (规范要求 UTF-8，比 zTXt 更合适)
+        return _make_chunk(chunk_type, keyword + b'\x00\x01\x00\x00\x00' + zlib.compress(text, 9))
+    return _make_chunk(b'tEXt', keyword + b'\x00' + text)
+
+class PngMetadataWriter:
+    def __init__(self, metadata, chunk_type=None):
+        """
+        增量式 PNG 元数据注入：数据可以任意切分后依次 feed，每次返回应写出的片段
+        元数据块插在第一个 IDAT (没有 IDAT 时为 IEND) 之前，原有的本程序元数据块丢弃 (重复注入不会越写越多)
+        图像块以输入的 memoryview 切片原样返回，只有块头与文本块会短暂缓存
+        :param chunk_type: 见 build_metadata_chunk
+        """
+        self.metadata_chunk = build_metadata_chunk(metadata, chunk_type)
+        self.inserted = False
+        self.done = False      # 已写出 IEND，之后的输入全部忽略
+        self.written = 0
+        self._buf = bytearray()
+        self._need = len(PNG_SIGNATURE)
+        self._state = "signature"  # signature / header / text / copy
+        self._header = b""
+        self._remaining = 0        # copy 状态下当前块还剩多少字节 (数据 + CRC)
+        self._last = False         # 当前块是 IEND
+
+    def feed(self, data):
+        """
+        :param data: 紧接上一次输入的一段 PNG 字节 (bytes / bytearray / memoryview)
+        :return: 需要依次写出的片段列表；不是 PNG / 块结构损坏时抛出 ValueError
+        """
+        view = memoryview(data)
+        out = []
+        pos = 0
+        while pos < len(view) and not self.done:
+            if self._state == "copy":
+                piece = view[pos:pos + self._remaining]
+                out.append(piece)
+                pos += len(piece)
+                self._remaining -= len(piece)
+                if self._remaining == 0: self._next_chunk()
+                continue
+            # 块头 / 文本块：凑够需要的字节数再处理
+            piece = view[pos:pos + self._need - len(self._buf)]
+            self._buf += piece
+            pos += len(piece)
+            if len(self._buf) < self._need: break
+            buf, self._buf = bytes(self._buf), bytearray()
+            if self._state == "signature":
+                if buf != PNG_SIGNATURE: raise ValueError("不是 PNG 文件")
+                out.append(PNG_SIGNATURE)
+                self._next_chunk()
+            elif self._state == "header":
+                chunk_length, ctype = struct.unpack('>I4s', buf)
+                if not self.inserted and ctype in (b'IDAT', b'IEND'):
+                    out.append(self.metadata_chunk)
+                    self.inserted = True
+                self._last = ctype == b'IEND'
+                if ctype in TEXT_CHUNK_TYPES and chunk_length <= MAX_TEXT_CHUNK_SIZE:
+                    self._header = buf
+                    self._state, self._need = "text", chunk_length + 4
+                else:
+                    out.append(buf)
+                    self._state, self._remaining = "copy", chunk_length + 4
+            else:
+                # 文本块整块读入，旧的元数据块直接丢弃
+                if buf.partition(b'\x00')[0].decode('latin-1') not in METADATA_KEYWORDS:
+                    out.extend((self._header, buf))
+                self._next_chunk()
+        self.written += sum(len(piece) for piece in out)
+        return out
+
+    def _next_chunk(self):
+        if self._last:
+            self.done = True
+            return
+        self._state, self._need = "header", 8
+
+    def finish(self):
+        """输入结束时调用：没有读到 IEND 时抛出 ValueError"""
+        if self.done: return self.written
+        if self._state == "signature": raise ValueError("不是 PNG 文件")
+        if self._state == "header" and not self._buf: raise ValueError("PNG 缺少 IEND 块")
+        raise ValueError("PNG 数据不完整")
+
+def write_png_with_metadata(src, dst, metadata, chunk_type=None):
+    """
+    按块把 PNG 写到 dst (逻辑见 PngMetadataWriter)，不会拼接出整张图的副本
+    :param src: PNG 字节 (bytes / bytearray / memoryview) 或已打开的二进制文件
+    :param dst: 可写的二进制文件 (含 io.BytesIO)
+    :param chunk_type: 见 build_metadata_chunk
+    :return: 写入的字节数；不是 PNG / 块结构损坏时抛出 ValueError
+    """
+    writer = PngMetadataWriter(metadata, chunk_type)
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        for piece in writer.feed(src): dst.write(piece)
+    else:
+        while not writer.done:
+            block = src.read(PNG_COPY_BLOCK_SIZE)
+            if not block: break
+            for piece in writer.feed(block): dst.write(piece)
+    return writer.finish()
+
 def add_metadata_to_png(image_bytes, metadata):
     try:
         png_signature = b'\x89PNG\r\n\x1a\n'
@@ -264,38 +696,47 @@ def add_metadata_to_png(image_bytes, metadata):
                 # 不是PNG且没有PIL，无法注入元数据
                 return image_bytes
 
-        # 2. 准备元数据
-        metadata_payload = {
-            "source": "ZhaishengyuanAI",
-            "data": metadata
-        }
-        metadata_json = json.dumps(metadata_payload, ensure_ascii=False)
-        keyword = "zsyAI"
-        text_data = f"{keyword}\x00{metadata_json}"
-        chunk_type = b'tEXt'
-        chunk_data = text_data.encode('utf-8')
-        chunk_length = struct.pack('>I', len(chunk_data))
-        chunk_crc = struct.pack('>I', zlib.crc32(chunk_type + chunk_data) & 0xffffffff)
-        
-        # 3. 寻找 IEND 块并插入元数据
-        iend_pos = image_bytes.rfind(b'IEND')
-        if iend_pos == -1:
-            return image_bytes
-
-        new_image_data = (
-            image_bytes[:iend_pos-4] + 
-            chunk_length +
-            chunk_type +
-            chunk_data +
-            chunk_crc +
-            image_bytes[iend_pos-4:] 
-        )
-        return new_image_data
+        # 2. 按块写出，元数据插在第一个 IDAT 之前 (不再用 rfind 找 IEND，压缩数据里也可能出现这四个字节)
+        out = io.BytesIO()
+        write_png_with_metadata(image_bytes, out, metadata)
+        return out.getvalue()
     except Exception as e:
         print(f"Error adding metadata: {e}")
         return image_bytes
 
+def _decode_text_chunk(chunk_type, chunk_data):
+    """解析 tEXt / zTXt / iTXt 块，返回 (关键字, 文本)；无法解析时返回 (None, None)"""
+    keyword, sep, rest = chunk_data.partition(b'\x00')
+    if not sep: return None, None
+    keyword = keyword.decode('latin-1')
+    if chunk_type == b'tEXt':
+        return keyword, rest.decode('utf-8', errors='ignore')
+    if chunk_type == b'zTXt':
+        # 压缩方式 (1 字节) + zlib 数据
+        if len(rest) < 2: return None, None
+        return keyword, zlib.decompress(rest[1:]).decode('utf-8')
+    # iTXt: 压缩标志 (1) + 压缩方式 (1) + 语言标签\0 + 翻译后的关键字\0 + 文本 (UTF-8)
+    if len(rest) < 2: return None, None
+    compressed = rest[0] == 1
+    _, _, rest = rest[2:].partition(b'\x00')
+    _, _, text = rest.partition(b'\x00')
+    if compressed: text = zlib.decompress(text)
+    return keyword, text.decode('utf-8')
+
+def _parse_metadata_chunk(chunk_type, chunk_data):
+    """文本块中是本程序写入的元数据时返回它，否则返回 None"""
+    try:
+        keyword, text = _decode_text_chunk(chunk_type, chunk_data)
+        if keyword not in METADATA_KEYWORDS or text is None: return None
+        metadata = json.loads(text)
+        if isinstance(metadata, dict) and 'data' in metadata:
+            return metadata['data']
+        return metadata
+    except Exception:
+        return None
+
 def extract_metadata_from_png(image_bytes):
+    """从内存中的 PNG 字节读取元数据 (已有整张图字节时使用；读文件请用 read_metadata_from_file)"""
     try:
         offset = 8 
         while offset < len(image_bytes):
@@ -305,35 +746,10 @@ def extract_metadata_from_png(image_bytes):
             
             if offset + 12 + chunk_length > len(image_bytes): break
             
-            chunk_data_start = offset + 8
-            chunk_data_end = chunk_data_start + chunk_length
-            chunk_data = image_bytes[chunk_data_start:chunk_data_end]
-            
-            if chunk_type in [b'tEXt', b'zTXt']:
-                try:
-                    decoded_text = ""
-                    if chunk_type == b'zTXt':
-                        parts = chunk_data.split(b'\x00', 1)
-                        if len(parts) >= 2:
-                            if len(parts[1]) > 1:
-                                compressed_data = parts[1][1:]
-                                decoded_text = zlib.decompress(compressed_data).decode('utf-8')
-                    else:
-                        decoded_text = chunk_data.decode('utf-8', errors='ignore')
-                    
-                    if '\x00' in decoded_text:
-                        keyword, metadata_str = decoded_text.split('\x00', 1)
-                        if keyword in ["ZhaishengyuanAI", "zsyAI"]:
-                            try:
-                                metadata = json.loads(metadata_str)
-                                if isinstance(metadata, dict) and 'data' in metadata:
-                                    return metadata['data']
-                                else:
-                                    return metadata
-                            except json.JSONDecodeError:
-                                continue
-                except Exception:
-                    continue
+            if chunk_type in TEXT_CHUNK_TYPES:
+                chunk_data = image_bytes[offset+8:offset+8+chunk_length]
+                metadata = _parse_metadata_chunk(chunk_type, chunk_data)
+                if metadata is not None: return metadata
             
             if chunk_type == b'IEND':
                 break
@@ -343,6 +759,33 @@ def extract_metadata_from_png(image_bytes):
         print(f"Error extracting metadata: {e}")
         return None
 
+def read_metadata_from_file(path):
+    """
+    按块扫描 PNG 文件读取元数据：只读 8 字节的块头，IDAT 等图像数据直接 seek 跳过，
+    只有文本块 (tEXt / zTXt / iTXt) 才读入内容。几 MB 的图也只需要几次小读取。
+    非 PNG / 读取失败时返回 None
+    """
+    try:
+        # 不用缓冲：每次 seek 之后带缓冲的读取都会从磁盘读满一整块 (8 KB)
+        with open(path, "rb", buffering=0) as f:
+            if f.read(8) != PNG_SIGNATURE: return None
+            while True:
+                header = f.read(8)
+                if len(header) < 8: return None
+                chunk_length, chunk_type = struct.unpack('>I4s', header)
+                if chunk_type == b'IEND': return None
+                if chunk_type in TEXT_CHUNK_TYPES and chunk_length <= MAX_TEXT_CHUNK_SIZE:
+                    chunk_data = f.read(chunk_length)
+                    if len(chunk_data) < chunk_length: return None
+                    metadata = _parse_metadata_chunk(chunk_type, chunk_data)
+                    if metadata is not None: return metadata
+                    f.seek(4, os.SEEK_CUR) # CRC
+                else:
+                    f.seek(chunk_length + 4, os.SEEK_CUR)
+    except Exception as e:
+        print(f"Error reading metadata: {e}")
+        return None
+
 # ==========================================
 #      【I2I 专用工具函数】
 # ==========================================
@@ -384,10 +827,12 @@ async def upload_image_to_host(file_path):
 
     try:
         filename = os.path.basename(file_path)
-        with open(file_path, 'rb') as f:
-            files = {'files[]': (filename, f, 'image/png')}
-            # 使用 ungu.se 作为临时图床
-            res = await asyncio.to_thread(requests.post, "https://uguu.se/upload", files=files, timeout=60)
+        def read_file():
+            with open(file_path, 'rb') as f: return f.read()
+        file_bytes = await executors.run_disk(read_file)
+        files = {'files[]': (filename, file_bytes, 'image/png')}
+        # 使用 ungu.se 作为临时图床
+        res = await http_client.get_client().post("https://uguu.se/upload", files=files, timeout=60)
         if res.status_code == 200:
             data = res.json()
             if data.get('success'):
@@ -495,45 +940,24 @@ def safe_close_dialog(page, dlg):
 
 async def save_image_to_local_folder(page, url, target_folder, metadata=None):
     if not url: return False
-    # 如果 URL 已经是本地路径（缓存文件），直接复制
-    if os.path.exists(url) and os.path.isfile(url):
-        try:
-            timestamp = int(time.time())
-            filename = f"img_{timestamp}_{random.randint(100,999)}.png"
-            save_path = os.path.join(target_folder, filename)
-            shutil.copy2(url, save_path)
-            page.snack_bar = ft.SnackBar(ft.Text(f"✅ 图片已保存至: {save_path}"), open=True)
-            page.update()
-            return True
-        except Exception as e:
-            page.snack_bar = ft.SnackBar(ft.Text(f"保存错误: {str(e)}"), open=True)
-            page.update()
-            return False
-
+    # 保存目录同样按内容哈希归档，同一张图重复保存不会多占空间
+    store = content_store.get_store(target_folder)
     try:
-        res = await asyncio.to_thread(requests.get, url, timeout=30)
-        if res.status_code == 200:
-            image_bytes = res.content
-            # 尝试注入元数据 (内部会自动处理 JPG转PNG)
-            if metadata:
-                image_bytes = add_metadata_to_png(image_bytes, metadata)
-            
-            # 生成文件名
-            timestamp = int(time.time())
-            filename = f"img_{timestamp}_{random.randint(100,999)}.png"
-            save_path = os.path.join(target_folder, filename)
-            
-            # 写入文件
-            with open(save_path, "wb") as f:
-                f.write(image_bytes)
-            
-            page.snack_bar = ft.SnackBar(ft.Text(f"✅ 图片已保存至: {save_path}"), open=True)
-            page.update()
-            return True
+        if os.path.exists(url) and os.path.isfile(url):
+            # 如果 URL 已经是本地路径（缓存文件），直接复制
+            save_path, deduped = await executors.run_disk(store.put_file, url)
         else:
-            page.snack_bar = ft.SnackBar(ft.Text("下载失败: 网络错误"), open=True)
-            page.update()
-            return False
+            # 流式下载并注入元数据 (内部会自动处理 JPG转PNG)
+            save_path, deduped = await download_image_to_store(url, store, metadata)
+            if not save_path:
+                page.snack_bar = ft.SnackBar(ft.Text("下载失败: 网络错误"), open=True)
+                page.update()
+                return False
+
+        tip = "图片已存在" if deduped else "图片已保存至"
+        page.snack_bar = ft.SnackBar(ft.Text(f"✅ {tip}: {save_path}"), open=True)
+        page.update()
+        return True
     except Exception as err:
         page.snack_bar = ft.SnackBar(ft.Text(f"保存错误: {str(err)}"), open=True)
         page.update()
@@ -546,8 +970,7 @@ async def download_via_local_server(page, url, metadata=None):
     image_bytes = None
     if os.path.exists(url) and os.path.isfile(url):
         try:
-            with open(url, "rb") as f:
-                image_bytes = f.read()
+            image_bytes = await executors.run_disk(_read_bytes, url)
         except Exception as e:
             page.snack_bar = ft.SnackBar(ft.Text(f"读取本地缓存失败: {e}"), open=True)
             page.update()
@@ -559,14 +982,14 @@ async def download_via_local_server(page, url, metadata=None):
             page.update()
             
             # 1. 先下载图片到内存
-            res = await asyncio.to_thread(requests.get, url, timeout=30)
+            res = await http_client.get_client().get(url, timeout=30)
             if res.status_code != 200:
                 raise Exception("图片下载失败")
                 
             image_bytes = res.content
             # 尝试注入元数据 (内部会自动处理 JPG转PNG)
             if metadata:
-                image_bytes = add_metadata_to_png(image_bytes, metadata)
+                image_bytes = await executors.run_cpu(add_metadata_to_png, image_bytes, metadata)
         except Exception as err:
             page.snack_bar = ft.SnackBar(ft.Text(f"处理失败: {str(err)}"), open=True)
             page.update()
@@ -589,6 +1012,9 @@ async def download_via_local_server(page, url, metadata=None):
         page.update()
         return False
 
+def _read_bytes(path):
+    with open(path, "rb") as f: return f.read()
+
 async def save_temp_image_from_url(url):
     """
     (新增) 将 URL 图片下载并保存为临时文件，返回本地绝对路径
@@ -601,22 +1027,10 @@ async def save_temp_image_from_url(url):
         return os.path.abspath(url)
         
     try:
-        # 定义临时目录
+        # 临时目录 (按内容哈希归档，同一张图多次传递只下载保存一份)
         temp_dir = os.path.join(os.getcwd(), TEMP_TRANSFER_FOLDER)
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
-            
-        # 下载
-        res = await asyncio.to_thread(requests.get, url, timeout=30)
-        if res.status_code == 200:
-            filename = f"transfer_{int(time.time())}_{random.randint(100,999)}.png"
-            save_path = os.path.join(temp_dir, filename)
-            
-            with open(save_path, "wb") as f:
-                f.write(res.content)
-                
-            return os.path.abspath(save_path)
-        return None
+        save_path, _ = await download_image_to_store(url, content_store.get_store(temp_dir))
+        return save_path
     except Exception as e:
         print(f"Temp save error: {e}")
         return None
@@ -636,14 +1050,23 @@ async def load_global_config(page):
         stored_custom_models = await page.client_storage.get_async("custom_models") or ""
         
         # 读取强力模式配置
-        # 结构: {"enabled": bool, "batch_size": int, "selected_keys": [list], "daily_limit": int, "request_delay": float}
+        # 结构: {"enabled": bool, "batch_size": int, "selected_keys": [list], "daily_limit": int, "rate_qps": float, "rate_burst": int}
         stored_power_config = await page.client_storage.get_async("power_mode_config")
+        # 连接池配置
+        stored_http_pool_config = await page.client_storage.get_async("http_pool_config")
+        # 执行器配置 (各池大小 / 图片编解码是否用进程池)
+        stored_executor_config = await page.client_storage.get_async("executor_config")
+        # 会话缓存配置
+        stored_session_cache_config = await page.client_storage.get_async("session_cache_config")
     except Exception as e:
         print(f"Error reading storage: {e}")
         stored_api_keys_str, stored_baidu_config = "", ""
         stored_color_name, stored_mode = "Gold", "dark"
         stored_custom_models = ""
         stored_power_config = None
+        stored_http_pool_config = None
+        stored_executor_config = None
+        stored_session_cache_config = None
 
     current_api_keys = [k.strip() for k in stored_api_keys_str.split('\n') if k.strip()]
     
@@ -658,16 +1081,38 @@ async def load_global_config(page):
             "batch_size": 10,
             "selected_keys": [], # 默认空列表，逻辑上视为空时使用全部Keys
             "daily_limit": 200,
-            "request_delay": 0.2  # 新增：默认每次请求间隔 0.2秒
+            "rate_qps": 2.0,  # 每个 Key 每秒可提交的任务数
+            "rate_burst": 3,  # 每个 Key 允许的瞬时突发数
+            "stream_enabled": False, # 流式超大批量 (不受 50 张上限限制)
+            "stream_total": 200,     # 流式批量的总张数
+            "stream_window": 10,     # 流式批量同时在途的任务数
+            "result_cache_enabled": True, # 相同请求体直接复用本地结果，不调用 API
+            "result_cache_mb": 1024       # 结果缓存大小上限 (MB)
         }
 
+    # 连接池默认值 (缺失的字段用默认值补齐)
+    http_pool_config = dict(http_client.DEFAULT_POOL_CONFIG)
+    if isinstance(stored_http_pool_config, dict):
+        http_pool_config.update({k: v for k, v in stored_http_pool_config.items() if k in http_pool_config})
+
+    executor_config = dict(executors.DEFAULT_EXECUTOR_CONFIG)
+    if isinstance(stored_executor_config, dict):
+        executor_config.update({k: v for k, v in stored_executor_config.items() if k in executor_config})
+
+    session_cache_config = dict(DEFAULT_SESSION_CACHE_CONFIG)
+    if isinstance(stored_session_cache_config, dict):
+        session_cache_config.update({k: v for k, v in stored_session_cache_config.items() if k in session_cache_config})
+
     return {
         "api_keys": current_api_keys,
         "baidu_config": {"appid": current_baidu_appid, "key": current_baidu_key},
         "theme_color_name": stored_color_name,
         "theme_mode": stored_mode,
         "custom_models": stored_custom_models,
-        "power_mode_config": stored_power_config
+        "power_mode_config": stored_power_config,
+        "http_pool_config": http_pool_config,
+        "executor_config": executor_config,
+        "session_cache_config": session_cache_config
     }
 
 async def save_config_to_storage(page, key, value):